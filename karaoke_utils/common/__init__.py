@@ -0,0 +1 @@
+"""Modules shared by the download_mp3 and karaoke_driver services."""
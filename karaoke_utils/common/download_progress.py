@@ -0,0 +1,94 @@
+"""Live progress and throughput accounting for in-process yt-dlp downloads."""
+import threading
+import time
+from contextlib import contextmanager
+from dataclasses import dataclass
+from typing import Callable, Iterator, Optional
+
+ProgressHook = Callable[[dict], None]
+
+
+@dataclass
+class DownloadProgress:
+    downloaded_bytes: int
+    total_bytes: Optional[int]          # None when yt-dlp cannot tell, e.g. some live or HLS streams
+    speed: Optional[float]              # bytes per second
+    eta_seconds: Optional[float]
+
+    @property
+    def fraction(self) -> Optional[float]:
+        if not self.total_bytes:
+            return None
+        return min(self.downloaded_bytes / self.total_bytes, 1.0)
+
+
+class DownloadMeter:
+    """Turns yt-dlp progress hook calls into DownloadProgress reports and service-wide totals.
+
+    Reports for a download are throttled to one per report_interval seconds
+    (plus one when each file finishes), so callers can persist them freely.
+    """
+
+    def __init__(self, report_interval: float = 0.5):
+        self.report_interval = report_interval
+        self._lock = threading.Lock()
+        self._speeds: dict[str, float] = {}
+        self.files = 0
+        self.bytes = 0
+        self.seconds = 0.0
+
+    @contextmanager
+    def track(self, key: str, on_progress: Callable[[DownloadProgress], None]) -> Iterator[ProgressHook]:
+        """Yield a progress hook for one download; key identifies it among concurrent downloads."""
+        last_report = 0.0
+
+        def hook(d: dict) -> None:
+            nonlocal last_report
+            status = d.get("status")
+            if status == "downloading":
+                with self._lock:
+                    self._speeds[key] = d.get("speed") or 0.0
+                now = time.monotonic()
+                if now - last_report < self.report_interval:
+                    return
+                last_report = now
+                on_progress(DownloadProgress(
+                    downloaded_bytes=d.get("downloaded_bytes") or 0,
+                    total_bytes=d.get("total_bytes") or d.get("total_bytes_estimate"),
+                    speed=d.get("speed"),
+                    eta_seconds=d.get("eta"),
+                ))
+            elif status == "finished":
+                size = d.get("total_bytes") or d.get("downloaded_bytes") or 0
+                elapsed = d.get("elapsed") or 0.0
+                with self._lock:
+                    self._speeds.pop(key, None)
+                    self.files += 1
+                    self.bytes += size
+                    self.seconds += elapsed
+                on_progress(DownloadProgress(
+                    downloaded_bytes=size,
+                    total_bytes=size,
+                    speed=size / elapsed if elapsed else None,
+                    eta_seconds=0.0,
+                ))
+
+        try:
+            yield hook
+        finally:
+            with self._lock:
+                self._speeds.pop(key, None)
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            return {
+                "files": self.files,
+                "bytes": self.bytes,
+                "seconds": round(self.seconds, 3),
+                "average_bytes_per_second": self.bytes / self.seconds if self.seconds else None,
+                "active": len(self._speeds),
+                "current_bytes_per_second": sum(self._speeds.values()),
+            }
+
+
+meter = DownloadMeter()
@@ -0,0 +1,143 @@
+"""Range-aware, conditional-GET-capable file responses for job artifacts."""
+import os
+import re
+import stat
+from email.utils import formatdate
+from typing import Optional
+
+import anyio
+from starlette.datastructures import Headers
+from starlette.responses import FileResponse
+from starlette.types import Receive, Scope, Send
+
+_RANGE_RE = re.compile(r"bytes=(\d*)-(\d*)")
+
+
+class RangeNotSatisfiable(Exception):
+    pass
+
+
+def parse_range(header: str, size: int) -> Optional[tuple[int, int]]:
+    """Inclusive (first, last) byte positions of a single-range Range header.
+
+    Returns None when the header should be ignored and the whole file served:
+    it is malformed or asks for several ranges, which players never need.
+    Raises RangeNotSatisfiable when the range lies outside the file.
+    """
+    match = _RANGE_RE.fullmatch(header.strip())
+    if not match or match.group(1) == match.group(2) == "":
+        return None
+    first, last = match.groups()
+    if first == "":
+        # Suffix range: the last n bytes
+        length = int(last)
+        if length == 0 or size == 0:
+            raise RangeNotSatisfiable(header)
+        return max(size - length, 0), size - 1
+    start = int(first)
+    if last and int(last) < start:
+        return None
+    if start >= size:
+        raise RangeNotSatisfiable(header)
+    return start, min(int(last), size - 1) if last else size - 1
+
+
+def _etag_matches(header: str, etag: str) -> bool:
+    # If-None-Match uses weak comparison, so W/ prefixes are ignored
+    tags = [tag.strip().removeprefix("W/") for tag in header.split(",")]
+    return "*" in tags or etag in tags
+
+
+class ArtifactResponse(FileResponse):
+    """FileResponse that answers Range, If-Range and If-None-Match.
+
+    The body goes out through the ASGI zero-copy extensions when the server
+    offers them (zerocopysend for any range, pathsend for a whole file) and
+    as chunked reads otherwise.
+    """
+
+    chunk_size = 256 * 1024
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        try:
+            stat_result = await anyio.to_thread.run_sync(os.stat, self.path)
+        except FileNotFoundError:
+            raise RuntimeError(f"File at path {self.path} does not exist.")
+        if not stat.S_ISREG(stat_result.st_mode):
+            raise RuntimeError(f"File at path {self.path} is not a file.")
+        self.set_stat_headers(stat_result)
+        self.headers["accept-ranges"] = "bytes"
+
+        request_headers = Headers(scope=scope)
+        etag = self.headers["etag"]
+        size = stat_result.st_size
+        if_none_match = request_headers.get("if-none-match")
+        if if_none_match and _etag_matches(if_none_match, etag):
+            await self._send_headers_only(send, 304, drop=("content-length", "content-type", "content-disposition"))
+            return
+
+        byte_range = None
+        range_header = request_headers.get("range")
+        if range_header and self._if_range_holds(request_headers.get("if-range"), stat_result):
+            try:
+                byte_range = parse_range(range_header, size)
+            except RangeNotSatisfiable:
+                self.headers["content-range"] = f"bytes */{size}"
+                self.headers["content-length"] = "0"
+                await self._send_headers_only(send, 416, drop=("content-disposition",))
+                return
+
+        start, count = 0, size
+        if byte_range:
+            start, count = byte_range[0], byte_range[1] - byte_range[0] + 1
+            self.status_code = 206
+            self.headers["content-range"] = f"bytes {byte_range[0]}-{byte_range[1]}/{size}"
+            self.headers["content-length"] = str(count)
+
+        await send({"type": "http.response.start", "status": self.status_code, "headers": self.raw_headers})
+        if scope["method"].upper() == "HEAD":
+            await send({"type": "http.response.body", "body": b"", "more_body": False})
+        else:
+            await self._send_body(scope, send, start, count, whole=not byte_range)
+        if self.background is not None:
+            await self.background()
+
+    def _if_range_holds(self, if_range: Optional[str], stat_result: os.stat_result) -> bool:
+        # A Range is only honoured against the representation the client already has part of
+        if not if_range:
+            return True
+        if if_range.startswith('"'):
+            return if_range == self.headers["etag"]
+        return if_range == formatdate(stat_result.st_mtime, usegmt=True)
+
+    async def _send_headers_only(self, send: Send, status: int, drop: tuple[str, ...]) -> None:
+        for name in drop:
+            if name in self.headers:
+                del self.headers[name]
+        await send({"type": "http.response.start", "status": status, "headers": self.raw_headers})
+        await send({"type": "http.response.body", "body": b"", "more_body": False})
+
+    async def _send_body(self, scope: Scope, send: Send, start: int, count: int, whole: bool) -> None:
+        extensions = scope.get("extensions") or {}
+        if "http.response.zerocopysend" in extensions:
+            with open(self.path, "rb") as file:
+                await send({
+                    "type": "http.response.zerocopysend",
+                    "file": file.fileno(),
+                    "offset": start,
+                    "count": count,
+                    "more_body": False,
+                })
+        elif whole and "http.response.pathsend" in extensions:
+            await send({"type": "http.response.pathsend", "path": str(self.path)})
+        else:
+            async with await anyio.open_file(self.path, mode="rb") as file:
+                await file.seek(start)
+                remaining = count
+                while True:
+                    chunk = await file.read(min(self.chunk_size, remaining))
+                    remaining -= len(chunk)
+                    more_body = bool(chunk) and remaining > 0
+                    await send({"type": "http.response.body", "body": chunk, "more_body": more_body})
+                    if not more_body:
+                        break
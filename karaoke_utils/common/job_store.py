@@ -0,0 +1,271 @@
+"""Durable job records with TTL-based cleanup."""
+import dataclasses
+import json
+import logging
+import os
+import re
+import shutil
+import sqlite3
+import tempfile
+import threading
+import time
+from dataclasses import dataclass, field
+from enum import Enum
+from typing import Optional
+
+logger = logging.getLogger(__name__)
+
+
+class JobStatus(str, Enum):
+    # Karaoke jobs go queued → downloading → extracting → separating → encoding → done;
+    # MP3 downloads go queued → downloading → encoding (yt-dlp's audio post-processing) → done
+    QUEUED = "queued"
+    DOWNLOADING = "downloading"
+    EXTRACTING = "extracting"
+    SEPARATING = "separating"
+    ENCODING = "encoding"
+    DONE = "done"
+    ERROR = "error"
+
+
+FINISHED = {JobStatus.DONE, JobStatus.ERROR}
+
+
+@dataclass
+class Job:
+    job_id: str
+    status: JobStatus = JobStatus.QUEUED
+    progress_message: str = "Job queued"
+    title: str = ""
+    progress: Optional[float] = None       # fraction of the current stage done, 0.0–1.0
+    eta_seconds: Optional[float] = None
+    downloaded_bytes: Optional[int] = None  # these three are set while a download runs
+    total_bytes: Optional[int] = None
+    speed: Optional[float] = None          # bytes per second
+    output_path: Optional[str] = None
+    work_dir: Optional[str] = None         # deleted together with the job
+    batch_id: Optional[str] = None         # the batch job this one was started for
+    error: Optional[str] = None
+    created_at: float = field(default_factory=time.time)
+    expires_at: Optional[float] = None     # set once the job is finished
+
+
+def _job_from_json(data: str) -> Job:
+    values = json.loads(data)
+    known = {f.name for f in dataclasses.fields(Job)}
+    job = Job(**{key: value for key, value in values.items() if key in known})
+    job.status = JobStatus(job.status)
+    return job
+
+
+def _dir_size(path: str) -> int:
+    total = 0
+    for root, _, files in os.walk(path):
+        for name in files:
+            try:
+                total += os.lstat(os.path.join(root, name)).st_size
+            except OSError:
+                pass
+    return total
+
+
+class JobStore:
+    """Job records kept in memory and written through to SQLite.
+
+    Jobs survive restarts; ones that were still running are marked as failed.
+    Finished jobs expire ttl_seconds after they finish, and reap() deletes
+    expired jobs together with their work_dir once no other job shares it.
+    Jobs started for a batch are kept as long as the batch job is, and go
+    with it.
+    It also evicts the oldest finished jobs while their work dirs use more
+    than max_disk_bytes, and removes stale tempfile.mkdtemp(prefix=orphan_prefix)
+    dirs that no job refers to.
+    """
+
+    def __init__(
+        self,
+        db_path: str = ":memory:",
+        ttl_seconds: float = 24 * 3600,
+        max_disk_bytes: int = 0,
+        orphan_prefix: Optional[str] = None,
+        done_message: str = "Done",
+    ):
+        self.ttl_seconds = ttl_seconds
+        self.done_message = done_message
+        self.max_disk_bytes = max_disk_bytes
+        self.orphan_prefix = orphan_prefix
+        self._lock = threading.Lock()
+        self._jobs: dict[str, Job] = {}
+        self._db = sqlite3.connect(db_path, check_same_thread=False)
+        if db_path != ":memory:":
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.execute("CREATE TABLE IF NOT EXISTS jobs (job_id TEXT PRIMARY KEY, data TEXT NOT NULL)")
+        self._load()
+
+    def _load(self) -> None:
+        interrupted = 0
+        for (data,) in self._db.execute("SELECT data FROM jobs").fetchall():
+            job = _job_from_json(data)
+            if job.status not in FINISHED:
+                job.status = JobStatus.ERROR
+                job.progress_message = "Processing failed"
+                job.error = "Interrupted by a service restart"
+                job.expires_at = time.time() + self.ttl_seconds
+                self._save(job)
+                interrupted += 1
+            self._jobs[job.job_id] = job
+        self._db.commit()
+        if self._jobs:
+            logger.info("Loaded %d jobs (%d interrupted by restart)", len(self._jobs), interrupted)
+
+    def _save(self, job: Job) -> None:
+        # Caller holds _lock (or is the constructor) and commits
+        self._db.execute(
+            "INSERT OR REPLACE INTO jobs (job_id, data) VALUES (?, ?)",
+            (job.job_id, json.dumps(dataclasses.asdict(job))),
+        )
+
+    def create(self, job_id: str, work_dir: Optional[str] = None, batch_id: Optional[str] = None) -> Job:
+        job = Job(job_id=job_id, work_dir=work_dir, batch_id=batch_id)
+        with self._lock:
+            self._jobs[job_id] = job
+            self._save(job)
+            self._db.commit()
+        return job
+
+    def get(self, job_id: str) -> Optional[Job]:
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def members(self, batch_id: str) -> list[Job]:
+        """Jobs started for batch_id, oldest first."""
+        with self._lock:
+            jobs = [job for job in self._jobs.values() if job.batch_id == batch_id]
+        return sorted(jobs, key=lambda job: job.created_at)
+
+    def delete(self, job_id: str) -> None:
+        with self._lock:
+            self._jobs.pop(job_id, None)
+            self._db.execute("DELETE FROM jobs WHERE job_id = ?", (job_id,))
+            self._db.commit()
+
+    def update(self, job_id: str, **kwargs) -> None:
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job:
+                for key, value in kwargs.items():
+                    setattr(job, key, value)
+                self._save(job)
+                self._db.commit()
+
+    def set_done(self, job_id: str, output_path: str, message: Optional[str] = None) -> None:
+        self.update(
+            job_id,
+            status=JobStatus.DONE,
+            progress_message=message or self.done_message,
+            progress=1.0,
+            eta_seconds=0.0,
+            output_path=output_path,
+            expires_at=time.time() + self.ttl_seconds,
+        )
+
+    def set_error(self, job_id: str, error: str) -> None:
+        self.update(
+            job_id,
+            status=JobStatus.ERROR,
+            progress_message="Processing failed",
+            error=error,
+            expires_at=time.time() + self.ttl_seconds,
+        )
+
+    def reap(self) -> int:
+        """Delete expired jobs, then the oldest finished ones while over the disk cap. Returns jobs removed."""
+        now = time.time()
+        with self._lock:
+            jobs = list(self._jobs.values())
+
+        # Batch members are only reaped together with their batch
+        ids = {job.job_id for job in jobs}
+        members: dict[str, list[Job]] = {}
+        for job in jobs:
+            if job.batch_id in ids and job.status in FINISHED:
+                members.setdefault(job.batch_id, []).append(job)
+
+        def with_members(job: Job) -> list[Job]:
+            return [job, *members.get(job.job_id, ())]
+
+        finished = sorted(
+            (job for job in jobs if job.status in FINISHED and job.batch_id not in ids),
+            key=lambda job: job.expires_at or 0.0,
+        )
+        expired = [job for job in finished if job.expires_at is not None and job.expires_at <= now]
+        victims = [victim for job in expired for victim in with_members(job)]
+        if self.max_disk_bytes:
+            # A shared work dir counts once and frees space only when its last job goes
+            users: dict[str, int] = {}
+            for job in jobs:
+                if job.work_dir:
+                    users[job.work_dir] = users.get(job.work_dir, 0) + 1
+            sizes = {path: _dir_size(path) for path in users}
+            total = sum(sizes.values())
+
+            def release(job: Job) -> int:
+                if not job.work_dir:
+                    return 0
+                users[job.work_dir] -= 1
+                return sizes[job.work_dir] if not users[job.work_dir] else 0
+
+            for job in victims:
+                total -= release(job)
+            for job in finished[len(expired):]:
+                if total <= self.max_disk_bytes:
+                    break
+                for victim in with_members(job):
+                    victims.append(victim)
+                    total -= release(victim)
+
+        with self._lock:
+            for job in victims:
+                self._jobs.pop(job.job_id, None)
+                self._db.execute("DELETE FROM jobs WHERE job_id = ?", (job.job_id,))
+            self._db.commit()
+            known_dirs = {job.work_dir for job in self._jobs.values() if job.work_dir}
+
+        # Work dirs still shared with a surviving job stay until that job goes too
+        for work_dir in {job.work_dir for job in victims if job.work_dir} - known_dirs:
+            shutil.rmtree(work_dir, ignore_errors=True)
+        self._reap_orphans(known_dirs, now)
+        if victims:
+            logger.info("Reaped %d jobs", len(victims))
+        return len(victims)
+
+    def _reap_orphans(self, known_dirs: set[str], now: float) -> None:
+        if not self.orphan_prefix:
+            return
+        # mkdtemp appends 8 random characters; anything else (e.g. a cache dir) is left alone
+        pattern = re.compile(re.escape(self.orphan_prefix) + r"[a-z0-9_]{8}")
+        for entry in os.scandir(tempfile.gettempdir()):
+            if not pattern.fullmatch(entry.name) or entry.path in known_dirs:
+                continue
+            try:
+                stale = entry.is_dir(follow_symlinks=False) and entry.stat().st_mtime < now - self.ttl_seconds
+            except OSError:
+                continue
+            if stale:
+                shutil.rmtree(entry.path, ignore_errors=True)
+                logger.info("Removed orphaned work dir %s", entry.path)
+
+    def start_reaper(self, interval_seconds: float = 300) -> threading.Thread:
+        def loop() -> None:
+            while True:
+                try:
+                    self.reap()
+                except Exception:
+                    logger.exception("Job reaper failed")
+                time.sleep(interval_seconds)
+
+        thread = threading.Thread(target=loop, name="job-reaper", daemon=True)
+        thread.start()
+        return thread
+
@@ -0,0 +1,158 @@
+"""Staged worker pools with a bounded queue."""
+import logging
+import threading
+from collections import deque
+from typing import Callable, Optional, Sequence
+
+logger = logging.getLogger(__name__)
+
+Step = tuple[str, Callable]
+
+
+class QueueFull(Exception):
+    """Raised when a job is submitted while the queue is at its depth limit."""
+
+
+class WorkerPool:
+    """Runs tasks on a fixed number of worker threads, in FIFO order."""
+
+    def __init__(self, name: str, workers: int, on_take: Optional[Callable[[], None]] = None):
+        self.name = name
+        self.workers = workers
+        self._on_take = on_take  # called whenever a worker takes a task, i.e. a waiting slot frees up
+        self._cond = threading.Condition()
+        self._pending: deque[tuple[str, Callable]] = deque()
+        self._threads: list[threading.Thread] = []
+
+    def _start(self) -> None:
+        # Called with _cond held; threads are started on first use so importing is side-effect free
+        if self._threads:
+            return
+        for i in range(self.workers):
+            thread = threading.Thread(target=self._worker, name=f"{self.name}-worker-{i}", daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    def submit(self, job_id: str, task: Callable[[], None]) -> None:
+        with self._cond:
+            self._start()
+            self._pending.append((job_id, task))
+            self._cond.notify()
+
+    def position(self, job_id: str) -> Optional[int]:
+        """1-based position of job_id among the waiting tasks, or None if it is not waiting here."""
+        with self._cond:
+            for i, (pending_id, _) in enumerate(self._pending, start=1):
+                if pending_id == job_id:
+                    return i
+        return None
+
+    @property
+    def depth(self) -> int:
+        with self._cond:
+            return len(self._pending)
+
+    def _worker(self) -> None:
+        while True:
+            with self._cond:
+                while not self._pending:
+                    self._cond.wait()
+                job_id, task = self._pending.popleft()
+            if self._on_take:
+                self._on_take()  # outside _cond: the callback may submit to this pool
+            try:
+                task()
+            except Exception:
+                logger.exception("Job %s crashed a %s worker task", job_id, self.name)
+
+
+class JobScheduler:
+    """Moves each job through a sequence of stages, each with its own worker pool.
+
+    Stages are independent, so while one job holds the separation workers the
+    next one can already be downloading. Admission control counts the jobs
+    waiting in any stage; jobs fed in bulk past that limit wait in a backlog
+    and are admitted one by one as workers free up waiting slots.
+    """
+
+    def __init__(self, stages: dict[str, int], max_queue: int):
+        self.max_queue = max_queue
+        self.pools = {
+            name: WorkerPool(name, workers, on_take=self._admit_backlog) for name, workers in stages.items()
+        }
+        self._lock = threading.Lock()
+        self._backlog: deque[tuple[str, list[Step], tuple, Callable]] = deque()
+
+    @property
+    def depth(self) -> int:
+        return sum(pool.depth for pool in self.pools.values())
+
+    def submit(
+        self,
+        job_id: str,
+        steps: Sequence[Step],
+        *args,
+        on_error: Callable[[str, Exception], None],
+    ) -> None:
+        """Run each (stage, fn) step as fn(job_id, *args) on that stage's pool, in order.
+
+        If a step raises, on_error(job_id, exc) is called and the remaining steps are skipped.
+        """
+        with self._lock:
+            if self.depth >= self.max_queue:
+                raise QueueFull(f"{self.depth} jobs already waiting")
+            self._enqueue(job_id, list(steps), args, on_error)
+
+    def feed(
+        self,
+        jobs: Sequence[tuple[str, tuple]],
+        steps: Sequence[Step],
+        *,
+        on_error: Callable[[str, Exception], None],
+    ) -> None:
+        """submit() for several (job_id, args) without ever raising QueueFull.
+
+        Jobs are admitted in order while the queue has room; the rest wait in
+        the backlog and are admitted, still in order, as waiting slots free up.
+        """
+        with self._lock:
+            self._backlog.extend((job_id, list(steps), args, on_error) for job_id, args in jobs)
+            self._drain_backlog()
+
+    def _admit_backlog(self) -> None:
+        with self._lock:
+            self._drain_backlog()
+
+    def _drain_backlog(self) -> None:
+        # Called with _lock held
+        while self._backlog and self.depth < self.max_queue:
+            self._enqueue(*self._backlog.popleft())
+
+    def _enqueue(self, job_id: str, steps: list[Step], args: tuple, on_error) -> None:
+        stage, fn = steps[0]
+
+        def task() -> None:
+            try:
+                fn(job_id, *args)
+            except Exception as exc:
+                on_error(job_id, exc)
+                return
+            if len(steps) > 1:
+                self._enqueue(job_id, steps[1:], args, on_error)
+
+        self.pools[stage].submit(job_id, task)
+
+    def position(self, job_id: str) -> Optional[tuple[str, int]]:
+        """(stage, 1-based position) if job_id is waiting for a worker, else None."""
+        for name, pool in self.pools.items():
+            position = pool.position(job_id)
+            if position is not None:
+                return name, position
+        with self._lock:
+            for i, (backlog_id, steps, _, _) in enumerate(self._backlog, start=1):
+                if backlog_id == job_id:
+                    # Backlogged jobs start behind everything already waiting at their first stage
+                    stage = steps[0][0]
+                    return stage, self.pools[stage].depth + i
+        return None
+
@@ -0,0 +1,53 @@
+"""Tests for yt-dlp progress reporting and throughput accounting."""
+from common.download_progress import DownloadMeter
+
+
+def test_reports_are_throttled_and_final_report_always_sent(monkeypatch):
+    now = [0.0]
+    monkeypatch.setattr("common.download_progress.time.monotonic", lambda: now[0])
+    meter = DownloadMeter(report_interval=1.0)
+    reports = []
+
+    with meter.track("job", reports.append) as hook:
+        now[0] = 10.0
+        hook({"status": "downloading", "downloaded_bytes": 100, "total_bytes": 400, "speed": 50.0, "eta": 6})
+        hook({"status": "downloading", "downloaded_bytes": 200, "total_bytes": 400, "speed": 50.0, "eta": 4})
+        assert meter.snapshot()["active"] == 1
+        assert meter.snapshot()["current_bytes_per_second"] == 50.0
+        hook({"status": "finished", "total_bytes": 400, "elapsed": 8.0})
+
+    assert len(reports) == 2
+    assert reports[0].fraction == 0.25
+    assert reports[0].eta_seconds == 6
+    assert reports[1].fraction == 1.0
+    assert reports[1].speed == 50.0
+    assert meter.snapshot() == {
+        "files": 1,
+        "bytes": 400,
+        "seconds": 8.0,
+        "average_bytes_per_second": 50.0,
+        "active": 0,
+        "current_bytes_per_second": 0,
+    }
+
+
+def test_estimated_and_unknown_sizes():
+    meter = DownloadMeter(report_interval=0)
+    reports = []
+    with meter.track("job", reports.append) as hook:
+        hook({"status": "downloading", "downloaded_bytes": 10, "total_bytes_estimate": 40})
+        hook({"status": "downloading", "downloaded_bytes": 20})
+    assert reports[0].fraction == 0.25
+    assert reports[1].fraction is None
+
+
+def test_failed_download_is_no_longer_active():
+    meter = DownloadMeter()
+    try:
+        with meter.track("job", lambda progress: None) as hook:
+            hook({"status": "downloading", "downloaded_bytes": 1, "speed": 10.0})
+            raise RuntimeError("network down")
+    except RuntimeError:
+        pass
+    assert meter.snapshot()["active"] == 0
+    assert meter.snapshot()["files"] == 0
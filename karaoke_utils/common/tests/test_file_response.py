@@ -0,0 +1,87 @@
+"""Tests for range and conditional requests against job artifacts."""
+import pytest
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+from common.file_response import ArtifactResponse, RangeNotSatisfiable, parse_range
+
+BODY = bytes(range(256)) * 4  # 1024 bytes
+
+
+@pytest.fixture
+def client(tmp_path):
+    path = tmp_path / "final.mp4"
+    path.write_bytes(BODY)
+    app = FastAPI()
+
+    @app.api_route("/artifact", methods=["GET", "HEAD"])
+    def artifact():
+        return ArtifactResponse(path=str(path), media_type="video/mp4", filename="Song.mp4")
+
+    return TestClient(app)
+
+
+def test_parse_range():
+    assert parse_range("bytes=0-99", 1024) == (0, 99)
+    assert parse_range("bytes=1000-", 1024) == (1000, 1023)
+    assert parse_range("bytes=1000-5000", 1024) == (1000, 1023)
+    assert parse_range("bytes=-24", 1024) == (1000, 1023)
+    assert parse_range("bytes=-5000", 1024) == (0, 1023)
+    # Ignored: the whole file is served instead
+    assert parse_range("bytes=0-9, 20-29", 1024) is None
+    assert parse_range("bytes=9-0", 1024) is None
+    assert parse_range("items=0-9", 1024) is None
+    assert parse_range("bytes=-", 1024) is None
+    with pytest.raises(RangeNotSatisfiable):
+        parse_range("bytes=1024-", 1024)
+    with pytest.raises(RangeNotSatisfiable):
+        parse_range("bytes=-0", 1024)
+
+
+def test_full_response_advertises_ranges(client):
+    response = client.get("/artifact")
+    assert response.status_code == 200
+    assert response.content == BODY
+    assert response.headers["accept-ranges"] == "bytes"
+    assert response.headers["etag"]
+    assert "Song.mp4" in response.headers["content-disposition"]
+
+
+def test_range_request(client):
+    response = client.get("/artifact", headers={"Range": "bytes=100-199"})
+    assert response.status_code == 206
+    assert response.content == BODY[100:200]
+    assert response.headers["content-range"] == "bytes 100-199/1024"
+    assert response.headers["content-length"] == "100"
+
+
+def test_unsatisfiable_range(client):
+    response = client.get("/artifact", headers={"Range": "bytes=2000-"})
+    assert response.status_code == 416
+    assert response.headers["content-range"] == "bytes */1024"
+    assert response.content == b""
+
+
+def test_if_none_match(client):
+    etag = client.get("/artifact").headers["etag"]
+    response = client.get("/artifact", headers={"If-None-Match": f'"other", W/{etag}'})
+    assert response.status_code == 304
+    assert response.headers["etag"] == etag
+    assert response.content == b""
+
+
+def test_stale_if_range_gets_whole_file(client):
+    etag = client.get("/artifact").headers["etag"]
+    response = client.get("/artifact", headers={"Range": "bytes=0-9", "If-Range": etag})
+    assert response.status_code == 206
+
+    response = client.get("/artifact", headers={"Range": "bytes=0-9", "If-Range": '"stale"'})
+    assert response.status_code == 200
+    assert response.content == BODY
+
+
+def test_head_sends_no_body(client):
+    response = client.head("/artifact", headers={"Range": "bytes=0-9"})
+    assert response.status_code == 206
+    assert response.headers["content-length"] == "10"
+    assert response.content == b""
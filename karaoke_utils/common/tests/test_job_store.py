@@ -0,0 +1,147 @@
+"""Tests for the durable job store."""
+import os
+import time
+
+from common.job_store import JobStatus, JobStore
+
+
+def _store(tmp_path, **kwargs) -> JobStore:
+    return JobStore(db_path=str(tmp_path / "jobs.sqlite3"), **kwargs)
+
+
+def _work_dir(tmp_path, name: str, size: int = 0) -> str:
+    path = tmp_path / name
+    path.mkdir()
+    (path / "final.mp4").write_bytes(b"\x00" * size)
+    return str(path)
+
+
+def test_jobs_survive_restart(tmp_path):
+    store = _store(tmp_path, done_message="Song ready")
+    store.create("done", work_dir="/tmp/x")
+    store.update("done", title="Song")
+    store.set_done("done", "/tmp/x/Song.mp4")
+
+    job = _store(tmp_path).get("done")
+    assert job.status == JobStatus.DONE
+    assert job.progress_message == "Song ready"
+    assert job.title == "Song"
+    assert job.output_path == "/tmp/x/Song.mp4"
+    assert job.work_dir == "/tmp/x"
+
+
+def test_running_jobs_fail_on_restart(tmp_path):
+    store = _store(tmp_path)
+    store.create("running")
+    store.update("running", status=JobStatus.SEPARATING)
+
+    job = _store(tmp_path).get("running")
+    assert job.status == JobStatus.ERROR
+    assert "restart" in job.error
+    assert job.expires_at is not None
+
+
+def test_members_of_a_batch(tmp_path):
+    store = _store(tmp_path)
+    store.create("batch")
+    store.create("first", batch_id="batch")
+    store.create("other")
+    store.create("second", batch_id="batch")
+
+    assert [job.job_id for job in store.members("batch")] == ["first", "second"]
+    assert [job.job_id for job in _store(tmp_path).members("batch")] == ["first", "second"]
+
+
+def test_delete(tmp_path):
+    store = _store(tmp_path)
+    store.create("gone")
+    store.delete("gone")
+    assert store.get("gone") is None
+    assert _store(tmp_path).get("gone") is None
+
+
+def test_reap_removes_expired_jobs_and_work_dirs(tmp_path):
+    store = _store(tmp_path, ttl_seconds=60)
+    expired_dir = _work_dir(tmp_path, "expired")
+    fresh_dir = _work_dir(tmp_path, "fresh")
+    running_dir = _work_dir(tmp_path, "running")
+    for job_id, work_dir in (("expired", expired_dir), ("fresh", fresh_dir), ("running", running_dir)):
+        store.create(job_id, work_dir=work_dir)
+    store.set_done("expired", os.path.join(expired_dir, "final.mp4"))
+    store.update("expired", expires_at=time.time() - 1)
+    store.set_error("fresh", "boom")
+
+    assert store.reap() == 1
+    assert store.get("expired") is None
+    assert not os.path.exists(expired_dir)
+    assert store.get("fresh") is not None and os.path.exists(fresh_dir)
+    assert store.get("running") is not None and os.path.exists(running_dir)
+    assert _store(tmp_path).get("expired") is None
+
+
+def test_reap_enforces_disk_cap_oldest_first(tmp_path):
+    store = _store(tmp_path, ttl_seconds=3600, max_disk_bytes=250)
+    for i, job_id in enumerate(("old", "mid", "new")):
+        work_dir = _work_dir(tmp_path, job_id, size=100)
+        store.create(job_id, work_dir=work_dir)
+        store.set_done(job_id, os.path.join(work_dir, "final.mp4"))
+        store.update(job_id, expires_at=time.time() + 3600 + i)
+
+    assert store.reap() == 1
+    assert store.get("old") is None
+    assert store.get("mid") is not None
+    assert store.get("new") is not None
+
+
+def test_reap_keeps_work_dir_shared_with_a_live_job(tmp_path):
+    store = _store(tmp_path, ttl_seconds=60, max_disk_bytes=150)
+    shared = _work_dir(tmp_path, "shared", size=100)
+    for job_id in ("first", "second"):
+        store.create(job_id, work_dir=shared)
+        store.set_done(job_id, os.path.join(shared, "final.mp4"))
+    store.update("first", expires_at=time.time() - 1)
+
+    # The shared dir counts once against the cap, so "second" is not evicted for it either
+    assert store.reap() == 1
+    assert store.get("second") is not None
+    assert os.path.exists(shared)
+
+    store.update("second", expires_at=time.time() - 1)
+    assert store.reap() == 1
+    assert not os.path.exists(shared)
+
+
+def test_reap_keeps_batch_members_until_the_batch_goes(tmp_path):
+    store = _store(tmp_path, ttl_seconds=60, max_disk_bytes=150)
+    store.create("batch", work_dir=_work_dir(tmp_path, "batch"))
+    member_dirs = {job_id: _work_dir(tmp_path, job_id, size=100) for job_id in ("a", "b")}
+    for job_id, work_dir in member_dirs.items():
+        store.create(job_id, work_dir=work_dir, batch_id="batch")
+        store.set_done(job_id, os.path.join(work_dir, "final.mp4"))
+    store.update("a", expires_at=time.time() - 1)
+
+    # Neither expiry nor the disk cap takes a member while its batch is still there
+    assert store.reap() == 0
+    assert [job.job_id for job in store.members("batch")] == ["a", "b"]
+
+    store.set_done("batch", os.path.join(tmp_path, "batch", "batch.zip"))
+    store.update("batch", expires_at=time.time() - 1)
+    assert store.reap() == 3
+    assert store.members("batch") == []
+    assert not any(os.path.exists(path) for path in member_dirs.values())
+
+
+def test_reap_removes_stale_orphan_dirs(tmp_path, monkeypatch):
+    monkeypatch.setattr("common.job_store.tempfile.gettempdir", lambda: str(tmp_path))
+    store = _store(tmp_path, ttl_seconds=60, orphan_prefix="karaoke_")
+    orphan = _work_dir(tmp_path, "karaoke_abc12345")
+    owned = _work_dir(tmp_path, "karaoke_def67890")
+    cache_dir = _work_dir(tmp_path, "karaoke_cache")
+    for path in (orphan, owned, cache_dir):
+        os.utime(path, (0, 0))
+    store.create("owned", work_dir=owned)
+
+    store.reap()
+    assert not os.path.exists(orphan)
+    assert os.path.exists(owned)
+    assert os.path.exists(cache_dir)
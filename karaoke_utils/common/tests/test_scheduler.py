@@ -0,0 +1,128 @@
+"""Tests for the staged job scheduler."""
+import threading
+import time
+
+import pytest
+
+from common.scheduler import JobScheduler, QueueFull, WorkerPool
+
+
+def _wait_until(predicate, timeout: float = 2.0):
+    deadline = time.time() + timeout
+    while time.time() < deadline and not predicate():
+        time.sleep(0.01)
+    return predicate()
+
+
+def _fail(job_id, exc):
+    raise AssertionError(f"{job_id} failed: {exc}")
+
+
+def test_pool_runs_tasks_in_fifo_order():
+    order = []
+    pool = WorkerPool("test", workers=1)
+    for job_id in ("a", "b", "c"):
+        pool.submit(job_id, lambda job_id=job_id: order.append(job_id))
+    assert _wait_until(lambda: len(order) == 3)
+    assert order == ["a", "b", "c"]
+
+
+def test_pool_limits_concurrent_tasks():
+    release = threading.Event()
+    running, peak = [], []
+    lock = threading.Lock()
+
+    def task(job_id):
+        with lock:
+            running.append(job_id)
+            peak.append(len(running))
+        release.wait(2)
+        with lock:
+            running.remove(job_id)
+
+    pool = WorkerPool("test", workers=2)
+    for i in range(5):
+        pool.submit(str(i), lambda i=i: task(str(i)))
+
+    assert _wait_until(lambda: len(running) == 2)
+    assert pool.depth == 3
+    assert pool.position("4") == 3
+    assert pool.position("0") is None
+    release.set()
+    assert _wait_until(lambda: pool.depth == 0 and not running)
+    assert max(peak) == 2
+
+
+def test_stages_overlap_across_jobs():
+    """Job 2 downloads while job 1 still holds the single separation worker."""
+    separating = threading.Event()
+    release = threading.Event()
+    events = []
+
+    def download(job_id):
+        events.append(("download", job_id))
+
+    def separate(job_id):
+        events.append(("separate", job_id))
+        separating.set()
+        release.wait(2)
+
+    scheduler = JobScheduler({"download": 1, "separation": 1}, max_queue=10)
+    steps = [("download", download), ("separation", separate)]
+    scheduler.submit("job1", steps, on_error=_fail)
+    assert separating.wait(2)
+    scheduler.submit("job2", steps, on_error=_fail)
+
+    assert _wait_until(lambda: ("download", "job2") in events)
+    assert scheduler.position("job2") == ("separation", 1)
+    release.set()
+    assert _wait_until(lambda: ("separate", "job2") in events)
+
+
+def test_passes_args_and_stops_after_failing_step():
+    calls, errors = [], []
+
+    def boom(job_id, ctx):
+        raise RuntimeError("boom")
+
+    scheduler = JobScheduler({"a": 1, "b": 1}, max_queue=10)
+    scheduler.submit(
+        "job",
+        [("a", lambda job_id, ctx: calls.append(ctx)), ("b", boom), ("a", lambda job_id, ctx: calls.append("never"))],
+        "ctx",
+        on_error=lambda job_id, exc: errors.append((job_id, str(exc))),
+    )
+    assert _wait_until(lambda: errors == [("job", "boom")])
+    time.sleep(0.05)
+    assert calls == ["ctx"]
+
+
+def test_rejects_past_max_queue():
+    release = threading.Event()
+    scheduler = JobScheduler({"download": 1}, max_queue=1)
+    scheduler.submit("running", [("download", lambda job_id: release.wait(2))], on_error=_fail)
+    assert _wait_until(lambda: scheduler.depth == 0)
+    scheduler.submit("waiting", [("download", lambda job_id: None)], on_error=_fail)
+    with pytest.raises(QueueFull):
+        scheduler.submit("rejected", [("download", lambda job_id: None)], on_error=_fail)
+    release.set()
+
+
+def test_feed_backlogs_jobs_past_the_queue_limit():
+    release = threading.Event()
+    ran = []
+    scheduler = JobScheduler({"download": 1}, max_queue=1)
+    scheduler.submit("running", [("download", lambda job_id: release.wait(2))], on_error=_fail)
+    assert _wait_until(lambda: scheduler.depth == 0)
+
+    steps = [("download", lambda job_id, ctx: ran.append(ctx))]
+    scheduler.feed([("a", (1,)), ("b", (2,)), ("c", (3,))], steps, on_error=_fail)
+    assert scheduler.depth == 1
+    assert scheduler.position("a") == ("download", 1)
+    assert scheduler.position("c") == ("download", 3)
+    with pytest.raises(QueueFull):
+        scheduler.submit("rejected", [("download", lambda job_id: None)], on_error=_fail)
+
+    release.set()
+    assert _wait_until(lambda: ran == [1, 2, 3])
+    assert scheduler.position("c") is None
\ No newline at end of file
@@ -0,0 +1,20 @@
+"""Tests for YouTube URL parsing."""
+import pytest
+
+from common.youtube_url import video_id
+
+
+@pytest.mark.parametrize("link", [
+    "https://www.youtube.com/watch?v=dQw4w9WgXcQ",
+    "https://www.youtube.com/watch?list=PL123&v=dQw4w9WgXcQ&t=42",
+    "https://youtu.be/dQw4w9WgXcQ?si=abc",
+    "https://www.youtube.com/shorts/dQw4w9WgXcQ",
+    "https://www.youtube.com/embed/dQw4w9WgXcQ",
+    "https://www.youtube.com/live/dQw4w9WgXcQ",
+])
+def test_video_id_canonicalises_url_forms(link):
+    assert video_id(link) == "dQw4w9WgXcQ"
+
+
+def test_video_id_none_for_unknown_url():
+    assert video_id("https://example.com/song.mp4") is None
@@ -0,0 +1,11 @@
+"""YouTube URL parsing shared by the services that key work by video."""
+import re
+from typing import Optional
+
+_VIDEO_ID_RE = re.compile(r"(?:[?&]v=|youtu\.be/|/shorts/|/embed/|/live/)([A-Za-z0-9_-]{11})")
+
+
+def video_id(link: str) -> Optional[str]:
+    """Return the canonical 11-character YouTube video ID, or None if link has none."""
+    match = _VIDEO_ID_RE.search(link)
+    return match.group(1) if match else None
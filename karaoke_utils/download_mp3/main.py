@@ -2,23 +2,66 @@ import logging
 import os
 import re
 import shutil
-import subprocess
 import tempfile
 import threading
+import time
 import uuid
 from pathlib import Path
+from typing import Literal, Optional
 
-from fastapi import BackgroundTasks, FastAPI, HTTPException
-from fastapi.responses import FileResponse
-from pydantic import BaseModel
+from fastapi import FastAPI, HTTPException
+from pydantic import BaseModel, Field
+import yt_dlp
+
+from common.download_progress import DownloadProgress, meter
+from common.file_response import ArtifactResponse
+from common.job_store import JobStatus, JobStore
+from common.scheduler import JobScheduler, QueueFull
+from common.youtube_url import video_id
+from rate_limit import rate_limiter
+from tagging import jpeg_thumbnail_url, tag_audio
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
 app = FastAPI(title="MP3 Download Service")
 
-_jobs: dict[str, dict] = {}
-_lock = threading.Lock()
+store = JobStore(
+    db_path=os.environ.get("JOB_DB_PATH", os.path.join(tempfile.gettempdir(), "mp3_jobs.sqlite3")),
+    ttl_seconds=float(os.environ.get("JOB_TTL_HOURS", "24")) * 3600,
+    max_disk_bytes=int(os.environ.get("JOB_DISK_LIMIT_MB", "5120")) * 1024 * 1024,
+    orphan_prefix="mp3_",
+    done_message="MP3 ready",
+)
+scheduler = JobScheduler(
+    stages={"download": int(os.environ.get("MP3_DOWNLOAD_WORKERS", "2"))},
+    max_queue=int(os.environ.get("MP3_MAX_QUEUE", "50")),
+)
+
+# Served with these types; "original" keeps whatever container the source audio came in
+MEDIA_TYPES = {
+    ".mp3": "audio/mpeg",
+    ".m4a": "audio/mp4",
+    ".opus": "audio/ogg",
+    ".ogg": "audio/ogg",
+    ".webm": "audio/webm",
+    ".aac": "audio/aac",
+    ".flac": "audio/flac",
+    ".wav": "audio/wav",
+}
+
+# Requests for the same video and audio parameters share one download. _artifacts maps that key
+# to the job whose work dir holds (or will hold) the file; _followers lists the jobs attached to
+# a still-running download. Jobs attached to a download share its work dir, and the job store
+# only deletes a work dir once every job using it has expired.
+_dedup_lock = threading.Lock()
+_artifacts: dict[str, str] = {}
+_followers: dict[str, list[str]] = {}
+
+
+@app.on_event("startup")
+def start_job_reaper() -> None:
+    store.start_reaper()
 
 
 def _safe_filename(title: str) -> str:
@@ -29,102 +72,249 @@ def _safe_filename(title: str) -> str:
 class DownloadRequest(BaseModel):
     video_url: str
     video_title: str = ""
+    embed_thumbnail: bool = True  # YouTube thumbnail as album art; bulk exports can skip the fetch
+    embed_metadata: bool = True   # title, artist (channel), date and source URL tags
+    # "original" copies the source audio stream without transcoding; yt-dlp also
+    # copies instead of transcoding when the source already has the requested codec
+    audio_format: Literal["mp3", "m4a", "opus", "original"] = "mp3"
+    audio_bitrate: Optional[int] = Field(None, ge=32, le=320)  # kbps; None = best VBR quality
 
 
-def _run_download(job_id: str, video_url: str, output_path: str) -> None:
-    with _lock:
-        _jobs[job_id]["status"] = "downloading"
-        _jobs[job_id]["progress_message"] = "Downloading audio…"
-    logger.info("Job %s: starting yt-dlp for %s", job_id, video_url)
+def _dedup_key(req: DownloadRequest) -> str:
+    return "|".join((
+        video_id(req.video_url) or req.video_url,
+        req.audio_format,
+        str(req.audio_bitrate or "vbr"),
+        f"thumbnail={req.embed_thumbnail}",
+        f"metadata={req.embed_metadata}",
+    ))
+
+
+def _download_name(title: str, file_path: str) -> str:
+    """Download filename: a shared file is named after the job that started it, so use this job's title."""
+    return f"{title}{Path(file_path).suffix}" if title else Path(file_path).name
+
+
+def _update_group(job_id: str, **kwargs) -> None:
+    """Update job_id and every job attached to its download."""
+    with _dedup_lock:
+        job_ids = [job_id, *_followers.get(job_id, ())]
+    for each in job_ids:
+        store.update(each, **kwargs)
+
+
+def _finish_group(job_id: str, key: str, output_path: Optional[str] = None, error: Optional[str] = None) -> None:
+    # Under the lock so a request arriving now either attaches before the jobs finish or sees them done
+    with _dedup_lock:
+        job_ids = [job_id, *_followers.pop(job_id, ())]
+        if error is not None and _artifacts.get(key) == job_id:
+            del _artifacts[key]
+        for each in job_ids:
+            if error is not None:
+                store.set_error(each, error)
+            else:
+                store.set_done(each, output_path)
+
+
+def _source_of(job_id: str) -> str:
+    """The job running the download job_id is attached to (job_id itself if it runs its own)."""
+    with _dedup_lock:
+        for source_id, followers in _followers.items():
+            if job_id in followers:
+                return source_id
+    return job_id
+
+
+def _prune_artifacts() -> None:
+    """Forget downloads whose job the store has reaped. Called with _dedup_lock held."""
+    for key in [key for key, job_id in _artifacts.items() if store.get(job_id) is None]:
+        del _artifacts[key]
+
+
+def _attach(key: str, job_id: str, title: str) -> bool:
+    """Attach job_id to a running or finished download for key. Returns False if there is none to share.
+
+    Called with _dedup_lock held.
+    """
+    source = store.get(_artifacts.get(key, ""))
+    if not source:
+        _artifacts.pop(key, None)  # the job was reaped along with its file
+        return False
+    if source.status == JobStatus.ERROR:
+        return False
+    if source.status == JobStatus.DONE:
+        if not source.output_path or not os.path.isfile(source.output_path):
+            return False
+        store.create(job_id, work_dir=source.work_dir)
+        store.update(job_id, title=title)
+        store.set_done(job_id, source.output_path)
+        # The newest job now keeps the file alive the longest
+        _artifacts[key] = job_id
+    else:
+        store.create(job_id, work_dir=source.work_dir)
+        store.update(job_id, title=title, status=source.status, progress_message=source.progress_message)
+        _followers[source.job_id].append(job_id)
+    logger.info("Job %s: sharing the download of job %s", job_id, source.job_id)
+    return True
+
+
+def _ydl_options(req: DownloadRequest, output_path: str) -> dict:
+    """YoutubeDL options, spelled as the yt-dlp command line they are equivalent to.
+
+    Thumbnail and metadata embedding are left to tag_audio, which writes the
+    tags in place instead of yt-dlp's extra thumbnail conversion and ffmpeg remux.
+    """
+    parsed = yt_dlp.parse_options([
+        "-f", "bestaudio/best",
+        "-x",
+        "--audio-format", "best" if req.audio_format == "original" else req.audio_format,
+        "--audio-quality", f"{req.audio_bitrate}K" if req.audio_bitrate else "0",
+        "--no-playlist",
+        "-o", output_path,
+    ])
+    return {**parsed.ydl_opts, "quiet": True, "no_warnings": True, "logger": logger}
+
+
+def _output_file(info: dict) -> str:
+    # yt-dlp records where each download ended up after post-processing
+    for download in info.get("requested_downloads") or ():
+        if download.get("filepath"):
+            return download["filepath"]
+    raise RuntimeError("yt-dlp reported success but no output file")
+
+
+def _fetch_cover(ydl: yt_dlp.YoutubeDL, info: dict) -> Optional[bytes]:
+    url = jpeg_thumbnail_url(info)
+    if not url:
+        return None
     try:
-        result = subprocess.run(
-            [
-                "yt-dlp",
-                "-f", "bestaudio/best",
-                "-x",
-                "--audio-format", "mp3",
-                "--audio-quality", "0",
-                "--embed-thumbnail",           # embed YouTube thumbnail as album art
-                "--convert-thumbnails", "jpg", # convert WebP → JPEG before embedding
-                "--embed-metadata",            # write ID3 tags (title, artist, album, etc.)
-                "--parse-metadata", "%(uploader)s:%(artist)s",  # map channel name → Artist tag
-                "--no-playlist",
-                "-o", output_path,
-                video_url,
-            ],
-            capture_output=True,
-            text=True,
+        return ydl.urlopen(url).read()
+    except Exception:
+        # Album art is a nicety; the MP3 is still good without it
+        logger.warning("Could not fetch thumbnail %s", url, exc_info=True)
+        return None
+
+
+def _run_download(job_id: str, req: DownloadRequest, output_path: str, key: str) -> None:
+    video_url = req.video_url
+    delay = rate_limiter.reserve(video_url)
+    if delay:
+        _update_group(job_id, progress_message=f"Waiting {delay:.0f}s to avoid upstream rate limits…")
+        time.sleep(delay)
+    _update_group(job_id, status=JobStatus.DOWNLOADING, progress_message="Downloading audio…")
+    logger.info("Job %s: starting yt-dlp for %s", job_id, video_url)
+
+    def report(progress: DownloadProgress) -> None:
+        _update_group(
+            job_id,
+            progress=progress.fraction,
+            eta_seconds=progress.eta_seconds,
+            downloaded_bytes=progress.downloaded_bytes,
+            total_bytes=progress.total_bytes,
+            speed=progress.speed,
         )
-        logger.info("Job %s: yt-dlp rc=%d\nstdout: %s\nstderr: %s",
-                    job_id, result.returncode, result.stdout[-3000:], result.stderr[-3000:])
-        if result.returncode != 0:
-            err = result.stderr[-500:] or result.stdout[-500:] or "yt-dlp failed with no output"
-            with _lock:
-                _jobs[job_id]["status"] = "error"
-                _jobs[job_id]["error"] = err
-            return
-        with _lock:
-            _jobs[job_id]["status"] = "done"
-            _jobs[job_id]["progress_message"] = "MP3 ready"
-        logger.info("Job %s: MP3 download complete → %s.mp3", job_id, output_path)
+
+    def on_postprocess(d: dict) -> None:
+        if d.get("status") == "started" and d.get("postprocessor") == "ExtractAudio":
+            _update_group(job_id, status=JobStatus.ENCODING, progress_message="Extracting audio…", speed=None)
+
+    try:
+        with meter.track(job_id, report) as hook:
+            opts = {
+                **_ydl_options(req, output_path),
+                "progress_hooks": [hook],
+                "postprocessor_hooks": [on_postprocess],
+            }
+            with yt_dlp.YoutubeDL(opts) as ydl:
+                info = ydl.extract_info(video_url, download=True)
+                audio_path = _output_file(info)
+                if req.embed_metadata or req.embed_thumbnail:
+                    _update_group(job_id, progress_message="Tagging audio…")
+                    cover = _fetch_cover(ydl, info) if req.embed_thumbnail else None
+                    tag_audio(audio_path, info if req.embed_metadata else None, cover)
+        _finish_group(job_id, key, output_path=audio_path)
+        logger.info("Job %s: audio download complete → %s", job_id, audio_path)
     except Exception as e:
         logger.exception("MP3 download failed for job %s", job_id)
-        with _lock:
-            _jobs[job_id]["status"] = "error"
-            _jobs[job_id]["error"] = str(e)
+        _finish_group(job_id, key, error=str(e))
 
 
 @app.post("/download")
-def download(req: DownloadRequest, background_tasks: BackgroundTasks):
+def download(req: DownloadRequest):
     job_id = uuid.uuid4().hex
-    tmp_dir = tempfile.mkdtemp(prefix="mp3_")
-    safe_title = _safe_filename(req.video_title) if req.video_title else job_id
-    output_template = os.path.join(tmp_dir, safe_title)
-    output_path = f"{output_template}.mp3"
-    with _lock:
-        _jobs[job_id] = {
-            "status": "queued",
-            "path": output_path,
-            "progress_message": "Job queued…",
-            "error": None,
-        }
-    background_tasks.add_task(_run_download, job_id, req.video_url, output_template)
+    safe_title = _safe_filename(req.video_title) if req.video_title else ""
+    key = _dedup_key(req)
+    with _dedup_lock:
+        if _attach(key, job_id, safe_title):
+            return {"job_id": job_id}
+        tmp_dir = tempfile.mkdtemp(prefix="mp3_")
+        store.create(job_id, work_dir=tmp_dir)
+        store.update(job_id, title=safe_title, progress_message="Job queued…")
+        output_template = os.path.join(tmp_dir, safe_title or job_id)
+        try:
+            scheduler.submit(
+                job_id,
+                [("download", _run_download)],
+                req, output_template, key,
+                on_error=lambda failed_id, exc: _finish_group(failed_id, key, error=str(exc)),
+            )
+        except QueueFull:
+            store.delete(job_id)
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+            raise HTTPException(
+                status_code=503,
+                detail="Too many downloads waiting, try again later",
+                headers={"Retry-After": "30"},
+            )
+        _prune_artifacts()
+        _artifacts[key] = job_id
+        _followers[job_id] = []
     return {"job_id": job_id}
 
 
 @app.get("/status/{job_id}")
 def get_status(job_id: str):
-    with _lock:
-        job = _jobs.get(job_id)
+    job = store.get(job_id)
     if not job:
         raise HTTPException(status_code=404, detail="Job not found")
+    waiting = scheduler.position(_source_of(job_id))
+    queue_position = None
+    progress_message = job.progress_message
+    if waiting:
+        _, queue_position = waiting
+        progress_message = f"Waiting for a download slot (position {queue_position})"
     return {
         "job_id": job_id,
-        "status": job["status"],
-        "progress_message": job["progress_message"],
-        "error": job["error"],
+        "status": job.status,
+        "progress_message": progress_message,
+        "queue_position": queue_position,
+        "progress": job.progress,
+        "eta_seconds": job.eta_seconds,
+        "downloaded_bytes": job.downloaded_bytes,
+        "total_bytes": job.total_bytes,
+        "speed": job.speed,
+        "error": job.error,
     }
 
 
 @app.get("/file/{job_id}")
 def get_file(job_id: str):
-    with _lock:
-        job = _jobs.get(job_id)
+    job = store.get(job_id)
     if not job:
         raise HTTPException(status_code=404, detail="Job not found")
-    if job["status"] == "error":
-        raise HTTPException(status_code=500, detail=job["error"])
-    if job["status"] != "done" or not job["path"]:
+    if job.status == JobStatus.ERROR:
+        raise HTTPException(status_code=500, detail=job.error)
+    if job.status != JobStatus.DONE or not job.output_path:
         raise HTTPException(status_code=409, detail="File not ready")
 
-    file_path = job["path"]
+    file_path = job.output_path
     if not os.path.isfile(file_path):
         raise HTTPException(status_code=404, detail="File not found on disk")
 
-    return FileResponse(
+    return ArtifactResponse(
         path=file_path,
-        media_type="audio/mpeg",
-        filename=Path(file_path).name,
+        media_type=MEDIA_TYPES.get(Path(file_path).suffix.lower(), "application/octet-stream"),
+        filename=_download_name(job.title, file_path),
     )
 
 
@@ -138,16 +328,15 @@ def save_file(job_id: str, req: SaveRequest):
     if not output_dir:
         raise HTTPException(status_code=400, detail="OUTPUT_DIR not configured on server")
 
-    with _lock:
-        job = _jobs.get(job_id)
+    job = store.get(job_id)
     if not job:
         raise HTTPException(status_code=404, detail="Job not found")
-    if job["status"] == "error":
-        raise HTTPException(status_code=500, detail=job["error"])
-    if job["status"] != "done" or not job["path"]:
+    if job.status == JobStatus.ERROR:
+        raise HTTPException(status_code=500, detail=job.error)
+    if job.status != JobStatus.DONE or not job.output_path:
         raise HTTPException(status_code=409, detail="File not ready yet")
 
-    src = job["path"]
+    src = job.output_path
     if not os.path.isfile(src):
         raise HTTPException(status_code=404, detail="Source file missing on disk")
 
@@ -157,12 +346,17 @@ def save_file(job_id: str, req: SaveRequest):
         raise HTTPException(status_code=400, detail="Invalid path: must be within OUTPUT_DIR")
 
     os.makedirs(dest_dir, exist_ok=True)
-    dest = os.path.join(dest_dir, os.path.basename(src))
+    dest = os.path.join(dest_dir, _download_name(job.title, src))
     shutil.copy2(src, dest)
     logger.info("Job %s: saved to %s", job_id, dest)
     return {"saved_to": dest}
 
 
+@app.get("/metrics")
+def metrics():
+    return {"downloads": meter.snapshot()}
+
+
 @app.get("/health")
 def health():
     return {"status": "ok"}
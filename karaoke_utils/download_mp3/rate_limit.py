@@ -0,0 +1,51 @@
+import os
+import threading
+import time
+from urllib.parse import urlparse
+
+# Hostnames that are the same upstream as far as rate limits are concerned
+_HOST_ALIASES = {"youtu.be": "youtube.com"}
+_HOST_PREFIXES = ("www.", "m.", "music.")
+
+
+def host_of(url: str) -> str:
+    host = (urlparse(url).hostname or "").lower()
+    for prefix in _HOST_PREFIXES:
+        if host.startswith(prefix):
+            host = host[len(prefix):]
+            break
+    return _HOST_ALIASES.get(host, host)
+
+
+class HostRateLimiter:
+    """Token bucket per host: bursts of up to burst requests, then per_minute on average.
+
+    reserve() takes a token even if the bucket is empty and returns how long
+    the caller must wait before using it, so concurrent callers queue up in
+    order instead of racing for the next token. per_minute <= 0 disables it.
+    """
+
+    def __init__(self, per_minute: float, burst: int):
+        self.per_minute = per_minute
+        self.burst = burst
+        self._lock = threading.Lock()
+        self._buckets: dict[str, tuple[float, float]] = {}    # host -> (tokens, updated at)
+
+    def reserve(self, url: str) -> float:
+        """Take a token for url's host; returns seconds to wait before the request may start."""
+        if self.per_minute <= 0:
+            return 0.0
+        rate = self.per_minute / 60
+        host = host_of(url)
+        now = time.monotonic()
+        with self._lock:
+            tokens, updated = self._buckets.get(host, (float(self.burst), now))
+            tokens = min(float(self.burst), tokens + (now - updated) * rate) - 1
+            self._buckets[host] = (tokens, now)
+        return -tokens / rate if tokens < 0 else 0.0
+
+
+rate_limiter = HostRateLimiter(
+    per_minute=float(os.environ.get("MP3_HOST_REQUESTS_PER_MINUTE", "30")),
+    burst=int(os.environ.get("MP3_HOST_BURST", "5")),
+)
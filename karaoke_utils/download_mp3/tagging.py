@@ -0,0 +1,112 @@
+import base64
+import logging
+import os
+from typing import Optional
+
+from mutagen.flac import Picture
+from mutagen.id3 import APIC, ID3, TALB, TDRC, TIT2, TPE1, WOAS, ID3NoHeaderError
+from mutagen.mp4 import MP4, MP4Cover
+from mutagen.oggopus import OggOpus
+
+logger = logging.getLogger(__name__)
+
+
+def jpeg_thumbnail_url(info: dict) -> Optional[str]:
+    """URL of the preferred JPEG thumbnail in a yt-dlp info dict, or None.
+
+    YouTube offers every thumbnail as JPEG as well as WebP, so picking a JPEG
+    avoids the WebP → JPEG conversion yt-dlp would otherwise run through ffmpeg.
+    """
+    # yt-dlp sorts thumbnails worst first
+    for thumbnail in reversed(info.get("thumbnails") or []):
+        url = thumbnail.get("url", "")
+        if url.split("?", 1)[0].lower().endswith((".jpg", ".jpeg")):
+            return url
+    return None
+
+
+def _date(upload_date: Optional[str]) -> Optional[str]:
+    # yt-dlp dates are YYYYMMDD; tags want YYYY-MM-DD
+    if not upload_date or len(upload_date) != 8:
+        return None
+    return f"{upload_date[:4]}-{upload_date[4:6]}-{upload_date[6:]}"
+
+
+def _fields(info: dict) -> dict:
+    """Tag values common to every container, omitting the ones the video doesn't have."""
+    fields = {
+        "title": info.get("track") or info.get("title"),
+        # The channel stands in for the artist, as yt-dlp's --parse-metadata "%(uploader)s:%(artist)s" did
+        "artist": info.get("artist") or info.get("uploader") or info.get("channel"),
+        "album": info.get("album"),
+        "date": _date(info.get("upload_date")),
+        "url": info.get("webpage_url"),
+    }
+    return {key: value for key, value in fields.items() if value}
+
+
+def _tag_id3(path: str, fields: dict, cover: Optional[bytes]) -> None:
+    try:
+        tags = ID3(path)
+    except ID3NoHeaderError:
+        tags = ID3()
+    frames = {"title": TIT2, "artist": TPE1, "album": TALB, "date": TDRC}
+    for key, frame in frames.items():
+        if key in fields:
+            tags.add(frame(encoding=3, text=fields[key]))
+    if "url" in fields:
+        tags.add(WOAS(url=fields["url"]))
+    if cover:
+        tags.add(APIC(encoding=3, mime="image/jpeg", type=3, desc="Cover", data=cover))
+    tags.save(path, v2_version=3)
+
+
+def _tag_mp4(path: str, fields: dict, cover: Optional[bytes]) -> None:
+    audio = MP4(path)
+    if audio.tags is None:
+        audio.add_tags()
+    atoms = {"title": "\xa9nam", "artist": "\xa9ART", "album": "\xa9alb", "date": "\xa9day"}
+    for key, atom in atoms.items():
+        if key in fields:
+            audio.tags[atom] = [fields[key]]
+    if cover:
+        audio.tags["covr"] = [MP4Cover(cover, imageformat=MP4Cover.FORMAT_JPEG)]
+    audio.save()
+
+
+def _tag_opus(path: str, fields: dict, cover: Optional[bytes]) -> None:
+    audio = OggOpus(path)
+    for key in ("title", "artist", "album", "date"):
+        if key in fields:
+            audio[key] = [fields[key]]
+    if "url" in fields:
+        audio["contact"] = [fields["url"]]
+    if cover:
+        picture = Picture()
+        picture.type = 3
+        picture.mime = "image/jpeg"
+        picture.desc = "Cover"
+        picture.data = cover
+        audio["metadata_block_picture"] = [base64.b64encode(picture.write()).decode("ascii")]
+    audio.save()
+
+
+_TAGGERS = {
+    ".mp3": _tag_id3,
+    ".m4a": _tag_mp4,
+    ".mp4": _tag_mp4,
+    ".opus": _tag_opus,
+}
+
+
+def tag_audio(path: str, info: Optional[dict] = None, cover: Optional[bytes] = None) -> None:
+    """Write tags from a yt-dlp info dict and/or a JPEG cover into the audio file at path, in place.
+
+    MP3 (ID3), M4A and Opus are supported; other containers are left untagged.
+    """
+    tagger = _TAGGERS.get(os.path.splitext(path)[1].lower())
+    if tagger is None:
+        logger.info("Not tagging %s: unsupported container", path)
+        return
+    tagger(path, _fields(info) if info else {}, cover)
+    logger.info("Tagged %s (metadata=%s, cover=%s)", path, bool(info), bool(cover))
@@ -1,19 +1,111 @@
 import os
+import threading
+import time
+from io import BytesIO
 from pathlib import Path
-from unittest.mock import MagicMock, patch
+from unittest.mock import patch
 
 import pytest
+import yt_dlp
 from fastapi.testclient import TestClient
+from mutagen.id3 import ID3
 
-from main import app, _jobs
+import main
+from common.job_store import FINISHED, JobStatus
+from common.scheduler import JobScheduler
+from main import DownloadRequest, app, store
+from rate_limit import HostRateLimiter
 
 client = TestClient(app)
 
 YOUTUBE_URL = "https://www.youtube.com/watch?v=test123"
 
 
-def _reset_jobs():
-    _jobs.clear()
+def _done_job(job_id: str, path) -> None:
+    store.create(job_id)
+    store.set_done(job_id, str(path))
+
+
+@pytest.fixture(autouse=True)
+def fresh_state(monkeypatch):
+    monkeypatch.setattr(main, "_artifacts", {})
+    monkeypatch.setattr(main, "_followers", {})
+    monkeypatch.setattr(main, "scheduler", JobScheduler({"download": 1}, max_queue=10))
+    monkeypatch.setattr(main, "rate_limiter", HostRateLimiter(per_minute=0, burst=1))
+
+
+def _wait_for_job(job_id: str, timeout: float = 5.0):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        job = store.get(job_id)
+        if job and job.status in FINISHED:
+            return job
+        time.sleep(0.02)
+    return store.get(job_id)
+
+
+def _post(video_url: str, **fields) -> str:
+    response = client.post("/download", json={"video_url": video_url, **fields})
+    assert response.status_code == 200
+    return response.json()["job_id"]
+
+
+def _write_audio(opts, url):
+    """Default download behaviour: report progress, write the file yt-dlp would have produced, return its info."""
+    for hook in opts["progress_hooks"]:
+        hook({"status": "downloading", "downloaded_bytes": 3, "total_bytes": 7, "speed": 7.0, "eta": 1})
+        hook({"status": "finished", "total_bytes": 7, "elapsed": 1.0})
+    extract = next(pp for pp in opts["postprocessors"] if pp["key"] == "FFmpegExtractAudio")
+    # "best" keeps the source stream, which for YouTube audio is Opus in WebM
+    ext = "webm" if extract["preferredcodec"] == "best" else extract["preferredcodec"]
+    filepath = f"{opts['outtmpl']['default']}.{ext}"
+    Path(filepath).write_bytes(b"\xff\xfb\x90\x00" * 4)
+    return {
+        "requested_downloads": [{"filepath": filepath}],
+        "title": "Song",
+        "uploader": "Channel",
+        "upload_date": "20240102",
+        "webpage_url": url,
+        "thumbnails": [{"url": "https://i.ytimg.com/vi/x/hqdefault.jpg"}],
+    }
+
+
+def _unavailable(opts, url):
+    raise yt_dlp.utils.DownloadError("ERROR: video unavailable")
+
+
+class FakeYoutubeDL:
+    """Stands in for yt_dlp.YoutubeDL; extract_info() records the options and calls run(opts, url)."""
+
+    run = staticmethod(_write_audio)
+    calls: list = []
+    # yt_dlp.parse_options validates the output template through the class
+    validate_outtmpl = staticmethod(yt_dlp.YoutubeDL.validate_outtmpl)
+
+    def __init__(self, opts):
+        self.opts = opts
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def extract_info(self, url, download):
+        assert download
+        self.calls.append(self.opts)
+        return self.run(self.opts, url)
+
+    def urlopen(self, url):
+        self.fetched.append(url)
+        return BytesIO(b"\xff\xd8cover")
+
+
+@pytest.fixture(autouse=True)
+def ydl(monkeypatch):
+    fake = type("FakeYoutubeDL", (FakeYoutubeDL,), {"calls": [], "fetched": []})
+    monkeypatch.setattr(main.yt_dlp, "YoutubeDL", fake)
+    return fake
 
 
 def test_health():
@@ -21,51 +113,61 @@ def test_health():
     assert response.status_code == 200
 
 
-@patch("main.subprocess.run")
-@patch("main.Path.glob")
-def test_download_success(mock_glob, mock_run, tmp_path):
-    _reset_jobs()
-    fake_mp3 = tmp_path / "My Song.mp3"
-    fake_mp3.write_bytes(b"ID3fake")
+def test_download_success(ydl):
+    job = _wait_for_job(_post(YOUTUBE_URL, video_title="My Song"))
+    assert job.status == JobStatus.DONE
+    assert job.output_path.endswith("My Song.mp3")
+    assert job.work_dir == os.path.dirname(job.output_path)
 
-    mock_run.return_value = MagicMock(returncode=0, stderr="")
-    mock_glob.return_value = [fake_mp3]
+    # yt-dlp run with the right options
+    opts = ydl.calls[0]
+    assert opts["format"] == "bestaudio/best"
+    assert opts["noplaylist"]
+    extract = next(pp for pp in opts["postprocessors"] if pp["key"] == "FFmpegExtractAudio")
+    assert extract["preferredcodec"] == "mp3"
 
-    response = client.post("/download", json={"video_url": YOUTUBE_URL})
 
-    assert response.status_code == 200
-    data = response.json()
-    assert "job_id" in data
-    assert data["file_name"].endswith(".mp3")
+def test_download_reports_progress(ydl):
+    seen = []
+    posted = threading.Event()
 
-    # yt-dlp called with correct flags
-    call_args = mock_run.call_args[0][0]
-    assert "yt-dlp" in call_args
-    assert "--audio-format" in call_args
-    assert "mp3" in call_args
-    assert YOUTUBE_URL in call_args
+    def run(opts, url):
+        result = _write_audio(opts, url)
+        posted.wait(5)  # the worker can start before _post() has returned the job id
+        seen.append(client.get(f"/status/{job_id}").json())
+        return result
 
+    ydl.run = staticmethod(run)
+    job_id = _post(YOUTUBE_URL)
+    posted.set()
+    assert _wait_for_job(job_id).status == JobStatus.DONE
 
-@patch("main.subprocess.run")
-def test_download_ytdlp_failure(mock_run):
-    _reset_jobs()
-    mock_run.return_value = MagicMock(returncode=1, stderr="video unavailable")
+    status = seen[0]
+    assert status["downloaded_bytes"] == 7
+    assert status["total_bytes"] == 7
+    assert status["progress"] == 1.0
+    assert status["speed"] == 7.0
+    downloads = client.get("/metrics").json()["downloads"]
+    assert downloads["files"] >= 1
+    assert downloads["active"] == 0
 
-    response = client.post("/download", json={"video_url": YOUTUBE_URL})
-    assert response.status_code == 500
-    assert "video unavailable" in response.json()["detail"]
 
+def test_download_ytdlp_failure(ydl):
+    ydl.run = staticmethod(_unavailable)
 
-@patch("main.subprocess.run")
-@patch("main.Path.glob")
-def test_download_no_mp3_produced(mock_glob, mock_run):
-    _reset_jobs()
-    mock_run.return_value = MagicMock(returncode=0, stderr="")
-    mock_glob.return_value = []
+    job_id = _post(YOUTUBE_URL)
+    _wait_for_job(job_id)
 
-    response = client.post("/download", json={"video_url": YOUTUBE_URL})
-    assert response.status_code == 500
-    assert "No MP3" in response.json()["detail"]
+    status = client.get(f"/status/{job_id}").json()
+    assert status["status"] == "error"
+    assert "video unavailable" in status["error"]
+    assert client.get(f"/file/{job_id}").status_code == 500
+
+
+def test_get_file_missing_on_disk(tmp_path):
+    _done_job("missing_file_job", tmp_path / "gone.mp3")
+    response = client.get("/file/missing_file_job")
+    assert response.status_code == 404
 
 
 def test_get_file_not_found():
@@ -74,13 +176,15 @@ def test_get_file_not_found():
 
 
 def test_get_file_job_error():
-    _jobs["err_job"] = {"status": "error", "path": None, "error": "download failed"}
+    store.create("err_job")
+    store.set_error("err_job", "download failed")
     response = client.get("/file/err_job")
     assert response.status_code == 500
 
 
 def test_get_file_not_ready():
-    _jobs["pending_job"] = {"status": "downloading", "path": None, "error": None}
+    store.create("pending_job")
+    store.update("pending_job", status=JobStatus.DOWNLOADING)
     response = client.get("/file/pending_job")
     assert response.status_code == 409
 
@@ -88,8 +192,181 @@ def test_get_file_not_ready():
 def test_get_file_success(tmp_path):
     fake_mp3 = tmp_path / "song.mp3"
     fake_mp3.write_bytes(b"ID3data")
-    _jobs["done_job"] = {"status": "done", "path": str(fake_mp3), "error": None}
+    _done_job("done_job", fake_mp3)
 
     response = client.get("/file/done_job")
     assert response.status_code == 200
     assert response.headers["content-type"] == "audio/mpeg"
+
+
+def test_get_file_range_and_conditional(tmp_path):
+    fake_mp3 = tmp_path / "song.mp3"
+    fake_mp3.write_bytes(b"ID3data")
+    _done_job("range_job", fake_mp3)
+
+    response = client.get("/file/range_job", headers={"Range": "bytes=3-"})
+    assert response.status_code == 206
+    assert response.content == b"data"
+    assert response.headers["content-range"] == "bytes 3-6/7"
+
+    response = client.get("/file/range_job", headers={"If-None-Match": response.headers["etag"]})
+    assert response.status_code == 304
+
+
+def test_finished_download_is_shared(ydl):
+    first = _post("https://www.youtube.com/watch?v=dQw4w9WgXcQ", video_title="First")
+    _wait_for_job(first)
+    second = _post("https://youtu.be/dQw4w9WgXcQ?t=10", video_title="Second")
+
+    assert len(ydl.calls) == 1
+    assert store.get(second).status == JobStatus.DONE
+    assert store.get(second).output_path == store.get(first).output_path
+    assert store.get(second).work_dir == store.get(first).work_dir
+    response = client.get(f"/file/{second}")
+    assert "Second.mp3" in response.headers["content-disposition"]
+
+
+def test_running_download_is_shared(ydl):
+    attached = []
+
+    def run_and_attach(opts, url):
+        job_id = main.download(DownloadRequest(video_url=YOUTUBE_URL, video_title="Late"))["job_id"]
+        attached.append(job_id)
+        assert store.get(job_id).status == JobStatus.DOWNLOADING
+        return _write_audio(opts, url)
+
+    ydl.run = staticmethod(run_and_attach)
+    first = _wait_for_job(_post(YOUTUBE_URL)).job_id
+
+    assert len(ydl.calls) == 1
+    late = store.get(attached[0])
+    assert late.status == JobStatus.DONE
+    assert late.output_path == store.get(first).output_path
+
+
+def test_failed_download_is_not_shared(ydl):
+    ydl.run = staticmethod(_unavailable)
+    _wait_for_job(_post(YOUTUBE_URL))
+    _wait_for_job(_post(YOUTUBE_URL))
+    assert len(ydl.calls) == 2
+
+
+def test_different_videos_are_not_shared(ydl):
+    _wait_for_job(_post(YOUTUBE_URL))
+    _wait_for_job(_post("https://www.youtube.com/watch?v=other123456"))
+    assert len(ydl.calls) == 2
+
+
+def test_reaped_downloads_are_forgotten(ydl):
+    first = _wait_for_job(_post(YOUTUBE_URL))
+    store.delete(first.job_id)  # what the reaper does once the job expires
+    second = _wait_for_job(_post("https://www.youtube.com/watch?v=other123456")).job_id
+    assert list(main._artifacts.values()) == [second]
+
+    _wait_for_job(_post(YOUTUBE_URL))
+    assert len(ydl.calls) == 3
+
+
+def test_rejects_when_queue_full(monkeypatch):
+    monkeypatch.setattr(main, "scheduler", JobScheduler({"download": 1}, max_queue=0))
+    response = client.post("/download", json={"video_url": YOUTUBE_URL})
+    assert response.status_code == 503
+    assert response.headers["retry-after"] == "30"
+    # The rejected request is not left behind for later requests to attach to
+    assert main._artifacts == {}
+
+
+def test_status_reports_queue_position(ydl):
+    release = threading.Event()
+
+    def blocking_run(opts, url):
+        release.wait(5)
+        return _write_audio(opts, url)
+
+    ydl.run = staticmethod(blocking_run)
+    running = _post("https://www.youtube.com/watch?v=aaaaaaaaaaa")
+    queued = _post("https://www.youtube.com/watch?v=bbbbbbbbbbb")
+    attached = _post("https://youtu.be/bbbbbbbbbbb")
+    try:
+        deadline = time.time() + 5
+        while store.get(running).status != JobStatus.DOWNLOADING and time.time() < deadline:
+            time.sleep(0.02)
+        status = client.get(f"/status/{queued}").json()
+        assert status["queue_position"] == 1
+        assert "position 1" in status["progress_message"]
+        assert client.get(f"/status/{attached}").json()["queue_position"] == 1
+        assert client.get(f"/status/{running}").json()["queue_position"] is None
+    finally:
+        release.set()
+    assert _wait_for_job(queued).status == JobStatus.DONE
+    assert _wait_for_job(attached).status == JobStatus.DONE
+
+
+def test_download_waits_for_rate_limit(monkeypatch):
+    monkeypatch.setattr(main.rate_limiter, "reserve", lambda url: 0.01)
+    with patch("main.time.sleep") as mock_sleep:
+        job = _wait_for_job(_post(YOUTUBE_URL))
+    assert job.status == JobStatus.DONE
+    mock_sleep.assert_any_call(0.01)
+
+
+def test_download_tags_mp3_in_process(ydl):
+    job = _wait_for_job(_post(YOUTUBE_URL))
+    assert job.status == JobStatus.DONE
+
+    opts = ydl.calls[0]
+    assert not opts.get("writethumbnail")
+    assert [pp["key"] for pp in opts["postprocessors"] if pp["key"] != "FFmpegConcat"] == ["FFmpegExtractAudio"]
+    tags = ID3(job.output_path)
+    assert tags["TIT2"].text == ["Song"]
+    assert tags["TPE1"].text == ["Channel"]
+    assert tags.getall("APIC")[0].data == b"\xff\xd8cover"
+    assert ydl.fetched == ["https://i.ytimg.com/vi/x/hqdefault.jpg"]
+
+
+def test_download_without_tags(ydl):
+    job = _wait_for_job(_post(YOUTUBE_URL, embed_thumbnail=False, embed_metadata=False))
+    assert job.status == JobStatus.DONE
+    assert ydl.fetched == []
+    assert Path(job.output_path).read_bytes()[:3] != b"ID3"
+
+
+def test_tagging_options_are_not_shared(ydl):
+    _wait_for_job(_post(YOUTUBE_URL))
+    _wait_for_job(_post(YOUTUBE_URL, embed_thumbnail=False))
+    assert len(ydl.calls) == 2
+
+
+def test_audio_profile_options(ydl):
+    job = _wait_for_job(_post(YOUTUBE_URL, audio_format="m4a", audio_bitrate=128, embed_metadata=False,
+                                  embed_thumbnail=False))
+    assert job.status == JobStatus.DONE
+    assert job.output_path.endswith(".m4a")
+    extract = next(pp for pp in ydl.calls[0]["postprocessors"] if pp["key"] == "FFmpegExtractAudio")
+    assert extract["preferredcodec"] == "m4a"
+    assert extract["preferredquality"] == "128"
+
+
+def test_original_format_copies_source_stream(ydl):
+    job_id = _post(YOUTUBE_URL, video_title="My Song", audio_format="original", embed_metadata=False,
+                   embed_thumbnail=False)
+    job = _wait_for_job(job_id)
+    assert job.status == JobStatus.DONE
+    extract = next(pp for pp in ydl.calls[0]["postprocessors"] if pp["key"] == "FFmpegExtractAudio")
+    assert extract["preferredcodec"] == "best"
+
+    response = client.get(f"/file/{job_id}")
+    assert response.headers["content-type"] == "audio/webm"
+    assert "My%20Song.webm" in response.headers["content-disposition"]
+
+
+def test_audio_profiles_are_not_shared(ydl):
+    _wait_for_job(_post(YOUTUBE_URL))
+    _wait_for_job(_post(YOUTUBE_URL, audio_bitrate=192))
+    _wait_for_job(_post(YOUTUBE_URL, audio_format="opus"))
+    assert len(ydl.calls) == 3
+
+
+def test_rejects_out_of_range_bitrate():
+    response = client.post("/download", json={"video_url": YOUTUBE_URL, "audio_bitrate": 1000})
+    assert response.status_code == 422
@@ -0,0 +1,35 @@
+import pytest
+
+from rate_limit import HostRateLimiter, host_of
+
+
+@pytest.mark.parametrize("url", [
+    "https://www.youtube.com/watch?v=dQw4w9WgXcQ",
+    "https://youtu.be/dQw4w9WgXcQ",
+    "https://m.youtube.com/watch?v=dQw4w9WgXcQ",
+    "https://music.youtube.com/watch?v=dQw4w9WgXcQ",
+])
+def test_youtube_urls_share_a_host(url):
+    assert host_of(url) == "youtube.com"
+
+
+def test_burst_then_waits_in_order(monkeypatch):
+    now = [100.0]
+    monkeypatch.setattr("rate_limit.time.monotonic", lambda: now[0])
+    limiter = HostRateLimiter(per_minute=60, burst=2)
+    url = "https://www.youtube.com/watch?v=dQw4w9WgXcQ"
+
+    assert limiter.reserve(url) == 0
+    assert limiter.reserve(url) == 0
+    assert limiter.reserve(url) == pytest.approx(1.0)
+    assert limiter.reserve(url) == pytest.approx(2.0)
+    # Other hosts have their own bucket
+    assert limiter.reserve("https://vimeo.com/1") == 0
+
+    now[0] += 10
+    assert limiter.reserve(url) == 0
+
+
+def test_disabled():
+    limiter = HostRateLimiter(per_minute=0, burst=1)
+    assert all(limiter.reserve("https://youtu.be/x") == 0 for _ in range(10))
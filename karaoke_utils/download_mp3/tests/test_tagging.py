@@ -0,0 +1,62 @@
+from mutagen.id3 import ID3
+
+from tagging import jpeg_thumbnail_url, tag_audio
+
+INFO = {
+    "title": "Song",
+    "uploader": "Channel",
+    "upload_date": "20240102",
+    "webpage_url": "https://www.youtube.com/watch?v=dQw4w9WgXcQ",
+}
+
+
+def _mp3(tmp_path):
+    path = tmp_path / "song.mp3"
+    path.write_bytes(b"\xff\xfb\x90\x00" * 4)
+    return str(path)
+
+
+def test_tags_metadata_and_cover(tmp_path):
+    path = _mp3(tmp_path)
+    tag_audio(path, INFO, b"\xff\xd8cover")
+
+    tags = ID3(path)
+    assert tags["TIT2"].text == ["Song"]
+    assert tags["TPE1"].text == ["Channel"]
+    assert str(tags["TDRC"].text[0]) == "2024-01-02"
+    assert tags["WOAS"].url == INFO["webpage_url"]
+    assert tags.getall("APIC")[0].mime == "image/jpeg"
+
+
+def test_artist_field_wins_over_channel(tmp_path):
+    path = _mp3(tmp_path)
+    tag_audio(path, {**INFO, "artist": "Real Artist", "album": "Album"})
+    tags = ID3(path)
+    assert tags["TPE1"].text == ["Real Artist"]
+    assert tags["TALB"].text == ["Album"]
+    assert not tags.getall("APIC")
+
+
+def test_cover_only(tmp_path):
+    path = _mp3(tmp_path)
+    tag_audio(path, cover=b"\xff\xd8cover")
+    tags = ID3(path)
+    assert "TIT2" not in tags
+    assert tags.getall("APIC")
+
+
+def test_prefers_best_jpeg_thumbnail():
+    info = {"thumbnails": [
+        {"url": "https://i.ytimg.com/vi/x/default.jpg"},
+        {"url": "https://i.ytimg.com/vi/x/hqdefault.jpg?sqp=abc"},
+        {"url": "https://i.ytimg.com/vi_webp/x/maxresdefault.webp"},
+    ]}
+    assert jpeg_thumbnail_url(info) == "https://i.ytimg.com/vi/x/hqdefault.jpg?sqp=abc"
+    assert jpeg_thumbnail_url({"thumbnails": [{"url": "https://x/a.webp"}]}) is None
+
+
+def test_unsupported_container_is_left_alone(tmp_path):
+    path = tmp_path / "song.webm"
+    path.write_bytes(b"webm")
+    tag_audio(str(path), INFO, b"\xff\xd8cover")
+    assert path.read_bytes() == b"webm"
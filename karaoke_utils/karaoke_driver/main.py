@@ -1,73 +1,616 @@
+import io
+import json
 import logging
 import os
 import shutil
 import tempfile
+import threading
+import time
 import uuid
+import zipfile
+from dataclasses import dataclass
+from typing import Iterator, Literal, Optional
+from urllib.parse import quote
 
-from fastapi import BackgroundTasks, FastAPI, HTTPException
-from fastapi.responses import FileResponse
-from pydantic import BaseModel
+from fastapi import FastAPI, HTTPException
+from fastapi.responses import StreamingResponse
+from pydantic import BaseModel, Field
 
 import modules.youtube as ytube
 import modules.video_edit as ve
 import modules.vocal_remover as vr
 import modules.utils as utils
-from job_store import JobStatus, store
+from common.download_progress import DownloadProgress, meter
+from common.file_response import ArtifactResponse
+from common.job_store import FINISHED, Job, JobStatus, JobStore
+from common.scheduler import JobScheduler, QueueFull
+from result_cache import cache
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
 app = FastAPI(title="Karaoke Driver Service")
 
+store = JobStore(
+    db_path=os.environ.get("JOB_DB_PATH", os.path.join(tempfile.gettempdir(), "karaoke_jobs.sqlite3")),
+    ttl_seconds=float(os.environ.get("JOB_TTL_HOURS", "24")) * 3600,
+    max_disk_bytes=int(os.environ.get("JOB_DISK_LIMIT_MB", "10240")) * 1024 * 1024,
+    orphan_prefix="karaoke_",
+    done_message="Karaoke video ready",
+)
+scheduler = JobScheduler(
+    stages={
+        "download": int(os.environ.get("KARAOKE_DOWNLOAD_WORKERS", "2")),
+        "separation": int(os.environ.get("KARAOKE_SEPARATION_WORKERS", "1")),
+        "encode": int(os.environ.get("KARAOKE_ENCODE_WORKERS", "2")),
+        # Previews run start to finish here, so they never wait behind full-length jobs
+        "preview": int(os.environ.get("KARAOKE_PREVIEW_WORKERS", "1")),
+    },
+    max_queue=int(os.environ.get("KARAOKE_MAX_QUEUE", "20")),
+)
 
-class KaraokeRequest(BaseModel):
+
+@app.on_event("startup")
+def tune_separation_threads() -> None:
+    # Every separation worker may run Demucs at once, so they split the cores between them;
+    # previews run on a small fixed budget of their own (DEMUCS_PREVIEW_THREADS)
+    vr.configure_threads(scheduler.pools["separation"].workers)
+
+
+@app.on_event("startup")
+def preload_model() -> None:
+    # Warm the separation model in the background so /health answers immediately
+    if os.environ.get("DEMUCS_PRELOAD", "true").lower() == "true":
+        threading.Thread(target=vr.engine.load, name="demucs-preload", daemon=True).start()
+
+
+@app.on_event("startup")
+def start_job_reaper() -> None:
+    store.start_reaper()
+
+
+@app.on_event("shutdown")
+def stop_separation_pool() -> None:
+    vr.close_engines()
+
+
+class JobOptions(BaseModel):
+    output: Literal["mp3", "mp4", "both"] = "both"  # "mp3" skips downloading the video stream
+    # The accompaniment is freshly synthesized, so it is always encoded; this picks the rate
+    bitrate: Literal["128k", "192k", "256k", "320k"] = utils.AUDIO_BITRATE
+    # "fast" trades separation quality for speed: NumPy centre cancellation instead of Demucs
+    engine: Literal["demucs", "fast"] = "demucs"
+    # Demucs quality profile: "fast" hdemucs_mmi, "balanced" htdemucs, "best" htdemucs_ft with 2 shifts
+    quality: Literal["fast", "balanced", "best"] = vr.DEFAULT_QUALITY
+
+
+class KaraokeRequest(JobOptions):
     video_url: str
 
 
-def _run_pipeline(job_id: str, video_url: str, tmp_dir: str) -> None:
+def _cache_key(video_url: str, options: JobOptions) -> Optional[str]:
+    video_id = ytube.video_id(video_url)
+    if not video_id:
+        return None
+    separator = vr.get_engine(options.engine, options.quality)
+    params = {"model": separator.model_name, "stems": "vocals", "bitrate": options.bitrate}
+    if options.engine == "demucs" and options.quality != vr.DEFAULT_QUALITY:
+        # Keeps the keys of results cached before quality profiles existed
+        params["quality"] = options.quality
+    return cache.key(video_id, **params)
+
+
+def _mp3_path(job: Job) -> str:
+    return os.path.join(os.path.dirname(job.output_path), "final.mp3")
+
+
+def _mp4_path(job: Job) -> Optional[str]:
+    # MP3-only jobs point output_path at final.mp3 and never produce a video
+    return job.output_path if job.output_path.endswith(".mp4") else None
+
+
+def _store_result(cache_key: str, job: Job) -> None:
+    files = {}
+    if os.path.isfile(_mp3_path(job)):
+        files["final.mp3"] = _mp3_path(job)
+    if _mp4_path(job):
+        files["final.mp4"] = job.output_path
     try:
-        store.update(job_id, status=JobStatus.DOWNLOADING, progress_message="Downloading video…")
-        video_title = ytube.get_video_title(video_url)
-        ytube.download_video(video_url, tmp_dir)
+        cache.put(cache_key, job.title, files)
+    except Exception:
+        # A cache failure must never fail a job that has already succeeded
+        logger.exception("Could not cache result for %s", job.output_path)
+
+
+def _restore_result(job_id: str, cache_key: Optional[str], tmp_dir: str, output: str) -> bool:
+    entry = cache.get(cache_key) if cache_key else None
+    if not entry:
+        return False
+    if (output != "mp4" and not entry.has("final.mp3")) or (output != "mp3" and not entry.has("final.mp4")):
+        return False
+    files = {}
+    output_path = os.path.join(tmp_dir, "final.mp3")
+    if entry.has("final.mp3"):
+        files["final.mp3"] = output_path
+    if output != "mp3":
+        output_path = files["final.mp4"] = os.path.join(tmp_dir, utils.final_video_name(entry.title))
+    try:
+        cache.restore(entry, files)
+    except OSError:
+        logger.exception("Job %s: cached result %s unreadable, reprocessing", job_id, cache_key)
+        return False
+    store.update(job_id, title=entry.title)
+    store.set_done(job_id, output_path)
+    logger.info("Job %s served from cache: %s", job_id, output_path)
+    return True
+
+
+@dataclass
+class PipelineContext:
+    """State handed from one pipeline stage to the next."""
+    video_url: str
+    tmp_dir: str
+    output: str = "both"
+    bitrate: str = utils.AUDIO_BITRATE
+    engine: str = "demucs"
+    quality: str = vr.DEFAULT_QUALITY
+    cache_key: Optional[str] = None
+    title: str = ""
+    preview_length: Optional[float] = None  # set for previews: separate only this many seconds
+    preview_start: Optional[float] = None   # None picks the most replayed part
+
+
+def _download_stage(job_id: str, ctx: PipelineContext) -> None:
+    store.update(job_id, status=JobStatus.DOWNLOADING, progress_message="Fetching video info…")
+    info = ytube.probe(ctx.video_url)  # one extraction serves the title and the download
+    ctx.title = info.get("title", "")
+    store.update(job_id, title=f"{ctx.title} (preview)" if ctx.preview_length else ctx.title)
+
+    def report(progress: DownloadProgress) -> None:
+        store.update(
+            job_id,
+            progress=progress.fraction,
+            eta_seconds=progress.eta_seconds,
+            downloaded_bytes=progress.downloaded_bytes,
+            total_bytes=progress.total_bytes,
+            speed=progress.speed,
+        )
+
+    with meter.track(job_id, report) as hook:
+        if ctx.preview_length:
+            start = ctx.preview_start
+            if start is None:
+                start = ytube.preview_start(info, ctx.preview_length)
+            store.update(job_id, progress_message=f"Downloading a {ctx.preview_length:.0f}s excerpt…")
+            source = ytube.download_audio(
+                ctx.video_url, ctx.tmp_dir, info, progress_hooks=[hook], section=(start, start + ctx.preview_length)
+            )
+        elif ctx.output == "mp3":
+            store.update(job_id, progress_message="Downloading audio…")
+            source = ytube.download_audio(ctx.video_url, ctx.tmp_dir, info, progress_hooks=[hook])
+        else:
+            store.update(job_id, progress_message="Downloading video…")
+            source = ytube.download_video(ctx.video_url, ctx.tmp_dir, info, progress_hooks=[hook])
+
+    store.update(
+        job_id,
+        status=JobStatus.EXTRACTING,
+        progress_message="Extracting audio…",
+        progress=None,
+        eta_seconds=None,
+        speed=None,
+    )
+    ytube.extract_audio(ctx.tmp_dir, source)
+
+
+def _separation_stage(job_id: str, ctx: PipelineContext) -> None:
+    store.update(
+        job_id,
+        status=JobStatus.SEPARATING,
+        progress_message="Removing vocals (this takes a while)…",
+        progress=0.0,
+        eta_seconds=None,
+    )
+    started = time.monotonic()
+
+    def report(fraction: float) -> None:
+        elapsed = time.monotonic() - started
+        store.update(
+            job_id,
+            progress_message=f"Removing vocals… {fraction:.0%}",
+            progress=fraction,
+            eta_seconds=elapsed * (1 - fraction) / fraction if fraction else None,
+        )
+
+    vr.remove_vocals(
+        ctx.tmp_dir,
+        progress=report,
+        engine_name=ctx.engine,
+        quality=ctx.quality,
+        threads=vr.PREVIEW_THREADS if ctx.preview_length else None,
+    )
+
+
+def _encode_stage(job_id: str, ctx: PipelineContext) -> None:
+    store.update(
+        job_id, status=JobStatus.ENCODING, progress_message="Encoding karaoke outputs…", progress=None, eta_seconds=None
+    )
+    ve.encode_karaoke(ctx.tmp_dir, mp3=ctx.output != "mp4", mp4=ctx.output != "mp3", bitrate=ctx.bitrate)
+    output_path = os.path.join(ctx.tmp_dir, "final.mp3")
+    if ctx.output != "mp3":
+        output_path = utils.rename_final_video(ctx.tmp_dir, ctx.title, ctx.tmp_dir)
+
+    store.set_done(job_id, output_path)
+    logger.info("Job %s complete: %s", job_id, output_path)
+    if ctx.cache_key:
+        _store_result(ctx.cache_key, store.get(job_id))
+    _member_finished(job_id)
+
 
-        store.update(job_id, status=JobStatus.EXTRACTING, progress_message="Extracting audio…")
-        ytube.extract_audio(tmp_dir)
+PIPELINE = [
+    ("download", _download_stage),
+    ("separation", _separation_stage),
+    ("encode", _encode_stage),
+]
+# The fast engine takes seconds, so it runs on the encode workers instead of queueing behind Demucs
+FAST_PIPELINE = [
+    ("download", _download_stage),
+    ("encode", _separation_stage),
+    ("encode", _encode_stage),
+]
 
-        store.update(job_id, status=JobStatus.SEPARATING, progress_message="Removing vocals (this takes a while)…")
-        vr.remove_vocals(tmp_dir)
-        utils.copy_accompaniment_file(tmp_dir)
 
-        store.update(job_id, status=JobStatus.ENCODING, progress_message="Encoding karaoke video…")
-        utils.convert_wav_to_mp3(tmp_dir)
-        ve.create_karaoke_video(tmp_dir)
-        output_path = utils.rename_final_video(tmp_dir, video_title, tmp_dir)
+# A preview's excerpt is short enough to download, separate and encode on its own worker
+PREVIEW_PIPELINE = [
+    ("preview", _download_stage),
+    ("preview", _separation_stage),
+    ("preview", _encode_stage),
+]
 
-        store.set_done(job_id, output_path)
-        logger.info("Job %s complete: %s", job_id, output_path)
 
-    except Exception as exc:
-        logger.exception("Job %s failed", job_id)
-        store.set_error(job_id, str(exc))
+def _pipeline(engine: str) -> list:
+    return FAST_PIPELINE if engine == "fast" else PIPELINE
+
+
+def _fail_job(job_id: str, exc: Exception) -> None:
+    logger.error("Job %s failed", job_id, exc_info=exc)
+    store.set_error(job_id, str(exc))
+    _member_finished(job_id)
+
+
+def _settle_batch(batch_id: str) -> None:
+    # The batch is done once every one of its jobs has finished, successfully or not
+    members = store.members(batch_id)
+    batch = store.get(batch_id)
+    if batch and all(member.status in FINISHED for member in members):
+        failed = sum(member.status == JobStatus.ERROR for member in members)
+        # No output file of its own: the zip is streamed from the members' files on request
+        store.set_done(batch_id, "", message=f"{len(members) - failed} of {len(members)} ready")
+
+
+def _member_finished(job_id: str) -> None:
+    job = store.get(job_id)
+    if job and job.batch_id:
+        _settle_batch(job.batch_id)
+
+
+def _new_job(
+    video_url: str, options: JobOptions, batch_id: Optional[str] = None
+) -> tuple[str, Optional[PipelineContext]]:
+    """Create a job; returns it with the context to run the pipeline on, or None if served from the cache."""
+    job_id = uuid.uuid4().hex
+    tmp_dir = tempfile.mkdtemp(prefix="karaoke_")
+    store.create(job_id, work_dir=tmp_dir, batch_id=batch_id)
+    cache_key = _cache_key(video_url, options)
+    if _restore_result(job_id, cache_key, tmp_dir, options.output):
+        return job_id, None
+    return job_id, PipelineContext(
+        video_url=video_url,
+        tmp_dir=tmp_dir,
+        output=options.output,
+        bitrate=options.bitrate,
+        engine=options.engine,
+        quality=options.quality,
+        cache_key=cache_key,
+    )
+
+
+def _discard(job_id: str) -> None:
+    job = store.get(job_id)
+    store.delete(job_id)
+    if job and job.work_dir:
+        shutil.rmtree(job.work_dir, ignore_errors=True)
+
+
+def _queue_full() -> HTTPException:
+    return HTTPException(
+        status_code=503,
+        detail="Too many karaoke jobs waiting, try again later",
+        headers={"Retry-After": "30"},
+    )
+
+
+def _start_job(video_url: str, options: JobOptions) -> str:
+    job_id, ctx = _new_job(video_url, options)
+    if ctx:
+        try:
+            scheduler.submit(job_id, _pipeline(options.engine), ctx, on_error=_fail_job)
+        except QueueFull:
+            _discard(job_id)
+            raise _queue_full()
+    return job_id
 
 
 @app.post("/karaoke")
-def create_karaoke(req: KaraokeRequest, background_tasks: BackgroundTasks):
+def create_karaoke(req: KaraokeRequest):
+    return {"job_id": _start_job(req.video_url, req)}
+
+
+PREVIEW_SECONDS = 30.0
+# What a preview was started with, kept in its work dir so it can be promoted later
+_PREVIEW_FILE = "preview.json"
+
+
+class PreviewRequest(BaseModel):
+    video_url: str
+    start: Optional[float] = Field(None, ge=0)  # seconds; None picks the most replayed part
+    length: float = Field(PREVIEW_SECONDS, gt=0, le=60)
+    engine: Literal["demucs", "fast"] = "demucs"
+    quality: Literal["fast", "balanced", "best"] = vr.DEFAULT_QUALITY
+
+
+@app.post("/karaoke/preview")
+def create_preview(req: PreviewRequest):
+    """Separate a short excerpt into an MP3; only that section of the audio stream is downloaded."""
     job_id = uuid.uuid4().hex
     tmp_dir = tempfile.mkdtemp(prefix="karaoke_")
-    store.create(job_id)
-    background_tasks.add_task(_run_pipeline, job_id, req.video_url, tmp_dir)
+    store.create(job_id, work_dir=tmp_dir)
+    with open(os.path.join(tmp_dir, _PREVIEW_FILE), "w") as f:
+        json.dump({"video_url": req.video_url, "engine": req.engine, "quality": req.quality}, f)
+    ctx = PipelineContext(
+        video_url=req.video_url,
+        tmp_dir=tmp_dir,
+        output="mp3",
+        engine=req.engine,
+        quality=req.quality,
+        preview_length=req.length,
+        preview_start=req.start,
+    )
+    try:
+        scheduler.submit(job_id, PREVIEW_PIPELINE, ctx, on_error=_fail_job)
+    except QueueFull:
+        _discard(job_id)
+        raise _queue_full()
     return {"job_id": job_id}
 
 
+class PromoteRequest(BaseModel):
+    output: Literal["mp3", "mp4", "both"] = "both"
+    bitrate: Literal["128k", "192k", "256k", "320k"] = utils.AUDIO_BITRATE
+    engine: Optional[Literal["demucs", "fast"]] = None  # None keeps the preview's engine
+    quality: Optional[Literal["fast", "balanced", "best"]] = None  # None keeps the preview's quality
+
+
+@app.post("/karaoke/preview/{job_id}/promote")
+def promote_preview(job_id: str, req: Optional[PromoteRequest] = None):
+    """Start the full job for a preview's video; the preview's extraction is reused while it is cached."""
+    job = store.get(job_id)
+    preview_file = os.path.join(job.work_dir, _PREVIEW_FILE) if job and job.work_dir else None
+    if not preview_file or not os.path.isfile(preview_file):
+        raise HTTPException(status_code=404, detail="Preview not found")
+    with open(preview_file) as f:
+        preview = json.load(f)
+    req = req or PromoteRequest()
+    options = JobOptions(
+        output=req.output,
+        bitrate=req.bitrate,
+        engine=req.engine or preview["engine"],
+        quality=req.quality or preview.get("quality", vr.DEFAULT_QUALITY),
+    )
+    return {"job_id": _start_job(preview["video_url"], options)}
+
+
+# Videos per batch; independent of KARAOKE_MAX_QUEUE
+MAX_BATCH = int(os.environ.get("KARAOKE_MAX_BATCH", "100"))
+
+
+class BatchRequest(JobOptions):
+    video_urls: list[str] = []
+    playlist_url: Optional[str] = None  # expanded to its videos and appended to video_urls
+
+
+# Rough share of a job's processing time spent before each stage, and in it
+_STAGE_SPANS = {
+    JobStatus.QUEUED: (0.0, 0.0),
+    JobStatus.DOWNLOADING: (0.0, 0.2),
+    JobStatus.EXTRACTING: (0.2, 0.05),
+    JobStatus.SEPARATING: (0.25, 0.65),
+    JobStatus.ENCODING: (0.9, 0.1),
+}
+
+
+def _job_fraction(job: Job) -> float:
+    if job.status in FINISHED:
+        return 1.0
+    start, span = _STAGE_SPANS[job.status]
+    return start + span * (job.progress or 0.0)
+
+
+@app.post("/karaoke/batch")
+def create_batch(req: BatchRequest):
+    """Start one karaoke job per distinct video; the jobs share the stage worker pools and the loaded model."""
+    urls, title = list(req.video_urls), ""
+    if req.playlist_url:
+        try:
+            title, listed = ytube.expand_playlist(req.playlist_url, limit=MAX_BATCH + 1)
+        except RuntimeError as exc:
+            raise HTTPException(status_code=400, detail=str(exc))
+        urls += listed
+    unique, seen = [], set()
+    for url in urls:
+        # The same video under another URL form is still the same video
+        key = ytube.video_id(url) or url
+        if key not in seen:
+            seen.add(key)
+            unique.append(url)
+    if not unique:
+        raise HTTPException(status_code=400, detail="No videos to process")
+    if len(unique) > MAX_BATCH:
+        raise HTTPException(status_code=400, detail=f"A batch can hold at most {MAX_BATCH} videos")
+
+    batch_id = uuid.uuid4().hex
+    store.create(batch_id, work_dir=tempfile.mkdtemp(prefix="karaoke_"))
+    store.update(batch_id, title=title or f"Karaoke batch ({len(unique)} videos)")
+    job_ids, pending = [], []
+    for url in unique:
+        job_id, ctx = _new_job(url, req, batch_id=batch_id)
+        job_ids.append(job_id)
+        if ctx:
+            pending.append((job_id, (ctx,)))
+    # Never rejected for a busy queue: members past the free space are admitted as it drains
+    scheduler.feed(pending, _pipeline(req.engine), on_error=_fail_job)
+    if not pending:
+        _settle_batch(batch_id)  # every video came from the cache
+    return {"batch_id": batch_id, "job_ids": job_ids}
+
+
+def _get_batch(batch_id: str) -> tuple[Job, list[Job]]:
+    batch = store.get(batch_id)
+    members = store.members(batch_id)
+    if not batch or not members:
+        raise HTTPException(status_code=404, detail="Batch not found")
+    return batch, members
+
+
+@app.get("/karaoke/batch/{batch_id}")
+def get_batch(batch_id: str):
+    batch, members = _get_batch(batch_id)
+    return {
+        "batch_id": batch_id,
+        "title": batch.title,
+        "status": batch.status,
+        "progress_message": batch.progress_message,
+        "total": len(members),
+        "done": sum(job.status == JobStatus.DONE for job in members),
+        "failed": sum(job.status == JobStatus.ERROR for job in members),
+        "progress": sum(map(_job_fraction, members)) / len(members),
+        "jobs": [
+            {
+                "job_id": job.job_id,
+                "title": job.title,
+                "status": job.status,
+                "progress_message": job.progress_message,
+                "error": job.error,
+            }
+            for job in members
+        ],
+    }
+
+
+def _artifacts(job: Job) -> list[tuple[str, str]]:
+    """(path on disk, download name) of each file a finished job produced."""
+    files = []
+    if _mp4_path(job) and os.path.isfile(_mp4_path(job)):
+        files.append((_mp4_path(job), utils.final_video_name(job.title)))
+    if os.path.isfile(_mp3_path(job)):
+        files.append((_mp3_path(job), utils.final_audio_name(job.title)))
+    return files
+
+
+class _ZipSink(io.RawIOBase):
+    """Write-only, unseekable target for ZipFile; take() hands over what was written so far."""
+
+    def __init__(self):
+        self._buffer = bytearray()
+
+    def writable(self) -> bool:
+        return True
+
+    def write(self, data) -> int:
+        self._buffer += data
+        return len(data)
+
+    def take(self) -> bytes:
+        data = bytes(self._buffer)
+        self._buffer.clear()
+        return data
+
+
+_ARCHIVE_CHUNK = 1024 * 1024
+
+
+def _stream_archive(batch: Job, members: list[Job]) -> Iterator[bytes]:
+    """Zip every finished file of the batch plus a manifest.json, read straight from the members' files.
+
+    Nothing is written to disk and nothing is shared between requests, so
+    concurrent downloads, of the same batch or of others, never wait on each other.
+    """
+    sink = _ZipSink()
+    manifest = []
+    # Stored, not deflated: MP3 and MP4 are already compressed
+    with zipfile.ZipFile(sink, "w", compression=zipfile.ZIP_STORED) as archive:
+        for position, job in enumerate(members, start=1):
+            files = []
+            if job.status == JobStatus.DONE:
+                for src, name in _artifacts(job):
+                    files.append(f"{position:02d} - {name}")
+                    # from_file records the size up front, which decides whether the entry needs ZIP64
+                    info = zipfile.ZipInfo.from_file(src, files[-1])
+                    with open(src, "rb") as source, archive.open(info, "w") as entry:
+                        while chunk := source.read(_ARCHIVE_CHUNK):
+                            entry.write(chunk)
+                            yield sink.take()
+            manifest.append({
+                "position": position,
+                "job_id": job.job_id,
+                "title": job.title,
+                "status": job.status,
+                "error": job.error,
+                "files": files,
+            })
+        archive.writestr("manifest.json", json.dumps({"title": batch.title, "jobs": manifest}, indent=2))
+    yield sink.take()
+
+
+@app.get("/karaoke/batch/{batch_id}/zip")
+def get_batch_zip(batch_id: str):
+    batch, members = _get_batch(batch_id)
+    if batch.status != JobStatus.DONE:
+        raise HTTPException(status_code=409, detail="Batch not finished yet")
+    filename = utils.final_archive_name(batch.title)
+    # Same Content-Disposition as FileResponse: RFC 5987 form only when the title needs it
+    if quote(filename) == filename:
+        disposition = f'attachment; filename="{filename}"'
+    else:
+        disposition = f"attachment; filename*=utf-8''{quote(filename)}"
+    return StreamingResponse(
+        _stream_archive(batch, members),
+        media_type="application/zip",
+        headers={"Content-Disposition": disposition},
+    )
+
+
 @app.get("/status/{job_id}")
 def get_status(job_id: str):
     job = store.get(job_id)
     if not job:
         raise HTTPException(status_code=404, detail="Job not found")
+    waiting = scheduler.position(job_id)
+    queue_position = None
+    progress_message = job.progress_message
+    if waiting:
+        stage, queue_position = waiting
+        progress_message = f"Waiting for {stage} (position {queue_position})"
     return {
         "job_id": job.job_id,
         "status": job.status,
-        "progress_message": job.progress_message,
+        "progress_message": progress_message,
+        "queue_position": queue_position,
+        "progress": job.progress,
+        "eta_seconds": job.eta_seconds,
+        "downloaded_bytes": job.downloaded_bytes,
+        "total_bytes": job.total_bytes,
+        "speed": job.speed,
         "error": job.error,
     }
 
@@ -81,13 +624,16 @@ def get_file(job_id: str):
         raise HTTPException(status_code=500, detail=job.error)
     if job.status != JobStatus.DONE or not job.output_path:
         raise HTTPException(status_code=409, detail="File not ready yet")
-    if not os.path.isfile(job.output_path):
+    mp4_path = _mp4_path(job)
+    if not mp4_path:
+        raise HTTPException(status_code=404, detail="This job was run with output=mp3 and has no video")
+    if not os.path.isfile(mp4_path):
         raise HTTPException(status_code=404, detail="Output file missing on disk")
 
-    return FileResponse(
-        path=job.output_path,
+    return ArtifactResponse(
+        path=mp4_path,
         media_type="video/mp4",
-        filename=os.path.basename(job.output_path),
+        filename=os.path.basename(mp4_path),
     )
 
 
@@ -101,12 +647,15 @@ def get_mp3(job_id: str):
     if job.status != JobStatus.DONE or not job.output_path:
         raise HTTPException(status_code=409, detail="File not ready yet")
 
-    mp3_path = os.path.join(os.path.dirname(job.output_path), "final.mp3")
+    mp3_path = _mp3_path(job)
     if not os.path.isfile(mp3_path):
-        raise HTTPException(status_code=404, detail="MP3 file missing on disk")
+        raise HTTPException(status_code=404, detail="MP3 file missing on disk (jobs run with output=mp4 have none)")
 
-    mp3_filename = os.path.basename(job.output_path).replace(".mp4", ".mp3")
-    return FileResponse(
+    if job.title:
+        mp3_filename = utils.final_audio_name(job.title)
+    else:
+        mp3_filename = os.path.basename(job.output_path).replace(".mp4", ".mp3")
+    return ArtifactResponse(
         path=mp3_path,
         media_type="audio/mpeg",
         filename=mp3_filename,
@@ -132,12 +681,8 @@ def save_file(job_id: str, req: SaveRequest):
     if job.status != JobStatus.DONE or not job.output_path:
         raise HTTPException(status_code=409, detail="File not ready yet")
 
-    if req.file_type == "mp3":
-        src = os.path.join(os.path.dirname(job.output_path), "final.mp3")
-    else:
-        src = job.output_path
-
-    if not os.path.isfile(src):
+    src = _mp3_path(job) if req.file_type == "mp3" else _mp4_path(job)
+    if not src or not os.path.isfile(src):
         raise HTTPException(status_code=404, detail="Source file missing on disk")
 
     # Prevent path traversal outside OUTPUT_DIR
@@ -152,6 +697,11 @@ def save_file(job_id: str, req: SaveRequest):
     return {"saved_to": dest}
 
 
+@app.get("/metrics")
+def metrics():
+    return {"downloads": meter.snapshot()}
+
+
 @app.get("/health")
 def health():
     return {"status": "ok"}
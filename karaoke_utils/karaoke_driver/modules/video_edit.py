@@ -2,30 +2,62 @@ import logging
 import os
 import subprocess
 
+from modules.utils import AUDIO_BITRATE
+
 logger = logging.getLogger(__name__)
 
+# Encoder threads per output; 0 lets ffmpeg pick from the CPU count
+FFMPEG_THREADS = int(os.environ.get("FFMPEG_THREADS", "0"))
+# LAME algorithm quality, 0 (slowest, best) to 9 (fastest); empty keeps ffmpeg's default
+MP3_COMPRESSION_LEVEL = os.environ.get("FFMPEG_MP3_COMPRESSION_LEVEL", "")
+# Put the MP4 index up front so playback can start before the download finishes
+FASTSTART = os.environ.get("FFMPEG_FASTSTART", "true").lower() == "true"
+
+
+def _encoder_options() -> list[str]:
+    return ["-threads", str(FFMPEG_THREADS)] if FFMPEG_THREADS else []
+
 
-def create_karaoke_video(working_dir: str) -> None:
-    """Create karaoke MP4: original video with vocals-removed audio track."""
-    video_path = os.path.join(working_dir, "raw.mp4")
-    audio_path = os.path.join(working_dir, "final.mp3")
-    output_path = os.path.join(working_dir, "final.mp4")
-    result = subprocess.run(
-        [
-            "ffmpeg", "-y",
-            "-i", video_path,          # original video (has video + audio streams)
-            "-i", audio_path,          # instrumental audio
+def encode_karaoke(working_dir: str, mp3: bool = True, mp4: bool = True, bitrate: str = AUDIO_BITRATE) -> None:
+    """Encode final.mp3 and/or final.mp4 from accompaniment.wav in one ffmpeg run.
+
+    The accompaniment is decoded once and fed to both encoders; the MP4 keeps
+    the original video stream from raw.mp4 as is.
+    """
+    if not (mp3 or mp4):
+        raise ValueError("nothing to encode")
+    audio_path = os.path.join(working_dir, "accompaniment.wav")
+    cmd = ["ffmpeg", "-y"]
+    if mp4:
+        cmd += ["-i", os.path.join(working_dir, "raw.mp4")]  # original video (has video + audio streams)
+    cmd += ["-i", audio_path]                                # instrumental audio (PCM)
+    audio = "1:a:0" if mp4 else "0:a:0"
+
+    if mp4:
+        cmd += [
             "-map", "0:v:0",           # take video stream from raw.mp4
-            "-map", "1:a:0",           # take audio from instrumental
+            "-map", audio,             # take audio from instrumental
             "-c:v", "copy",            # copy video stream — no re-encode, fast
-            "-c:a", "aac", "-b:a", "192k",
+            "-c:a", "aac", "-b:a", bitrate,
+            *_encoder_options(),
             "-shortest",
-            output_path,
-        ],
-        capture_output=True,
-        text=True,
-    )
+        ]
+        if FASTSTART:
+            cmd += ["-movflags", "+faststart"]
+        cmd.append(os.path.join(working_dir, "final.mp4"))
+    if mp3:
+        cmd += [
+            "-map", audio,
+            "-vn", "-ar", "44100", "-ac", "2",
+            "-c:a", "libmp3lame", "-b:a", bitrate,
+            *_encoder_options(),
+        ]
+        if MP3_COMPRESSION_LEVEL:
+            cmd += ["-compression_level", MP3_COMPRESSION_LEVEL]
+        cmd.append(os.path.join(working_dir, "final.mp3"))
+
+    result = subprocess.run(cmd, capture_output=True, text=True)
     if result.returncode != 0:
         logger.error("ffmpeg stderr:\n%s", result.stderr[-1000:])
         raise RuntimeError(f"ffmpeg failed: {result.stderr[-300:]}")
-    logger.info("Karaoke video written to %s", output_path)
+    logger.info("Karaoke outputs written to %s (mp3=%s, mp4=%s)", working_dir, mp3, mp4)
@@ -1,50 +1,427 @@
 import logging
+import multiprocessing
 import os
-import shutil
-import subprocess
-from pathlib import Path
+import threading
+from collections import deque
+from concurrent.futures import Future, ProcessPoolExecutor
+from dataclasses import asdict, dataclass
+from typing import Callable, Optional
 
+import numpy as np
+import soundfile as sf
 import torch
+from demucs.apply import apply_model
+from demucs.pretrained import get_model
 
 logger = logging.getLogger(__name__)
 
+MODEL_NAME = os.environ.get("DEMUCS_MODEL", "htdemucs")
+CHUNK_SECONDS = float(os.environ.get("DEMUCS_CHUNK_SECONDS", "60"))
+OVERLAP_SECONDS = float(os.environ.get("DEMUCS_OVERLAP_SECONDS", "2"))
+PROCESSES = int(os.environ.get("DEMUCS_PROCESSES", "1"))
+# Torch threads per concurrent separation; 0 splits the CPU cores evenly between them
+THREADS = int(os.environ.get("DEMUCS_THREADS", "0"))
+# Torch threads for a preview's separation, on top of the full-length jobs' share
+PREVIEW_THREADS = int(os.environ.get("DEMUCS_PREVIEW_THREADS", "2"))
 
-def remove_vocals(working_dir: str) -> None:
-    audio_input = os.path.abspath(os.path.join(working_dir, "original.mp3"))
-    stems_dir = os.path.join(working_dir, "stems")
-
-    device = "cuda" if torch.cuda.is_available() else "cpu"
-    logger.info("Running demucs on device: %s", device)
-
-    result = subprocess.run(
-        [
-            "demucs",
-            "--two-stems=vocals",
-            "--device", device,
-            "-o", stems_dir,
-            audio_input,
-        ],
-        capture_output=True,
-        text=True,
-    )
-    if result.returncode != 0:
-        logger.error("demucs failed (rc=%d)\nstdout:\n%s\nstderr:\n%s",
-                     result.returncode, result.stdout[-2000:], result.stderr[-2000:])
-        raise RuntimeError(
-            f"demucs failed (rc={result.returncode}): "
-            f"{(result.stderr or result.stdout)[-500:] or 'no output'}"
-        )
-
-    # demucs outputs: stems/<model>/original/no_vocals.wav
-    no_vocals = next(Path(stems_dir).glob("*/original/no_vocals.wav"), None)
-    if not no_vocals:
-        raise RuntimeError(
-            f"demucs: no_vocals.wav not found under {stems_dir}. "
-            f"Contents: {list(Path(stems_dir).rglob('*.wav'))}"
-        )
-
-    # Place at working_dir/original/accompaniment.wav — where the rest of the pipeline expects it
-    out_dir = os.path.join(working_dir, "original")
-    os.makedirs(out_dir, exist_ok=True)
-    shutil.copy2(str(no_vocals), os.path.join(out_dir, "accompaniment.wav"))
-    logger.info("Vocal separation complete, accompaniment at %s/original/accompaniment.wav", working_dir)
+# Workers are spawned, not forked: forking after torch has started its thread pools can deadlock
+_MP_CONTEXT = "spawn"
+
+ProgressCallback = Callable[[float], None]
+
+
+@dataclass(frozen=True)
+class QualityProfile:
+    """How Demucs is run for one KaraokeRequest.quality value."""
+    model_name: str
+    shifts: int = 0                # extra passes on randomly shifted input, averaged; each costs a full pass
+    segment_overlap: float = 0.25  # overlap between the model's own segments; less overlap, less compute
+
+
+QUALITY_PROFILES = {
+    # Hybrid Demucs v3 has no transformer: roughly 40% less CPU time than
+    # htdemucs, with more vocal bleed on dense mixes
+    "fast": QualityProfile("hdemucs_mmi", segment_overlap=0.1),
+    # The configured model (htdemucs by default), one deterministic pass
+    "balanced": QualityProfile(MODEL_NAME),
+    # htdemucs_ft is a bag of four fine-tuned models, each run on two shifted
+    # copies: about eight times the compute of balanced, the cleanest vocals removal
+    "best": QualityProfile("htdemucs_ft", shifts=2),
+}
+
+
+def _chunk_bounds(total: int, chunk: int, overlap: int) -> list[tuple[int, int]]:
+    """[start, end) frame windows of at most chunk frames; neighbours share exactly overlap frames."""
+    bounds = []
+    start = 0
+    while True:
+        end = min(start + chunk, total)
+        bounds.append((start, end))
+        if end >= total:
+            return bounds
+        start += chunk - overlap
+
+
+def _mix_stats(f: sf.SoundFile, block: int) -> tuple[float, float]:
+    """Mean and std of the mono downmix, streamed so the whole track is never in memory."""
+    f.seek(0)
+    count, total, total_sq = 0, 0.0, 0.0
+    for data in f.blocks(blocksize=block, dtype="float32", always_2d=True):
+        mono = data.mean(axis=1, dtype=np.float64)
+        count += len(mono)
+        total += mono.sum()
+        total_sq += np.square(mono).sum()
+    mean = total / max(count, 1)
+    var = (total_sq - count * mean * mean) / max(count - 1, 1)
+    return mean, float(np.sqrt(max(var, 0.0))) + 1e-8
+
+
+class _CrossfadeWriter:
+    """Writes overlapping chunks in order, linearly crossfading each overlap region."""
+
+    def __init__(self, out: sf.SoundFile, overlap: int):
+        self._out = out
+        self._overlap = overlap
+        self._tail: Optional[np.ndarray] = None
+
+    def write(self, chunk: np.ndarray) -> None:
+        if self._tail is not None:
+            n = len(self._tail)
+            fade = np.linspace(0.0, 1.0, n, dtype=np.float32)[:, None]
+            chunk = chunk.copy()
+            chunk[:n] = self._tail * (1.0 - fade) + chunk[:n] * fade
+        if self._overlap:
+            self._out.write(np.clip(chunk[:-self._overlap], -1.0, 1.0))
+            self._tail = chunk[-self._overlap:]
+        else:
+            self._out.write(np.clip(chunk, -1.0, 1.0))
+
+    def close(self) -> None:
+        if self._tail is not None:
+            self._out.write(np.clip(self._tail, -1.0, 1.0))
+            self._tail = None
+
+
+def _separate_chunk(
+    model, device: str, data: np.ndarray, mean: float, std: float, shifts: int = 0, overlap: float = 0.25
+) -> np.ndarray:
+    """Accompaniment (every stem except vocals) of a (frames, channels) chunk, same layout."""
+    wav = torch.from_numpy(np.ascontiguousarray(data.T))
+    # Same normalisation the demucs CLI applies before inference, with whole-track statistics
+    # shifts=0 (all but the "best" profile) keeps the result deterministic, so chunked and parallel runs agree
+    with torch.no_grad():
+        sources = apply_model(model, ((wav - mean) / std)[None], shifts=shifts, overlap=overlap, device=device)[0]
+    sources = sources * std + mean
+    vocals = model.sources.index("vocals")
+    no_vocals = sources.sum(0) - sources[vocals]
+    return no_vocals.cpu().numpy().T
+
+
+def _load_model(model_name: str, device: str):
+    model = get_model(model_name)
+    model.to(device)
+    model.eval()
+    return model
+
+
+def thread_budget(concurrent_jobs: int) -> int:
+    """Torch threads one separation may use when concurrent_jobs of them run at once."""
+    return THREADS or max(1, (os.cpu_count() or 1) // max(concurrent_jobs, 1))
+
+
+# Threads available to each running separation, set by configure_threads
+_job_threads = thread_budget(1)
+
+
+def configure_threads(concurrent_jobs: int) -> int:
+    """Split the CPU between concurrent_jobs separations so they don't oversubscribe the cores.
+
+    Two jobs each running with all cores would fight over them. Pools
+    started afterwards split each job's share between their worker processes.
+    """
+    global _job_threads
+    _job_threads = thread_budget(concurrent_jobs)
+    torch.set_num_threads(_job_threads)
+    logger.info("Separation uses %d torch thread(s) per job for %d concurrent job(s)", _job_threads, concurrent_jobs)
+    return _job_threads
+
+
+# Per-process state of separation pool workers
+_worker_model = None
+
+
+def _init_worker(model_name: str, threads: int) -> None:
+    global _worker_model
+    torch.set_num_threads(threads)
+    _worker_model = _load_model(model_name, "cpu")
+
+
+def _worker_separate(data: np.ndarray, mean: float, std: float, shifts: int, overlap: float) -> np.ndarray:
+    return _separate_chunk(_worker_model, "cpu", data, mean, std, shifts, overlap)
+
+
+class SeparationEngine:
+    """Long-lived Demucs separator that keeps the model weights resident between jobs.
+
+    Tracks are processed in overlapping chunks that are crossfaded and written
+    to disk as they finish, so peak memory depends on the chunk length rather
+    than the track length.
+
+    With processes > 1 (CPU only) the chunks of a track are separated in
+    parallel by a pool of worker processes, each loading the model once.
+    Chunk boundaries and crossfades are identical to the in-process path, so
+    both produce the same accompaniment to within 1 LSB of 16-bit PCM (float
+    reductions may round differently with a different thread count). That
+    holds for shifts=0 only: shifted passes use random offsets.
+    """
+
+    def __init__(
+        self,
+        model_name: str = MODEL_NAME,
+        chunk_seconds: float = CHUNK_SECONDS,
+        overlap_seconds: float = OVERLAP_SECONDS,
+        processes: int = PROCESSES,
+        shifts: int = 0,
+        segment_overlap: float = 0.25,
+    ):
+        if overlap_seconds >= chunk_seconds:
+            raise ValueError("overlap_seconds must be shorter than chunk_seconds")
+        self.model_name = model_name
+        self.chunk_seconds = chunk_seconds
+        self.overlap_seconds = overlap_seconds
+        self.shifts = shifts
+        self.segment_overlap = segment_overlap
+        self.device = "cuda" if torch.cuda.is_available() else "cpu"
+        self.processes = processes if self.device == "cpu" else 1
+        self._model = None
+        self._pool: Optional[ProcessPoolExecutor] = None
+        self._lock = threading.Lock()
+
+    @property
+    def loaded(self) -> bool:
+        return self._model is not None
+
+    def load(self):
+        """Load the model on first use; later calls return the resident instance."""
+        with self._lock:
+            if self._model is None:
+                logger.info("Loading demucs model %s on device: %s", self.model_name, self.device)
+                self._model = _load_model(self.model_name, self.device)
+        return self._model
+
+    def _get_pool(self) -> ProcessPoolExecutor:
+        with self._lock:
+            if self._pool is None:
+                threads = max(1, _job_threads // self.processes)
+                logger.info("Starting %d separation processes with %d threads each", self.processes, threads)
+                self._pool = ProcessPoolExecutor(
+                    max_workers=self.processes,
+                    mp_context=multiprocessing.get_context(_MP_CONTEXT),
+                    initializer=_init_worker,
+                    initargs=(self.model_name, threads),
+                )
+        return self._pool
+
+    def close(self) -> None:
+        with self._lock:
+            if self._pool is not None:
+                self._pool.shutdown(cancel_futures=True)
+                self._pool = None
+
+    def separate(self, audio_input: str, output_path: str, progress: Optional[ProgressCallback] = None) -> None:
+        """Write the accompaniment of the WAV audio_input to output_path (16-bit PCM, clamped).
+
+        progress, if given, is called with the fraction of the track done after each chunk.
+        """
+        model = self.load()
+        with sf.SoundFile(audio_input) as f:
+            if f.samplerate != model.samplerate or f.channels != model.audio_channels:
+                raise RuntimeError(
+                    f"{audio_input} is {f.samplerate} Hz / {f.channels} ch, "
+                    f"model expects {model.samplerate} Hz / {model.audio_channels} ch"
+                )
+            if not f.frames:
+                raise RuntimeError(f"{audio_input} contains no audio")
+            chunk = int(self.chunk_seconds * f.samplerate)
+            overlap = int(self.overlap_seconds * f.samplerate)
+            mean, std = _mix_stats(f, chunk)
+            bounds = _chunk_bounds(f.frames, chunk, overlap)
+
+            with sf.SoundFile(
+                output_path, "w", samplerate=f.samplerate, channels=f.channels, subtype="PCM_16"
+            ) as out:
+                writer = _CrossfadeWriter(out, overlap)
+
+                def emit(end: int, accompaniment: np.ndarray) -> None:
+                    writer.write(accompaniment)
+                    if progress:
+                        progress(end / f.frames)
+
+                if self.processes > 1:
+                    pool = self._get_pool()
+                    # A bounded window of chunks in flight keeps memory flat; results are written in order
+                    in_flight: deque[tuple[int, Future]] = deque()
+                    for start, end in bounds:
+                        f.seek(start)
+                        data = f.read(end - start, dtype="float32", always_2d=True)
+                        in_flight.append((end, pool.submit(_worker_separate, data, mean, std, self.shifts, self.segment_overlap)))
+                        if len(in_flight) >= 2 * self.processes:
+                            done_end, future = in_flight.popleft()
+                            emit(done_end, future.result())
+                    while in_flight:
+                        done_end, future = in_flight.popleft()
+                        emit(done_end, future.result())
+                else:
+                    for start, end in bounds:
+                        f.seek(start)
+                        data = f.read(end - start, dtype="float32", always_2d=True)
+                        emit(end, _separate_chunk(
+                            model, self.device, data, mean, std, self.shifts, self.segment_overlap
+                        ))
+                writer.close()
+        logger.info("Separated %s in %d chunk(s)", audio_input, len(bounds))
+
+
+def _frames(x: np.ndarray, n_fft: int, hop: int) -> np.ndarray:
+    """(channels, frames, n_fft) windows of the (channels, samples) signal x, padded by n_fft // 2 at each end."""
+    n = x.shape[1]
+    padded_len = -(-(n + n_fft) // hop) * hop + n_fft
+    x = np.pad(x, ((0, 0), (n_fft // 2, padded_len - n - n_fft // 2)))
+    return np.lib.stride_tricks.sliding_window_view(x, n_fft, axis=1)[:, ::hop]
+
+
+def _overlap_add(frames: np.ndarray, hop: int) -> np.ndarray:
+    """Inverse of _frames for a signal: sums (channels, frames, n_fft) windows hop samples apart."""
+    channels, count, n_fft = frames.shape
+    out = np.zeros((channels, (count - 1) * hop + n_fft), dtype=frames.dtype)
+    # Every n_fft // hop-th frame tiles the signal without overlap, so each group is one vectorised add
+    for k in range(n_fft // hop):
+        group = frames[:, k::n_fft // hop]
+        start = k * hop
+        out[:, start:start + group.shape[1] * n_fft] += group.reshape(channels, -1)
+    return out
+
+
+class CenterCancelEngine:
+    """Vocal removal by cancelling what is panned to the centre, in the STFT domain.
+
+    For each time-frequency bin the left and right channels are compared; the
+    more alike they are, the more of their common (mid) part is removed from
+    both. Only the vocal band is touched, because bass and kick drum are
+    usually centred too. It is approximate (centred instruments go, reverb
+    on the voice stays) but needs no model and runs many times faster than
+    real time, so it suits previews and hosts that cannot run Demucs.
+    """
+
+    model_name = "center-cancel"
+
+    def __init__(
+        self,
+        n_fft: int = 4096,
+        low_hz: float = 120.0,
+        high_hz: float = 8000.0,
+        sharpness: float = 4.0,
+        chunk_seconds: float = 30.0,
+        overlap_seconds: float = 1.0,
+    ):
+        self.n_fft = n_fft
+        self.hop = n_fft // 4
+        self.low_hz = low_hz
+        self.high_hz = high_hz
+        self.sharpness = sharpness
+        self.chunk_seconds = chunk_seconds
+        self.overlap_seconds = overlap_seconds
+        self.window = np.hanning(n_fft + 1)[:-1].astype(np.float32)  # periodic Hann
+
+    def separate_chunk(self, data: np.ndarray, samplerate: int) -> np.ndarray:
+        """Accompaniment of a (frames, 2) chunk, same layout."""
+        x = np.ascontiguousarray(data.T, dtype=np.float32)
+        spec = np.fft.rfft(_frames(x, self.n_fft, self.hop) * self.window, axis=-1)
+        left, right = spec
+        # 1 where the channels are identical, 0 where either is silent or they are in antiphase
+        similarity = 2 * np.abs(left * right.conj()) / (np.abs(left) ** 2 + np.abs(right) ** 2 + 1e-12)
+        # Only in-phase content is centred; antiphase content is wide, not a centred voice
+        in_phase = np.real(left * right.conj()) > 0
+        freqs = np.fft.rfftfreq(self.n_fft, 1 / samplerate)
+        band = (freqs >= self.low_hz) & (freqs <= self.high_hz)
+        mask = np.where(in_phase & band, similarity ** self.sharpness, 0.0).astype(np.float32)
+        spec = spec - mask * (left + right) / 2
+
+        frames = np.fft.irfft(spec, n=self.n_fft, axis=-1).astype(np.float32) * self.window
+        norm = _overlap_add(np.broadcast_to(self.window ** 2, frames.shape[1:])[None], self.hop)[0]
+        out = _overlap_add(frames, self.hop) / np.maximum(norm, 1e-8)
+        start = self.n_fft // 2
+        return out[:, start:start + len(data)].T
+
+    def separate(self, audio_input: str, output_path: str, progress: Optional[ProgressCallback] = None) -> None:
+        """Same contract as SeparationEngine.separate; needs a stereo input."""
+        with sf.SoundFile(audio_input) as f:
+            if f.channels != 2:
+                raise RuntimeError(f"{audio_input} has {f.channels} channel(s); centre cancellation needs stereo")
+            if not f.frames:
+                raise RuntimeError(f"{audio_input} contains no audio")
+            chunk = int(self.chunk_seconds * f.samplerate)
+            overlap = int(self.overlap_seconds * f.samplerate)
+            bounds = _chunk_bounds(f.frames, chunk, overlap)
+            with sf.SoundFile(
+                output_path, "w", samplerate=f.samplerate, channels=f.channels, subtype="PCM_16"
+            ) as out:
+                writer = _CrossfadeWriter(out, overlap)
+                for start, end in bounds:
+                    f.seek(start)
+                    data = f.read(end - start, dtype="float32", always_2d=True)
+                    writer.write(self.separate_chunk(data, f.samplerate))
+                    if progress:
+                        progress(end / f.frames)
+                writer.close()
+        logger.info("Centre-cancelled %s in %d chunk(s)", audio_input, len(bounds))
+
+
+DEFAULT_QUALITY = "balanced"
+engine = SeparationEngine(**asdict(QUALITY_PROFILES[DEFAULT_QUALITY]))
+fast_engine = CenterCancelEngine()
+# Demucs engines for the other quality profiles, created on first use
+_quality_engines: dict[str, SeparationEngine] = {}
+_quality_lock = threading.Lock()
+
+
+def get_engine(name: str, quality: str = DEFAULT_QUALITY):
+    """The separator behind a KaraokeRequest's engine ("demucs" or "fast") and quality profile.
+
+    The quality profile only applies to Demucs.
+    """
+    if name == "fast":
+        return fast_engine
+    if quality == DEFAULT_QUALITY:
+        return engine
+    with _quality_lock:
+        if quality not in _quality_engines:
+            _quality_engines[quality] = SeparationEngine(**asdict(QUALITY_PROFILES[quality]))
+        return _quality_engines[quality]
+
+
+def close_engines() -> None:
+    """Stop the worker pools of every Demucs engine."""
+    engine.close()
+    with _quality_lock:
+        for quality_engine in _quality_engines.values():
+            quality_engine.close()
+
+
+def remove_vocals(
+    working_dir: str,
+    progress: Optional[ProgressCallback] = None,
+    engine_name: str = "demucs",
+    quality: str = DEFAULT_QUALITY,
+    threads: Optional[int] = None,
+) -> None:
+    """Separate working_dir/original.wav and write the result straight to working_dir/accompaniment.wav.
+
+    threads overrides the per-job torch thread count set by configure_threads.
+    """
+    # torch's OpenMP backend keeps the thread count per calling thread, so each job sets its own
+    torch.set_num_threads(threads or _job_threads)
+    audio_input = os.path.join(working_dir, "original.wav")
+    output_path = os.path.join(working_dir, "accompaniment.wav")
+    get_engine(engine_name, quality).separate(audio_input, output_path, progress)
+    logger.info("Vocal separation (%s, %s) complete, accompaniment at %s", engine_name, quality, output_path)
@@ -1,47 +1,180 @@
+import copy
 import logging
 import os
 import subprocess
+import threading
+import time
+from collections import OrderedDict
+from pathlib import Path
+from typing import Callable, Optional, Sequence
+
+import yt_dlp
+
+from common.youtube_url import video_id
 
 logger = logging.getLogger(__name__)
 
 
+class _InfoCache:
+    """Small LRU of raw yt-dlp info dicts that expire after ttl_seconds."""
+
+    def __init__(self, maxsize: int, ttl_seconds: float):
+        self.maxsize = maxsize
+        self.ttl_seconds = ttl_seconds
+        self._lock = threading.Lock()
+        self._items: OrderedDict[str, tuple[float, dict]] = OrderedDict()
+
+    def get(self, key: str) -> Optional[dict]:
+        with self._lock:
+            item = self._items.get(key)
+            if not item or item[0] < time.monotonic():
+                self._items.pop(key, None)
+                return None
+            self._items.move_to_end(key)
+            return item[1]
+
+    def put(self, key: str, info: dict) -> None:
+        with self._lock:
+            self._items[key] = (time.monotonic() + self.ttl_seconds, info)
+            self._items.move_to_end(key)
+            while len(self._items) > self.maxsize:
+                self._items.popitem(last=False)
+
+
+# Stream URLs in an info dict stay valid for hours, so a few minutes of reuse is safe
+info_cache = _InfoCache(
+    maxsize=int(os.environ.get("YTDLP_INFO_CACHE_SIZE", "32")),
+    ttl_seconds=float(os.environ.get("YTDLP_INFO_CACHE_SECONDS", "300")),
+)
+
+_BASE_OPTS = {"quiet": True, "no_warnings": True, "noplaylist": True}
+
+
+def probe(link: str) -> dict:
+    """Extract the video page once and return yt-dlp's unprocessed info dict.
+
+    The result is cached briefly per video and handed to download_video /
+    download_audio, which then select formats and download without a second
+    extraction. Callers get their own copy because yt-dlp mutates it.
+    """
+    key = video_id(link) or link
+    info = info_cache.get(key)
+    if info is None:
+        try:
+            with yt_dlp.YoutubeDL(_BASE_OPTS) as ydl:
+                info = ydl.extract_info(link, download=False, process=False)
+        except yt_dlp.utils.DownloadError as exc:
+            raise RuntimeError(f"yt-dlp could not read {link}: {exc}") from exc
+        info_cache.put(key, info)
+        logger.info("Probed %s: %s (%ss)", info.get("id"), info.get("title"), info.get("duration"))
+    return copy.deepcopy(info)
+
+
+def expand_playlist(link: str, limit: int) -> tuple[str, list[str]]:
+    """Title and video URLs of the playlist at link, at most limit of them.
+
+    Only the playlist page is read (flat extraction), not each video. A link
+    to a single video expands to itself.
+    """
+    opts = {"quiet": True, "no_warnings": True, "extract_flat": "in_playlist", "playlistend": limit}
+    try:
+        with yt_dlp.YoutubeDL(opts) as ydl:
+            info = ydl.extract_info(link, download=False)
+    except yt_dlp.utils.DownloadError as exc:
+        raise RuntimeError(f"yt-dlp could not read {link}: {exc}") from exc
+    if info.get("_type") != "playlist":
+        return info.get("title", ""), [link]
+    urls = [
+        entry.get("url") or f"https://www.youtube.com/watch?v={entry['id']}"
+        for entry in info.get("entries") or []
+        if entry and (entry.get("url") or entry.get("id"))
+    ]
+    logger.info("Expanded playlist %s: %d videos", info.get("title"), len(urls))
+    return info.get("title", ""), urls[:limit]
+
+
 def get_video_title(link: str) -> str:
-    result = subprocess.run(
-        ["yt-dlp", "--print", "%(title)s", "--no-playlist", link],
-        capture_output=True,
-        text=True,
-        check=True,
-    )
-    return result.stdout.strip()
+    return probe(link).get("title", "")
+
 
+def _download(
+    link: str, info: Optional[dict], opts: dict, what: str, progress_hooks: Sequence[Callable[[dict], None]]
+) -> None:
+    try:
+        with yt_dlp.YoutubeDL({**_BASE_OPTS, **opts, "progress_hooks": list(progress_hooks)}) as ydl:
+            ydl.process_ie_result(info if info is not None else probe(link), download=True)
+    except yt_dlp.utils.DownloadError as exc:
+        raise RuntimeError(f"yt-dlp {what} download failed: {exc}") from exc
 
-def download_video(link: str, tmp_dir: str) -> None:
-    """Download full YouTube video (video + audio merged) as raw.mp4."""
+
+def download_video(
+    link: str, tmp_dir: str, info: Optional[dict] = None, progress_hooks: Sequence[Callable[[dict], None]] = ()
+) -> str:
+    """Download full YouTube video (video + audio merged) as raw.mp4, reusing info from probe().
+
+    progress_hooks are yt-dlp progress hooks, called as each stream downloads.
+    """
     output_path = os.path.join(tmp_dir, "raw.mp4")
-    result = subprocess.run(
-        [
-            "yt-dlp",
-            "-f", "bestvideo[ext=mp4]+bestaudio[ext=m4a]/bestvideo+bestaudio/best",
-            "--merge-output-format", "mp4",
-            "--no-playlist",
-            "-o", output_path,
-            link,
-        ],
-        capture_output=True,
-        text=True,
+    _download(
+        link,
+        info,
+        {
+            "format": "bestvideo[ext=mp4]+bestaudio[ext=m4a]/bestvideo+bestaudio/best",
+            "merge_output_format": "mp4",
+            "outtmpl": output_path,
+        },
+        "video",
+        progress_hooks,
     )
-    if result.returncode != 0:
-        logger.error("yt-dlp stderr:\n%s", result.stderr[-2000:])
-        raise RuntimeError(f"yt-dlp video download failed: {result.stderr[-500:]}")
     logger.info("Downloaded video to %s", output_path)
+    return output_path
+
+
+def download_audio(
+    link: str,
+    tmp_dir: str,
+    info: Optional[dict] = None,
+    progress_hooks: Sequence[Callable[[dict], None]] = (),
+    section: Optional[tuple[float, float]] = None,
+) -> str:
+    """Download only the best audio stream (no video) as raw_audio.<ext>, reusing info from probe().
+
+    section, a (start, end) in seconds, fetches just that part of the stream,
+    like yt-dlp's --download-sections.
+    """
+    opts = {"format": "bestaudio/best", "outtmpl": os.path.join(tmp_dir, "raw_audio.%(ext)s")}
+    if section:
+        opts["download_ranges"] = yt_dlp.utils.download_range_func(None, [section])
+    _download(link, info, opts, "audio", progress_hooks)
+    output_path = next(Path(tmp_dir).glob("raw_audio.*"), None)
+    if not output_path:
+        raise RuntimeError(f"yt-dlp reported success but no audio file in {tmp_dir}")
+    logger.info("Downloaded audio to %s", output_path)
+    return str(output_path)
+
+
+def preview_start(info: dict, length: float) -> float:
+    """Where a length-second preview should start, in seconds.
+
+    YouTube's "most replayed" heatmap usually peaks at the chorus, so the
+    preview is centred on its peak; without one it starts a third of the way in.
+    """
+    duration = info.get("duration") or 0
+    heatmap = info.get("heatmap") or []
+    if heatmap:
+        peak = max(heatmap, key=lambda marker: marker.get("value", 0))
+        start = (peak["start_time"] + peak["end_time"]) / 2 - length / 2
+    else:
+        start = duration / 3
+    return max(0.0, min(start, duration - length)) if duration else 0.0
 
 
-def extract_audio(tmp_dir: str) -> None:
-    """Extract audio track from raw.mp4 → original.mp3 using ffmpeg."""
-    src = os.path.join(tmp_dir, "raw.mp4")
-    dst = os.path.join(tmp_dir, "original.mp3")
+def extract_audio(tmp_dir: str, src: Optional[str] = None) -> None:
+    """Decode the audio track of src (default raw.mp4) once → original.wav (16-bit PCM, 44.1 kHz stereo)."""
+    src = src or os.path.join(tmp_dir, "raw.mp4")
+    dst = os.path.join(tmp_dir, "original.wav")
     result = subprocess.run(
-        ["ffmpeg", "-y", "-i", src, "-vn", "-ar", "44100", "-ac", "2", "-b:a", "192k", dst],
+        ["ffmpeg", "-y", "-i", src, "-vn", "-ar", "44100", "-ac", "2", "-c:a", "pcm_s16le", dst],
         capture_output=True,
         text=True,
     )
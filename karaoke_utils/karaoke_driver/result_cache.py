@@ -0,0 +1,133 @@
+import hashlib
+import json
+import logging
+import os
+import shutil
+import threading
+import uuid
+from dataclasses import dataclass
+from typing import Optional
+
+logger = logging.getLogger(__name__)
+
+META_FILE = "meta.json"
+
+
+def _link_or_copy(src: str, dst: str) -> None:
+    """Hard-link when src and dst share a filesystem, otherwise fall back to a copy."""
+    try:
+        os.link(src, dst)
+    except OSError:
+        shutil.copy2(src, dst)
+
+
+def _dir_size(path: str) -> int:
+    total = 0
+    for entry in os.scandir(path):
+        if entry.is_file(follow_symlinks=False):
+            total += entry.stat(follow_symlinks=False).st_size
+    return total
+
+
+@dataclass
+class CacheEntry:
+    key: str
+    path: str
+    title: str
+
+    def file(self, name: str) -> str:
+        return os.path.join(self.path, name)
+
+    def has(self, name: str) -> bool:
+        return os.path.isfile(self.file(name))
+
+
+class ResultCache:
+    """On-disk, size-capped LRU cache of finished karaoke outputs.
+
+    Each entry is a directory named after the cache key holding the final
+    artifacts plus a meta.json; the meta file's mtime is the LRU timestamp,
+    so the cache survives restarts without a separate index.
+    """
+
+    def __init__(self, root: str, max_bytes: int):
+        self.root = root
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        if self.enabled:
+            os.makedirs(root, exist_ok=True)
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_bytes > 0
+
+    @staticmethod
+    def key(video_id: str, **params) -> str:
+        payload = json.dumps({"video_id": video_id, **params}, sort_keys=True)
+        return hashlib.sha256(payload.encode()).hexdigest()
+
+    def get(self, key: str) -> Optional[CacheEntry]:
+        if not self.enabled:
+            return None
+        path = os.path.join(self.root, key)
+        meta_path = os.path.join(path, META_FILE)
+        with self._lock:
+            try:
+                with open(meta_path) as f:
+                    meta = json.load(f)
+                os.utime(meta_path)  # mark as most recently used
+            except (OSError, ValueError):
+                return None
+        return CacheEntry(key=key, path=path, title=meta.get("title", ""))
+
+    def put(self, key: str, title: str, files: dict[str, str]) -> None:
+        """Store files (cache name → source path) under key, replacing any previous entry."""
+        if not self.enabled:
+            return
+        staging = os.path.join(self.root, f".{key}.{uuid.uuid4().hex}")
+        os.makedirs(staging)
+        try:
+            for name, src in files.items():
+                _link_or_copy(src, os.path.join(staging, name))
+            with open(os.path.join(staging, META_FILE), "w") as f:
+                json.dump({"title": title}, f)
+
+            with self._lock:
+                target = os.path.join(self.root, key)
+                if os.path.isdir(target):
+                    shutil.rmtree(target)
+                os.replace(staging, target)
+                self._evict()
+        finally:
+            shutil.rmtree(staging, ignore_errors=True)
+        logger.info("Cached result %s (%s)", key, title)
+
+    def _evict(self) -> None:
+        entries = []
+        for entry in os.scandir(self.root):
+            if entry.name.startswith(".") or not entry.is_dir():
+                continue
+            try:
+                last_used = os.stat(os.path.join(entry.path, META_FILE)).st_mtime
+            except OSError:
+                last_used = 0.0
+            entries.append((last_used, _dir_size(entry.path), entry.path))
+
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            shutil.rmtree(path, ignore_errors=True)
+            total -= size
+            logger.info("Evicted cached result %s", os.path.basename(path))
+
+    def restore(self, entry: CacheEntry, files: dict[str, str]) -> None:
+        """Materialise cached files (cache name → destination path) into a job directory."""
+        for name, dst in files.items():
+            _link_or_copy(entry.file(name), dst)
+
+
+cache = ResultCache(
+    root=os.environ.get("KARAOKE_CACHE_DIR", "/tmp/karaoke_cache"),
+    max_bytes=int(os.environ.get("KARAOKE_CACHE_MAX_MB", "5120")) * 1024 * 1024,
+)
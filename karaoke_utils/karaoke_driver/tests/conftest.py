@@ -0,0 +1,7 @@
+import os
+import sys
+
+# Keep test jobs out of the service's on-disk job database
+os.environ.setdefault("JOB_DB_PATH", ":memory:")
+# In the source tree the shared package sits next to the service; the image copies it into /app
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", ".."))
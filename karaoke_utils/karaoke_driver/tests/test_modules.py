@@ -4,9 +4,13 @@ import subprocess
 from pathlib import Path
 from unittest.mock import MagicMock, call, patch
 
+import numpy as np
 import pytest
+import soundfile as sf
+import torch
 
-from modules.utils import _safe_filename, copy_accompaniment_file, convert_wav_to_mp3, rename_final_video
+import modules.video_edit as video_edit
+from modules.utils import _safe_filename, rename_final_video
 
 
 # ── utils.py ──────────────────────────────────────────────────────────────────
@@ -22,37 +26,6 @@ def test_safe_filename_empty_becomes_default():
     assert _safe_filename(":/<>") == "karaoke_output"
 
 
-def test_copy_accompaniment_file(tmp_path):
-    sub = tmp_path / "original"
-    sub.mkdir()
-    src = sub / "accompaniment.wav"
-    src.write_bytes(b"RIFF")
-
-    copy_accompaniment_file(str(tmp_path))
-    dst = tmp_path / "accompaniment.wav"
-    assert dst.exists()
-    assert dst.read_bytes() == b"RIFF"
-
-
-@patch("modules.utils.subprocess.run")
-def test_convert_wav_to_mp3_calls_ffmpeg(mock_run, tmp_path):
-    mock_run.return_value = MagicMock(returncode=0, stderr="")
-    convert_wav_to_mp3(str(tmp_path))
-
-    call_args = mock_run.call_args[0][0]
-    assert "ffmpeg" in call_args
-    assert str(tmp_path / "accompaniment.wav") in call_args
-    assert str(tmp_path / "final.mp3") in call_args
-    assert "192k" in call_args
-
-
-@patch("modules.utils.subprocess.run")
-def test_convert_wav_to_mp3_raises_on_failure(mock_run, tmp_path):
-    mock_run.return_value = MagicMock(returncode=1, stderr="codec error")
-    with pytest.raises(RuntimeError, match="ffmpeg failed"):
-        convert_wav_to_mp3(str(tmp_path))
-
-
 def test_rename_final_video(tmp_path):
     src = tmp_path / "final.mp4"
     src.write_bytes(b"\x00")
@@ -71,39 +44,480 @@ def test_rename_final_video_sanitises_title(tmp_path):
     assert "Bad Title.mp4" in result
 
 
+# ── video_edit.py ─────────────────────────────────────────────────────────────
+
+def _outputs(cmd):
+    """Map each output path in an ffmpeg command line to the options that precede it."""
+    outputs, options = {}, []
+    last_input = max(i for i, arg in enumerate(cmd) if arg == "-i")
+    for arg in cmd[last_input + 2:]:
+        if arg.endswith((".mp3", ".mp4")):
+            outputs[os.path.basename(arg)], options = options, []
+        else:
+            options.append(arg)
+    return outputs
+
+
+@patch("modules.video_edit.subprocess.run")
+def test_encode_karaoke_writes_both_outputs_in_one_run(mock_run, tmp_path):
+    mock_run.return_value = MagicMock(returncode=0, stderr="")
+    video_edit.encode_karaoke(str(tmp_path), bitrate="256k")
+
+    mock_run.assert_called_once()
+    cmd = mock_run.call_args[0][0]
+    assert [cmd[i + 1] for i, arg in enumerate(cmd) if arg == "-i"] == [
+        str(tmp_path / "raw.mp4"), str(tmp_path / "accompaniment.wav"),
+    ]
+    outputs = _outputs(cmd)
+    assert list(outputs) == ["final.mp4", "final.mp3"]
+    mp4, mp3 = outputs["final.mp4"], outputs["final.mp3"]
+    assert mp4[mp4.index("-c:v") + 1] == "copy"
+    assert mp4[mp4.index("-map", 2) + 1] == "1:a:0"
+    assert mp4[mp4.index("-movflags") + 1] == "+faststart"
+    assert mp3[mp3.index("-map") + 1] == "1:a:0"
+    assert mp3[mp3.index("-c:a") + 1] == "libmp3lame"
+    assert mp3[mp3.index("-b:a") + 1] == mp4[mp4.index("-b:a") + 1] == "256k"
+
+
+@patch("modules.video_edit.subprocess.run")
+def test_encode_karaoke_mp3_only_skips_video(mock_run, tmp_path, monkeypatch):
+    monkeypatch.setattr(video_edit, "FFMPEG_THREADS", 2)
+    monkeypatch.setattr(video_edit, "MP3_COMPRESSION_LEVEL", "7")
+    mock_run.return_value = MagicMock(returncode=0, stderr="")
+    video_edit.encode_karaoke(str(tmp_path), mp4=False)
+
+    cmd = mock_run.call_args[0][0]
+    assert str(tmp_path / "raw.mp4") not in cmd
+    assert cmd[-1] == str(tmp_path / "final.mp3")
+    assert cmd[cmd.index("-map") + 1] == "0:a:0"
+    assert cmd[cmd.index("-threads") + 1] == "2"
+    assert cmd[cmd.index("-compression_level") + 1] == "7"
+
+
+@patch("modules.video_edit.subprocess.run")
+def test_encode_karaoke_without_faststart(mock_run, tmp_path, monkeypatch):
+    monkeypatch.setattr(video_edit, "FASTSTART", False)
+    mock_run.return_value = MagicMock(returncode=0, stderr="")
+    video_edit.encode_karaoke(str(tmp_path), mp3=False)
+
+    cmd = mock_run.call_args[0][0]
+    assert "-movflags" not in cmd
+    assert cmd[-1] == str(tmp_path / "final.mp4")
+
+
+@patch("modules.video_edit.subprocess.run")
+def test_encode_karaoke_raises_on_failure(mock_run, tmp_path):
+    mock_run.return_value = MagicMock(returncode=1, stderr="codec error")
+    with pytest.raises(RuntimeError, match="ffmpeg failed"):
+        video_edit.encode_karaoke(str(tmp_path))
+
+
 # ── youtube.py ────────────────────────────────────────────────────────────────
 
-@patch("modules.youtube.YouTube")
-def test_get_video_title(mock_yt_cls):
-    mock_yt = MagicMock()
-    mock_yt.title = "Test Video Title"
-    mock_yt_cls.return_value = mock_yt
+@patch("modules.youtube.yt_dlp.YoutubeDL")
+def test_download_audio_fetches_audio_stream_only(mock_ydl_cls, tmp_path):
+    from modules.youtube import download_audio
+
+    info = {"id": "test", "title": "Song"}
+    ydl = mock_ydl_cls.return_value.__enter__.return_value
+    ydl.process_ie_result.side_effect = lambda *a, **kw: (tmp_path / "raw_audio.webm").write_bytes(b"\x1a")
+
+    path = download_audio("https://www.youtube.com/watch?v=test", str(tmp_path), info)
+
+    assert path == str(tmp_path / "raw_audio.webm")
+    opts = mock_ydl_cls.call_args[0][0]
+    assert opts["format"] == "bestaudio/best"
+    assert "merge_output_format" not in opts
+    ydl.process_ie_result.assert_called_once_with(info, download=True)
+
+
+@patch("modules.youtube.yt_dlp.YoutubeDL")
+def test_download_passes_progress_hooks(mock_ydl_cls, tmp_path):
+    from modules.youtube import download_audio
+
+    ydl = mock_ydl_cls.return_value.__enter__.return_value
+    ydl.process_ie_result.side_effect = lambda *a, **kw: (tmp_path / "raw_audio.m4a").write_bytes(b"\x00")
+    hook = MagicMock()
+
+    download_audio("https://www.youtube.com/watch?v=test", str(tmp_path), {"id": "test"}, progress_hooks=[hook])
+    assert mock_ydl_cls.call_args[0][0]["progress_hooks"] == [hook]
+
+
+@patch("modules.youtube.yt_dlp.YoutubeDL")
+def test_download_audio_raises_on_failure(mock_ydl_cls, tmp_path):
+    import yt_dlp
+    from modules.youtube import download_audio
+
+    ydl = mock_ydl_cls.return_value.__enter__.return_value
+    ydl.process_ie_result.side_effect = yt_dlp.utils.DownloadError("unavailable")
+    with pytest.raises(RuntimeError, match="audio download failed"):
+        download_audio("https://www.youtube.com/watch?v=test", str(tmp_path), {"id": "test"})
+
+
+@patch("modules.youtube.subprocess.run")
+def test_extract_audio_decodes_to_pcm_wav(mock_run, tmp_path):
+    from modules.youtube import extract_audio
+
+    mock_run.return_value = MagicMock(returncode=0, stderr="")
+    extract_audio(str(tmp_path), str(tmp_path / "raw_audio.webm"))
+
+    cmd = mock_run.call_args[0][0]
+    assert str(tmp_path / "raw_audio.webm") in cmd
+    assert cmd[-1] == str(tmp_path / "original.wav")
+    assert cmd[cmd.index("-c:a") + 1] == "pcm_s16le"
+
+
+@patch("modules.youtube.yt_dlp.YoutubeDL")
+def test_expand_playlist_reads_entries_flat(mock_ydl_cls):
+    from modules.youtube import expand_playlist
+
+    ydl = mock_ydl_cls.return_value.__enter__.return_value
+    ydl.extract_info.return_value = {
+        "_type": "playlist",
+        "title": "Party",
+        "entries": [
+            {"id": "aaaaaaaaaaa", "url": "https://www.youtube.com/watch?v=aaaaaaaaaaa"},
+            None,  # unavailable videos come back empty
+            {"id": "bbbbbbbbbbb"},
+        ],
+    }
+    title, urls = expand_playlist("https://www.youtube.com/playlist?list=PL1", limit=10)
+
+    assert title == "Party"
+    assert urls == ["https://www.youtube.com/watch?v=aaaaaaaaaaa", "https://www.youtube.com/watch?v=bbbbbbbbbbb"]
+    opts = mock_ydl_cls.call_args[0][0]
+    assert opts["extract_flat"] == "in_playlist"
+    assert opts["playlistend"] == 10
+
+
+@patch("modules.youtube.yt_dlp.YoutubeDL")
+def test_expand_playlist_single_video(mock_ydl_cls):
+    from modules.youtube import expand_playlist
+
+    ydl = mock_ydl_cls.return_value.__enter__.return_value
+    ydl.extract_info.return_value = {"id": "dQw4w9WgXcQ", "title": "Song"}
+    link = "https://www.youtube.com/watch?v=dQw4w9WgXcQ"
+    assert expand_playlist(link, limit=10) == ("Song", [link])
+
+
+@patch("modules.youtube.yt_dlp.YoutubeDL")
+def test_download_audio_section(mock_ydl_cls, tmp_path):
+    from modules.youtube import download_audio
+
+    ydl = mock_ydl_cls.return_value.__enter__.return_value
+    ydl.process_ie_result.side_effect = lambda *a, **kw: (tmp_path / "raw_audio.webm").write_bytes(b"\x00")
+    download_audio("https://www.youtube.com/watch?v=test", str(tmp_path), {"id": "test"}, section=(60.0, 90.0))
+
+    ranges = mock_ydl_cls.call_args[0][0]["download_ranges"]
+    assert list(ranges({"id": "test"}, ydl)) == [{"start_time": 60.0, "end_time": 90.0}]
+
+
+def test_preview_start():
+    from modules.youtube import preview_start
+
+    heatmap = [
+        {"start_time": 0.0, "end_time": 10.0, "value": 0.2},
+        {"start_time": 100.0, "end_time": 110.0, "value": 1.0},
+        {"start_time": 190.0, "end_time": 200.0, "value": 0.5},
+    ]
+    assert preview_start({"duration": 200, "heatmap": heatmap}, 30) == 90.0
+    # Near the end the preview is moved back so it still fits
+    assert preview_start({"duration": 200, "heatmap": heatmap[2:]}, 30) == 170.0
+    assert preview_start({"duration": 240}, 30) == 80.0
+    assert preview_start({"duration": 20}, 30) == 0.0
+    assert preview_start({}, 30) == 0.0
+
+
+@pytest.fixture
+def fresh_info_cache(monkeypatch):
+    import modules.youtube as ytube
+    monkeypatch.setattr(ytube, "info_cache", ytube._InfoCache(maxsize=2, ttl_seconds=60))
+    return ytube.info_cache
+
+
+@patch("modules.youtube.yt_dlp.YoutubeDL")
+def test_get_video_title(mock_ydl_cls, fresh_info_cache):
+    ydl = mock_ydl_cls.return_value.__enter__.return_value
+    ydl.extract_info.return_value = {"id": "dQw4w9WgXcQ", "title": "Test Video Title", "duration": 212}
 
     from modules.youtube import get_video_title
-    title = get_video_title("https://www.youtube.com/watch?v=test")
+    title = get_video_title("https://www.youtube.com/watch?v=dQw4w9WgXcQ")
     assert title == "Test Video Title"
+    ydl.extract_info.assert_called_once_with(
+        "https://www.youtube.com/watch?v=dQw4w9WgXcQ", download=False, process=False
+    )
+
+
+@patch("modules.youtube.yt_dlp.YoutubeDL")
+def test_probe_is_cached_per_video(mock_ydl_cls, fresh_info_cache):
+    from modules.youtube import probe
+
+    ydl = mock_ydl_cls.return_value.__enter__.return_value
+    ydl.extract_info.return_value = {"id": "dQw4w9WgXcQ", "title": "Song", "formats": []}
+
+    first = probe("https://www.youtube.com/watch?v=dQw4w9WgXcQ")
+    first["formats"].append("mutated by a download")
+    second = probe("https://youtu.be/dQw4w9WgXcQ")
+
+    assert ydl.extract_info.call_count == 1
+    assert second["formats"] == []   # each caller gets its own copy
+
+
+def test_info_cache_expires_and_evicts(monkeypatch):
+    import modules.youtube as ytube
+
+    now = [1000.0]
+    monkeypatch.setattr(ytube.time, "monotonic", lambda: now[0])
+    cache = ytube._InfoCache(maxsize=2, ttl_seconds=10)
+    cache.put("a", {"id": "a"})
+    cache.put("b", {"id": "b"})
+    cache.get("a")
+    cache.put("c", {"id": "c"})     # evicts "b", the least recently used
+    assert cache.get("b") is None
+    assert cache.get("a") == {"id": "a"}
+
+    now[0] += 11
+    assert cache.get("c") is None
+
+
+@patch("modules.youtube.yt_dlp.YoutubeDL")
+def test_download_video_reuses_probed_info(mock_ydl_cls, tmp_path):
+    from modules.youtube import download_video
+
+    info = {"id": "test", "title": "Song"}
+    path = download_video("https://www.youtube.com/watch?v=test", str(tmp_path), info)
+
+    assert path == str(tmp_path / "raw.mp4")
+    opts = mock_ydl_cls.call_args[0][0]
+    assert opts["outtmpl"] == str(tmp_path / "raw.mp4")
+    assert opts["merge_output_format"] == "mp4"
+    ydl = mock_ydl_cls.return_value.__enter__.return_value
+    ydl.process_ie_result.assert_called_once_with(info, download=True)
+    ydl.extract_info.assert_not_called()
+
+
+@patch("modules.youtube.yt_dlp.YoutubeDL")
+def test_download_video_raises_on_failure(mock_ydl_cls, tmp_path):
+    import yt_dlp
+    from modules.youtube import download_video
+
+    ydl = mock_ydl_cls.return_value.__enter__.return_value
+    ydl.process_ie_result.side_effect = yt_dlp.utils.DownloadError("Requested format is not available")
+    with pytest.raises(RuntimeError, match="video download failed"):
+        download_video("https://www.youtube.com/watch?v=test", str(tmp_path), {"id": "test"})
+
+
+# ── vocal_remover.py ──────────────────────────────────────────────────────────
+
+def _fake_model():
+    model = MagicMock()
+    model.sources = ["drums", "bass", "other", "vocals"]
+    model.samplerate = 44100
+    model.audio_channels = 2
+    return model
+
+
+@patch("modules.vocal_remover.get_model")
+def test_engine_loads_model_once(mock_get_model):
+    from modules.vocal_remover import SeparationEngine
+
+    mock_get_model.return_value = _fake_model()
+    engine = SeparationEngine("htdemucs")
+    assert not engine.loaded
+
+    first = engine.load()
+    second = engine.load()
+    assert first is second
+    assert engine.loaded
+    mock_get_model.assert_called_once_with("htdemucs")
+
+
+@patch("modules.vocal_remover.apply_model")
+@patch("modules.vocal_remover.get_model")
+def test_remove_vocals_writes_accompaniment(mock_get_model, mock_apply, tmp_path, monkeypatch):
+    import modules.vocal_remover as vr
+
+    mock_get_model.return_value = _fake_model()
+    # Zero-mean, unit-variance input so the demucs normalisation is a no-op
+    sf.write(str(tmp_path / "original.wav"), [[0.5, 0.5], [-0.5, -0.5]] * 500, 44100, subtype="FLOAT")
+    stems = torch.zeros(1, 4, 2, 1000)
+    stems[0, 0] = 0.1   # drums
+    stems[0, 3] = 0.4   # vocals — must not end up in the accompaniment
+    mock_apply.return_value = stems
+    monkeypatch.setattr(vr, "engine", vr.SeparationEngine())
+
+    vr.remove_vocals(str(tmp_path))
+
+    data, samplerate = sf.read(str(tmp_path / "accompaniment.wav"))
+    assert samplerate == 44100
+    assert data.shape == (1000, 2)
+    assert data.max() == pytest.approx(0.05, abs=2e-3)
+    assert mock_apply.call_args[0][1].shape == (1, 2, 1000)
+    assert not (tmp_path / "original").exists()
+
+
+@patch("modules.vocal_remover.apply_model", side_effect=lambda model, mix, **kwargs: torch.zeros(1, 4, *mix.shape[1:]))
+@patch("modules.vocal_remover.get_model")
+def test_quality_profile_selects_model_and_shifts(mock_get_model, mock_apply, tmp_path, monkeypatch):
+    import modules.vocal_remover as vr
+
+    mock_get_model.return_value = _fake_model()
+    monkeypatch.setattr(vr, "_quality_engines", {})
+    sf.write(str(tmp_path / "original.wav"), np.zeros((1000, 2)), 44100, subtype="FLOAT")
+
+    with patch.object(vr.torch, "set_num_threads") as set_num_threads:
+        vr.remove_vocals(str(tmp_path), quality="best", threads=2)
+    set_num_threads.assert_called_once_with(2)
+    mock_get_model.assert_called_once_with("htdemucs_ft")
+    assert mock_apply.call_args.kwargs["shifts"] == 2
+    assert vr.get_engine("demucs", "best") is vr.get_engine("demucs", "best")
+    assert vr.get_engine("demucs") is vr.engine
+    assert vr.get_engine("fast", "best") is vr.fast_engine
+
+
+def test_configure_threads_splits_cores_between_jobs(monkeypatch):
+    import modules.vocal_remover as vr
+
+    monkeypatch.setattr(vr.os, "cpu_count", lambda: 8)
+    monkeypatch.setattr(vr, "THREADS", 0)
+    with patch.object(vr.torch, "set_num_threads") as set_num_threads:
+        assert vr.configure_threads(3) == 2
+        set_num_threads.assert_called_once_with(2)
+    assert vr.thread_budget(16) == 1
+    monkeypatch.setattr(vr, "THREADS", 5)
+    assert vr.thread_budget(2) == 5
+    monkeypatch.setattr(vr, "_job_threads", vr.thread_budget(1))
+
+
+def _identity_stems(model, mix, **kwargs):
+    """Fake apply_model: the whole mix lands in "drums", a loud constant in "vocals"."""
+    stems = torch.zeros(mix.shape[0], 4, *mix.shape[1:])
+    stems[:, 0] = mix
+    stems[:, 3] = 3.0
+    return stems
+
+
+def test_chunk_bounds_overlap():
+    from modules.vocal_remover import _chunk_bounds
+
+    assert _chunk_bounds(100, 40, 10) == [(0, 40), (30, 70), (60, 100)]
+    assert _chunk_bounds(30, 40, 10) == [(0, 30)]
+    assert _chunk_bounds(41, 40, 10) == [(0, 40), (30, 41)]
+
+
+@patch("modules.vocal_remover.apply_model", side_effect=_identity_stems)
+@patch("modules.vocal_remover.get_model")
+def test_chunked_separation_stitches_seamlessly(mock_get_model, mock_apply, tmp_path):
+    import numpy as np
+    from modules.vocal_remover import SeparationEngine
+
+    mock_get_model.return_value = _fake_model()
+    t = np.arange(44100) / 44100
+    mix = np.stack([0.5 * np.sin(2 * np.pi * 440 * t), 0.3 * np.cos(2 * np.pi * 220 * t)], axis=1)
+    sf.write(str(tmp_path / "original.wav"), mix, 44100, subtype="FLOAT")
+
+    fractions = []
+    engine = SeparationEngine(chunk_seconds=0.3, overlap_seconds=0.05)
+    engine.separate(str(tmp_path / "original.wav"), str(tmp_path / "out.wav"), progress=fractions.append)
+
+    out, _ = sf.read(str(tmp_path / "out.wav"))
+    assert out.shape == mix.shape
+    assert np.abs(out - mix).max() < 1e-3   # 16-bit quantisation only
+    assert mock_apply.call_count == 4
+    assert max(call.args[1].shape[-1] for call in mock_apply.call_args_list) == int(0.3 * 44100)
+    assert fractions == sorted(fractions)
+    assert fractions[-1] == 1.0
+
+
+def _stereo(left, right):
+    return np.stack([left, right], axis=1).astype(np.float32)
+
+
+def test_center_cancel_removes_centre_and_keeps_sides_and_bass():
+    from modules.vocal_remover import CenterCancelEngine
+
+    engine = CenterCancelEngine()
+    t = np.arange(44100) / 44100
+    voice = 0.3 * np.sin(2 * np.pi * 440 * t)
+    guitar = 0.3 * np.sin(2 * np.pi * 660 * t)
+    bass = 0.3 * np.sin(2 * np.pi * 60 * t)
+    inner = slice(4096, -4096)  # away from the chunk edges, which are crossfaded anyway
+
+    assert np.abs(engine.separate_chunk(_stereo(voice, voice), 44100)[inner]).max() < 1e-4
+    side = _stereo(guitar, 0 * t)
+    assert np.abs(engine.separate_chunk(side, 44100) - side)[inner].max() < 1e-4
+    centred_bass = _stereo(bass, bass)
+    assert np.abs(engine.separate_chunk(centred_bass, 44100) - centred_bass)[inner].max() < 1e-3
+
+
+def test_center_cancel_writes_accompaniment(tmp_path):
+    import modules.vocal_remover as vr
+
+    t = np.arange(3 * 44100) / 44100
+    voice = 0.3 * np.sin(2 * np.pi * 440 * t)
+    guitar = 0.3 * np.sin(2 * np.pi * 660 * t)
+    sf.write(str(tmp_path / "original.wav"), _stereo(voice + guitar, voice), 44100, subtype="FLOAT")
+
+    fractions = []
+    with patch.object(vr, "fast_engine", vr.CenterCancelEngine(chunk_seconds=1.0, overlap_seconds=0.1)):
+        vr.remove_vocals(str(tmp_path), progress=fractions.append, engine_name="fast")
+
+    out, samplerate = sf.read(str(tmp_path / "accompaniment.wav"))
+    assert samplerate == 44100
+    assert out.shape == (len(t), 2)
+    inner = slice(4096, -4096)
+    assert np.abs(out[inner, 0] - guitar[inner]).max() < 0.05  # voice gone, guitar (left only) kept
+    assert np.abs(out[inner, 1]).max() < 0.05
+    assert fractions[-1] == 1.0
+
+
+def test_center_cancel_needs_stereo(tmp_path):
+    from modules.vocal_remover import CenterCancelEngine
+
+    sf.write(str(tmp_path / "mono.wav"), np.zeros(1000, dtype=np.float32), 44100)
+    with pytest.raises(RuntimeError, match="stereo"):
+        CenterCancelEngine().separate(str(tmp_path / "mono.wav"), str(tmp_path / "out.wav"))
+
+
+def _nonlinear_stems(model, mix, **kwargs):
+    stems = torch.zeros(mix.shape[0], 4, *mix.shape[1:])
+    stems[:, 0] = torch.tanh(2 * mix)
+    return stems
+
+
+@patch("modules.vocal_remover.apply_model", side_effect=_nonlinear_stems)
+@patch("modules.vocal_remover.get_model")
+def test_parallel_separation_matches_single_process(mock_get_model, mock_apply, tmp_path, monkeypatch):
+    import numpy as np
+    import modules.vocal_remover as vr
 
+    # Forked workers inherit the patched model loader and apply_model
+    monkeypatch.setattr(vr, "_MP_CONTEXT", "fork")
+    mock_get_model.return_value = _fake_model()
+    rng = np.random.default_rng(0)
+    sf.write(str(tmp_path / "original.wav"), rng.uniform(-0.5, 0.5, (44100, 2)), 44100, subtype="FLOAT")
 
-@patch("modules.youtube.YouTube")
-def test_download_youtube_video_uses_filename_param(mock_yt_cls, tmp_path):
-    mock_stream = MagicMock()
-    mock_stream.download.return_value = str(tmp_path / "raw.mp4")
-    mock_yt = MagicMock()
-    mock_yt.streams.get_highest_resolution.return_value = mock_stream
-    mock_yt_cls.return_value = mock_yt
+    single = vr.SeparationEngine(chunk_seconds=0.2, overlap_seconds=0.05, processes=1)
+    single.separate(str(tmp_path / "original.wav"), str(tmp_path / "single.wav"))
 
-    from modules.youtube import download_youtube_video
-    download_youtube_video("https://www.youtube.com/watch?v=test", str(tmp_path))
+    fractions = []
+    parallel = vr.SeparationEngine(chunk_seconds=0.2, overlap_seconds=0.05, processes=2)
+    try:
+        parallel.separate(str(tmp_path / "original.wav"), str(tmp_path / "parallel.wav"), fractions.append)
+    finally:
+        parallel.close()
 
-    mock_stream.download.assert_called_once_with(output_path=str(tmp_path), filename="raw.mp4")
+    expected, _ = sf.read(str(tmp_path / "single.wav"))
+    actual, _ = sf.read(str(tmp_path / "parallel.wav"))
+    assert np.abs(actual - expected).max() <= 1 / 32768   # documented tolerance: 1 LSB
+    assert fractions == sorted(fractions) and fractions[-1] == 1.0
 
 
-@patch("modules.youtube.YouTube")
-def test_download_raises_when_no_stream(mock_yt_cls, tmp_path):
-    mock_yt = MagicMock()
-    mock_yt.streams.get_highest_resolution.return_value = None
-    mock_yt_cls.return_value = mock_yt
+@patch("modules.vocal_remover.get_model")
+def test_separate_rejects_unexpected_sample_rate(mock_get_model, tmp_path):
+    from modules.vocal_remover import SeparationEngine
 
-    from modules.youtube import download_youtube_video
-    with pytest.raises(RuntimeError, match="No video stream"):
-        download_youtube_video("https://www.youtube.com/watch?v=test", str(tmp_path))
+    mock_get_model.return_value = _fake_model()
+    sf.write(str(tmp_path / "original.wav"), [[0.0, 0.0]] * 10, 22050)
+    with pytest.raises(RuntimeError, match="22050 Hz"):
+        SeparationEngine().separate(str(tmp_path / "original.wav"), str(tmp_path / "out.wav"))
@@ -1,16 +1,32 @@
 """Tests for the FastAPI karaoke service and pipeline orchestration."""
+import io
+import json
+import os
+import threading
 import time
+import zipfile
 from unittest.mock import MagicMock, patch
 
 import pytest
 from fastapi.testclient import TestClient
 
-from job_store import JobStatus, store
-from main import app
+import main
+from common.job_store import JobStatus
+from common.scheduler import JobScheduler
+from main import app, store
+from result_cache import ResultCache
 
 client = TestClient(app)
 
 YOUTUBE_URL = "https://www.youtube.com/watch?v=test123"
+CACHEABLE_URL = "https://www.youtube.com/watch?v=dQw4w9WgXcQ"
+
+
+@pytest.fixture(autouse=True)
+def isolated_cache(tmp_path, monkeypatch):
+    result_cache = ResultCache(str(tmp_path / "cache"), max_bytes=10 * 1024 * 1024)
+    monkeypatch.setattr(main, "cache", result_cache)
+    return result_cache
 
 
 def _wait_for_job(job_id: str, target_statuses, timeout: float = 5.0, interval: float = 0.1):
@@ -38,16 +54,14 @@ def test_file_not_found():
     assert response.status_code == 404
 
 
-@patch("main.ytube.get_video_title", return_value="Test Song")
-@patch("main.ytube.download_youtube_video")
-@patch("main.ve.extract_audio_from_video")
+@patch("main.ytube.probe", return_value={"title": "Test Song"})
+@patch("main.ytube.download_video")
+@patch("main.ytube.extract_audio")
 @patch("main.vr.remove_vocals")
-@patch("main.utils.copy_accompaniment_file")
-@patch("main.utils.convert_wav_to_mp3")
-@patch("main.ve.add_audio_to_video")
+@patch("main.ve.encode_karaoke")
 @patch("main.utils.rename_final_video", return_value="/tmp/karaoke_test/Test Song.mp4")
 def test_pipeline_success(
-    mock_rename, mock_add_audio, mock_convert, mock_copy,
+    mock_rename, mock_encode,
     mock_remove_vocals, mock_extract, mock_download, mock_title,
     tmp_path,
 ):
@@ -70,14 +84,15 @@ def test_pipeline_success(
     mock_download.assert_called_once()
     mock_extract.assert_called_once()
     mock_remove_vocals.assert_called_once()
-    mock_copy.assert_called_once()
-    mock_convert.assert_called_once()
-    mock_add_audio.assert_called_once()
+    assert mock_remove_vocals.call_args.kwargs["threads"] is None  # the per-job share from configure_threads
+    mock_encode.assert_called_once()
+    assert mock_encode.call_args.kwargs == {"mp3": True, "mp4": True, "bitrate": "192k"}
+    assert job.progress == 1.0
     mock_rename.assert_called_once()
 
 
-@patch("main.ytube.get_video_title", return_value="Test Song")
-@patch("main.ytube.download_youtube_video", side_effect=RuntimeError("download failed"))
+@patch("main.ytube.probe", return_value={"title": "Test Song"})
+@patch("main.ytube.download_video", side_effect=RuntimeError("download failed"))
 def test_pipeline_download_failure(mock_download, mock_title):
     response = client.post("/karaoke", json={"video_url": YOUTUBE_URL})
     assert response.status_code == 200
@@ -89,6 +104,291 @@ def test_pipeline_download_failure(mock_download, mock_title):
     assert "download failed" in (job.error or "")
 
 
+def _fake_pipeline_outputs(tmp_dir: str, title: str) -> str:
+    """Write what a successful pipeline leaves behind and return the MP4 path."""
+    with open(os.path.join(tmp_dir, "final.mp3"), "wb") as f:
+        f.write(b"ID3")
+    output_path = os.path.join(tmp_dir, f"{title}.mp4")
+    with open(output_path, "wb") as f:
+        f.write(b"\x00" * 10)
+    return output_path
+
+
+@patch("main.ytube.probe", return_value={"title": "Cached Song"})
+@patch("main.ytube.download_video")
+@patch("main.ytube.extract_audio")
+@patch("main.vr.remove_vocals")
+@patch("main.ve.encode_karaoke")
+@patch("main.utils.rename_final_video")
+def test_repeat_request_served_from_cache(
+    mock_rename, mock_encode,
+    mock_remove_vocals, mock_extract, mock_download, mock_title,
+    isolated_cache,
+):
+    mock_rename.side_effect = lambda working_dir, title, dest: _fake_pipeline_outputs(dest, title)
+
+    first = client.post("/karaoke", json={"video_url": CACHEABLE_URL}).json()["job_id"]
+    assert _wait_for_job(first, {JobStatus.DONE, JobStatus.ERROR}).status == JobStatus.DONE
+
+    # Same video through a different URL form resolves to the same cache entry
+    second = client.post("/karaoke", json={"video_url": "https://youtu.be/dQw4w9WgXcQ"}).json()["job_id"]
+    job = store.get(second)
+    assert job.status == JobStatus.DONE
+    assert job.output_path.endswith("Cached Song.mp4")
+    assert client.get(f"/mp3/{second}").content == b"ID3"
+    mock_download.assert_called_once()
+    mock_remove_vocals.assert_called_once()
+
+
+@patch("main.ytube.probe", return_value={"title": "Cached Song"})
+@patch("main.ytube.download_video")
+@patch("main.ytube.extract_audio")
+@patch("main.vr.remove_vocals")
+@patch("main.ve.encode_karaoke")
+@patch("main.utils.rename_final_video")
+def test_bitrate_is_part_of_cache_key(
+    mock_rename, mock_encode,
+    mock_remove_vocals, mock_extract, mock_download, mock_title,
+    isolated_cache,
+):
+    mock_rename.side_effect = lambda working_dir, title, dest: _fake_pipeline_outputs(dest, title)
+
+    first = client.post("/karaoke", json={"video_url": CACHEABLE_URL}).json()["job_id"]
+    assert _wait_for_job(first, {JobStatus.DONE, JobStatus.ERROR}).status == JobStatus.DONE
+    second = client.post("/karaoke", json={"video_url": CACHEABLE_URL, "bitrate": "320k"}).json()["job_id"]
+    assert _wait_for_job(second, {JobStatus.DONE, JobStatus.ERROR}).status == JobStatus.DONE
+
+    assert mock_remove_vocals.call_count == 2
+    assert mock_encode.call_args.kwargs["bitrate"] == "320k"
+
+
+@patch("main.ytube.probe", return_value={"title": "Cached Song"})
+@patch("main.ytube.download_video")
+@patch("main.ytube.extract_audio")
+@patch("main.vr.remove_vocals")
+@patch("main.ve.encode_karaoke")
+@patch("main.utils.rename_final_video")
+def test_fast_engine_skips_separation_queue_and_has_own_cache_key(
+    mock_rename, mock_encode, mock_remove_vocals, mock_extract, mock_download, mock_title, monkeypatch,
+):
+    mock_rename.side_effect = lambda working_dir, title, dest: _fake_pipeline_outputs(dest, title)
+    busy = _scheduler(max_queue=5)
+    monkeypatch.setattr(main, "scheduler", busy)
+    monkeypatch.setattr(busy.pools["separation"], "_start", lambda: None)  # Demucs queue never moves
+
+    fast = client.post("/karaoke", json={"video_url": CACHEABLE_URL, "engine": "fast"}).json()["job_id"]
+    assert _wait_for_job(fast, {JobStatus.DONE, JobStatus.ERROR}).status == JobStatus.DONE
+    assert mock_remove_vocals.call_args.kwargs["engine_name"] == "fast"
+
+    # A Demucs request for the same video is not answered with the fast result
+    slow = client.post("/karaoke", json={"video_url": CACHEABLE_URL}).json()["job_id"]
+    assert _wait_for_job(slow, {JobStatus.SEPARATING}, timeout=0.5).status != JobStatus.DONE
+    assert busy.position(slow) == ("separation", 1)
+
+
+def test_quality_profiles_have_own_cache_keys():
+    balanced = main._cache_key(CACHEABLE_URL, main.JobOptions())
+    best = main._cache_key(CACHEABLE_URL, main.JobOptions(quality="best"))
+    assert best != balanced
+    # Results cached before quality profiles existed are still found
+    assert balanced == main.cache.key("dQw4w9WgXcQ", model="htdemucs", stems="vocals", bitrate="192k")
+    # The centre-cancellation engine has no quality profiles
+    fast = main._cache_key(CACHEABLE_URL, main.JobOptions(engine="fast"))
+    assert main._cache_key(CACHEABLE_URL, main.JobOptions(engine="fast", quality="best")) == fast
+
+
+@patch("main.ytube.probe", return_value={"title": "Song", "duration": 240})
+@patch("main.ytube.download_video")
+@patch("main.ytube.download_audio", return_value="/tmp/raw_audio.webm")
+@patch("main.ytube.extract_audio")
+@patch("main.vr.remove_vocals")
+@patch("main.ve.encode_karaoke")
+def test_preview_separates_an_excerpt_and_can_be_promoted(
+    mock_encode, mock_remove_vocals, mock_extract, mock_download_audio, mock_download_video, mock_title,
+):
+    mock_encode.side_effect = lambda tmp_dir, **kwargs: _fake_pipeline_outputs(tmp_dir, "unused")
+
+    response = client.post("/karaoke/preview", json={"video_url": CACHEABLE_URL, "start": 45, "engine": "fast", "quality": "best"})
+    preview = response.json()["job_id"]
+    job = _wait_for_job(preview, {JobStatus.DONE, JobStatus.ERROR})
+    assert job.status == JobStatus.DONE
+    assert mock_download_audio.call_args.kwargs["section"] == (45, 75)
+    mock_download_video.assert_not_called()
+    assert mock_encode.call_args.kwargs["mp4"] is False
+    assert mock_remove_vocals.call_args.kwargs["engine_name"] == "fast"
+    assert "Song%20%28preview%29.mp3" in client.get(f"/mp3/{preview}").headers["content-disposition"]
+
+    full = client.post(f"/karaoke/preview/{preview}/promote", json={"output": "mp3"}).json()["job_id"]
+    assert full != preview
+    assert _wait_for_job(full, {JobStatus.DONE, JobStatus.ERROR}).status == JobStatus.DONE
+    assert "section" not in mock_download_audio.call_args.kwargs
+    assert mock_remove_vocals.call_args.kwargs["engine_name"] == "fast"  # the preview's engine
+    assert mock_remove_vocals.call_args.kwargs["quality"] == "best"
+    assert store.get(full).title == "Song"
+
+
+@patch("main.ytube.probe", return_value={"title": "Song", "duration": 240})
+@patch("main.ytube.download_video")
+@patch("main.ytube.download_audio", return_value="/tmp/raw_audio.webm")
+@patch("main.ytube.extract_audio")
+@patch("main.vr.remove_vocals")
+@patch("main.ve.encode_karaoke")
+def test_demucs_preview_does_not_wait_behind_full_jobs(
+    mock_encode, mock_remove_vocals, mock_extract, mock_download_audio, mock_download_video, mock_title, monkeypatch,
+):
+    mock_encode.side_effect = lambda tmp_dir, **kwargs: _fake_pipeline_outputs(tmp_dir, "unused")
+    busy = _scheduler(max_queue=5)
+    monkeypatch.setattr(main, "scheduler", busy)
+    for stage in ("download", "separation"):
+        monkeypatch.setattr(busy.pools[stage], "_start", lambda: None)  # full jobs never move
+
+    full = client.post("/karaoke", json={"video_url": YOUTUBE_URL}).json()["job_id"]
+    preview = client.post("/karaoke/preview", json={"video_url": CACHEABLE_URL}).json()["job_id"]
+
+    assert _wait_for_job(preview, {JobStatus.DONE, JobStatus.ERROR}).status == JobStatus.DONE
+    assert mock_remove_vocals.call_args.kwargs["engine_name"] == "demucs"
+    assert mock_remove_vocals.call_args.kwargs["threads"] == main.vr.PREVIEW_THREADS
+    assert busy.position(full) == ("download", 1)
+
+
+def test_preview_validation():
+    assert client.post("/karaoke/preview", json={"video_url": YOUTUBE_URL, "length": 600}).status_code == 422
+    assert client.post("/karaoke/preview/nonexistent/promote").status_code == 404
+    store.create("not_a_preview")
+    assert client.post("/karaoke/preview/not_a_preview/promote").status_code == 404
+
+
+@patch("main.ytube.probe", return_value={"title": "Audio Only"})
+@patch("main.ytube.download_video")
+@patch("main.ytube.download_audio", return_value="/tmp/raw_audio.m4a")
+@patch("main.ytube.extract_audio")
+@patch("main.vr.remove_vocals")
+@patch("main.ve.encode_karaoke")
+def test_mp3_output_skips_video(
+    mock_encode, mock_remove_vocals,
+    mock_extract, mock_download_audio, mock_download_video, mock_title,
+):
+    mock_encode.side_effect = lambda tmp_dir, **kwargs: _fake_pipeline_outputs(tmp_dir, "unused")
+
+    response = client.post("/karaoke", json={"video_url": YOUTUBE_URL, "output": "mp3"})
+    job_id = response.json()["job_id"]
+    job = _wait_for_job(job_id, {JobStatus.DONE, JobStatus.ERROR})
+    assert job.status == JobStatus.DONE
+
+    mock_download_audio.assert_called_once()
+    mock_download_video.assert_not_called()
+    assert mock_encode.call_args.kwargs["mp4"] is False
+    assert mock_extract.call_args[0][1] == "/tmp/raw_audio.m4a"
+
+    assert client.get(f"/file/{job_id}").status_code == 404
+    response = client.get(f"/mp3/{job_id}")
+    assert response.status_code == 200
+    assert "Audio%20Only.mp3" in response.headers["content-disposition"]
+
+
+@patch("main.ytube.probe", return_value={"title": "Video Only"})
+@patch("main.ytube.download_video")
+@patch("main.ytube.extract_audio")
+@patch("main.vr.remove_vocals")
+@patch("main.ve.encode_karaoke")
+@patch("main.utils.rename_final_video")
+def test_mp4_output_skips_mp3_encode(
+    mock_rename, mock_encode, mock_remove_vocals, mock_extract, mock_download, mock_title, tmp_path,
+):
+    fake_output = tmp_path / "Video Only.mp4"
+    fake_output.write_bytes(b"\x00")
+    mock_rename.return_value = str(fake_output)
+
+    job_id = client.post("/karaoke", json={"video_url": YOUTUBE_URL, "output": "mp4"}).json()["job_id"]
+    assert _wait_for_job(job_id, {JobStatus.DONE, JobStatus.ERROR}).status == JobStatus.DONE
+
+    assert mock_encode.call_args.kwargs["mp3"] is False
+    assert client.get(f"/file/{job_id}").status_code == 200
+    assert client.get(f"/mp3/{job_id}").status_code == 404
+
+
+@patch("main.ytube.probe", return_value={"title": "Song"})
+@patch("main.ytube.download_audio")
+@patch("main.ytube.extract_audio")
+def test_status_reports_download_progress(mock_extract, mock_download_audio, mock_title):
+    release = threading.Event()
+
+    def download(link, tmp_dir, info, progress_hooks):
+        for hook in progress_hooks:
+            hook({"status": "downloading", "downloaded_bytes": 250, "total_bytes": 1000, "speed": 125.0, "eta": 6})
+        release.wait(5)
+        return "/tmp/raw_audio.m4a"
+
+    mock_download_audio.side_effect = download
+    mock_extract.side_effect = RuntimeError("stop here")
+    job_id = client.post("/karaoke", json={"video_url": YOUTUBE_URL, "output": "mp3"}).json()["job_id"]
+    try:
+        deadline = time.time() + 5
+        while store.get(job_id).downloaded_bytes is None and time.time() < deadline:
+            time.sleep(0.02)
+        status = client.get(f"/status/{job_id}").json()
+    finally:
+        release.set()
+    assert status["downloaded_bytes"] == 250
+    assert status["total_bytes"] == 1000
+    assert status["speed"] == 125.0
+    assert status["progress"] == 0.25
+    assert status["eta_seconds"] == 6
+    _wait_for_job(job_id, {JobStatus.ERROR})
+    assert client.get("/metrics").json()["downloads"]["active"] == 0
+
+
+def test_rejects_unknown_output():
+    response = client.post("/karaoke", json={"video_url": YOUTUBE_URL, "output": "flac"})
+    assert response.status_code == 422
+
+
+def _scheduler(max_queue: int) -> JobScheduler:
+    return JobScheduler({"download": 1, "separation": 1, "encode": 1, "preview": 1}, max_queue=max_queue)
+
+
+def test_rejects_when_queue_full(monkeypatch):
+    monkeypatch.setattr(main, "scheduler", _scheduler(max_queue=0))
+    response = client.post("/karaoke", json={"video_url": YOUTUBE_URL})
+    assert response.status_code == 503
+    assert response.headers["retry-after"] == "30"
+
+
+def test_status_reports_queue_position(monkeypatch):
+    waiting = _scheduler(max_queue=5)
+    monkeypatch.setattr(main, "scheduler", waiting)
+    monkeypatch.setattr(waiting.pools["download"], "_start", lambda: None)  # no workers: jobs stay queued
+
+    first = client.post("/karaoke", json={"video_url": YOUTUBE_URL}).json()["job_id"]
+    second = client.post("/karaoke", json={"video_url": YOUTUBE_URL}).json()["job_id"]
+
+    data = client.get(f"/status/{second}").json()
+    assert data["status"] == JobStatus.QUEUED
+    assert data["queue_position"] == 2
+    assert data["progress_message"] == "Waiting for download (position 2)"
+    assert client.get(f"/status/{first}").json()["queue_position"] == 1
+
+
+def test_separation_progress_reported_in_status(tmp_path):
+    def fake_remove_vocals(tmp_dir, progress, engine_name, quality, threads):
+        progress(0.5)
+        status = client.get(f"/status/{job_id}").json()
+        seen.update(status)
+        raise RuntimeError("stop after first chunk")
+
+    seen = {}
+    store.create("progress_job")
+    job_id = "progress_job"
+    ctx = main.PipelineContext(video_url=YOUTUBE_URL, tmp_dir=str(tmp_path))
+    with patch("main.vr.remove_vocals", side_effect=fake_remove_vocals), pytest.raises(RuntimeError):
+        main._separation_stage(job_id, ctx)
+
+    assert seen["status"] == JobStatus.SEPARATING
+    assert seen["progress"] == 0.5
+    assert seen["eta_seconds"] is not None
+    assert "50%" in seen["progress_message"]
+
+
 def test_status_queued_then_done():
     """Status endpoint returns correct data at each stage."""
     # Inject a done job directly into the store
@@ -113,3 +413,148 @@ def test_file_error_job():
     store.set_error("error_job_kd", "something broke")
     response = client.get("/file/error_job_kd")
     assert response.status_code == 500
+
+
+FAILING_URL = "https://www.youtube.com/watch?v=bbbbbbbbbbb"
+
+
+def _download_video(link, tmp_dir, info, progress_hooks):
+    if link == FAILING_URL:
+        raise RuntimeError("download failed")
+
+
+@pytest.fixture
+def batch_pipeline():
+    """Patch the pipeline for batch tests: titles come from the video id, outputs are fake files."""
+    patches = [
+        patch("main.ytube.probe", side_effect=lambda url: {"title": f"Song {main.ytube.video_id(url)}"}),
+        patch("main.ytube.download_video", side_effect=_download_video),
+        patch("main.ytube.extract_audio"),
+        patch("main.vr.remove_vocals"),
+        patch("main.ve.encode_karaoke"),
+        patch(
+            "main.utils.rename_final_video",
+            side_effect=lambda working_dir, title, dest: _fake_pipeline_outputs(dest, title),
+        ),
+    ]
+    yield [p.start() for p in patches]
+    for p in patches:
+        p.stop()
+
+
+def _wait_for_batch(batch_id: str, timeout: float = 5.0) -> dict:
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        data = client.get(f"/karaoke/batch/{batch_id}").json()
+        if data["status"] == JobStatus.DONE:
+            return data
+        time.sleep(0.05)
+    return data
+
+
+def test_batch_dedupes_and_zips_results(batch_pipeline):
+    response = client.post("/karaoke/batch", json={"video_urls": [
+        "https://www.youtube.com/watch?v=aaaaaaaaaaa",
+        "https://youtu.be/aaaaaaaaaaa",
+        "https://www.youtube.com/watch?v=ccccccccccc",
+    ]})
+    assert response.status_code == 200
+    body = response.json()
+    assert len(body["job_ids"]) == 2
+
+    data = _wait_for_batch(body["batch_id"])
+    assert data["status"] == JobStatus.DONE
+    assert (data["total"], data["done"], data["failed"]) == (2, 2, 0)
+    assert data["progress"] == 1.0
+    assert [job["title"] for job in data["jobs"]] == ["Song aaaaaaaaaaa", "Song ccccccccccc"]
+
+    response = client.get(f"/karaoke/batch/{body['batch_id']}/zip")
+    assert response.status_code == 200
+    assert response.headers["content-type"] == "application/zip"
+    archive = zipfile.ZipFile(io.BytesIO(response.content))
+    assert archive.testzip() is None
+    assert sorted(archive.namelist()) == [
+        "01 - Song aaaaaaaaaaa.mp3", "01 - Song aaaaaaaaaaa.mp4",
+        "02 - Song ccccccccccc.mp3", "02 - Song ccccccccccc.mp4",
+        "manifest.json",
+    ]
+    manifest = json.loads(archive.read("manifest.json"))
+    assert [job["job_id"] for job in manifest["jobs"]] == body["job_ids"]
+    # Streamed from the members' files, never copied into the batch's directory
+    assert os.listdir(store.get(body["batch_id"]).work_dir) == []
+
+
+def test_batch_reports_failed_videos(batch_pipeline):
+    batch_id = client.post("/karaoke/batch", json={
+        "video_urls": ["https://www.youtube.com/watch?v=aaaaaaaaaaa", FAILING_URL],
+    }).json()["batch_id"]
+
+    data = _wait_for_batch(batch_id)
+    assert data["status"] == JobStatus.DONE
+    assert (data["done"], data["failed"]) == (1, 1)
+    assert data["progress_message"] == "1 of 2 ready"
+    assert "download failed" in data["jobs"][1]["error"]
+
+    archive = zipfile.ZipFile(io.BytesIO(client.get(f"/karaoke/batch/{batch_id}/zip").content))
+    manifest = json.loads(archive.read("manifest.json"))
+    assert manifest["jobs"][1]["files"] == []
+
+
+def test_batch_expands_playlist(batch_pipeline):
+    playlist = ["https://www.youtube.com/watch?v=aaaaaaaaaaa", "https://www.youtube.com/watch?v=ccccccccccc"]
+    with patch("main.ytube.expand_playlist", return_value=("Party", playlist)) as mock_expand:
+        response = client.post("/karaoke/batch", json={
+            "playlist_url": "https://www.youtube.com/playlist?list=PL1",
+            "video_urls": ["https://youtu.be/ccccccccccc"],
+        })
+    mock_expand.assert_called_once()
+    body = response.json()
+    assert len(body["job_ids"]) == 2
+    data = _wait_for_batch(body["batch_id"])
+    assert data["title"] == "Party"
+    assert "Party.zip" in client.get(f"/karaoke/batch/{body['batch_id']}/zip").headers["content-disposition"]
+
+
+def test_batch_zip_not_ready_and_not_found(monkeypatch):
+    waiting = _scheduler(max_queue=5)
+    monkeypatch.setattr(main, "scheduler", waiting)
+    monkeypatch.setattr(waiting.pools["download"], "_start", lambda: None)  # no workers: jobs stay queued
+
+    batch_id = client.post("/karaoke/batch", json={"video_urls": [YOUTUBE_URL]}).json()["batch_id"]
+    data = client.get(f"/karaoke/batch/{batch_id}").json()
+    assert data["status"] == JobStatus.QUEUED
+    assert data["progress"] == 0.0
+    assert client.get(f"/karaoke/batch/{batch_id}/zip").status_code == 409
+    assert client.get("/karaoke/batch/nonexistent").status_code == 404
+
+
+def test_batch_larger_than_free_queue_is_fed_gradually(batch_pipeline, monkeypatch):
+    small = _scheduler(max_queue=1)
+    monkeypatch.setattr(main, "scheduler", small)
+    urls = [f"https://www.youtube.com/watch?v={c * 11}" for c in "acde"]
+
+    response = client.post("/karaoke/batch", json={"video_urls": urls})
+    assert response.status_code == 200
+    data = _wait_for_batch(response.json()["batch_id"])
+    assert data["status"] == JobStatus.DONE
+    assert (data["total"], data["done"]) == (4, 4)
+
+
+def test_batch_waits_in_backlog_behind_a_full_queue(monkeypatch):
+    waiting = _scheduler(max_queue=1)
+    monkeypatch.setattr(main, "scheduler", waiting)
+    monkeypatch.setattr(waiting.pools["download"], "_start", lambda: None)  # no workers: jobs stay queued
+    client.post("/karaoke", json={"video_url": YOUTUBE_URL})
+
+    response = client.post("/karaoke/batch", json={"video_urls": [YOUTUBE_URL, CACHEABLE_URL]})
+    assert response.status_code == 200
+    second = response.json()["job_ids"][1]
+    assert waiting.depth == 1
+    assert client.get(f"/status/{second}").json()["queue_position"] == 3
+
+
+def test_batch_size_limit(monkeypatch):
+    monkeypatch.setattr(main, "MAX_BATCH", 2)
+    urls = [f"https://www.youtube.com/watch?v={c * 11}" for c in "abc"]
+    assert client.post("/karaoke/batch", json={"video_urls": urls}).status_code == 400
+    assert client.post("/karaoke/batch", json={"video_urls": []}).status_code == 400
\ No newline at end of file
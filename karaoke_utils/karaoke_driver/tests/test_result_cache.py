@@ -0,0 +1,66 @@
+"""Tests for the on-disk karaoke result cache."""
+import os
+
+from result_cache import ResultCache
+
+
+def _write(path, size: int) -> str:
+    with open(path, "wb") as f:
+        f.write(b"\x00" * size)
+    return str(path)
+
+
+def test_key_depends_on_video_and_params():
+    key = ResultCache.key("abc", model="htdemucs", bitrate="192k")
+    assert key == ResultCache.key("abc", bitrate="192k", model="htdemucs")
+    assert key != ResultCache.key("abc", model="mdx_extra_q", bitrate="192k")
+    assert key != ResultCache.key("xyz", model="htdemucs", bitrate="192k")
+
+
+def test_put_get_restore(tmp_path):
+    cache = ResultCache(str(tmp_path / "cache"), max_bytes=1024)
+    src = _write(tmp_path / "final.mp3", 10)
+    cache.put("k1", "My Song", {"final.mp3": src})
+    os.remove(src)  # the cached copy must not depend on the job directory
+
+    entry = cache.get("k1")
+    assert entry.title == "My Song"
+    assert entry.has("final.mp3")
+    assert not entry.has("final.mp4")
+
+    dst = tmp_path / "job" / "final.mp3"
+    dst.parent.mkdir()
+    cache.restore(entry, {"final.mp3": str(dst)})
+    assert dst.read_bytes() == b"\x00" * 10
+
+
+def test_miss_returns_none(tmp_path):
+    cache = ResultCache(str(tmp_path), max_bytes=1024)
+    assert cache.get("missing") is None
+
+
+def test_evicts_least_recently_used(tmp_path):
+    cache = ResultCache(str(tmp_path / "cache"), max_bytes=250)
+    for key in ("a", "b"):
+        cache.put(key, key, {"final.mp3": _write(tmp_path / f"{key}.mp3", 100)})
+        os.utime(os.path.join(cache.root, key, "meta.json"), (1, 1 if key == "a" else 2))
+
+    cache.get("a")  # touch "a" so "b" becomes the LRU entry
+    cache.put("c", "c", {"final.mp3": _write(tmp_path / "c.mp3", 100)})
+
+    assert cache.get("a") is not None
+    assert cache.get("b") is None
+    assert cache.get("c") is not None
+
+
+def test_survives_restart(tmp_path):
+    root = str(tmp_path / "cache")
+    ResultCache(root, max_bytes=1024).put("k", "Song", {"final.mp3": _write(tmp_path / "s.mp3", 5)})
+    assert ResultCache(root, max_bytes=1024).get("k").title == "Song"
+
+
+def test_disabled_cache_is_noop(tmp_path):
+    cache = ResultCache(str(tmp_path / "cache"), max_bytes=0)
+    cache.put("k", "Song", {"final.mp3": _write(tmp_path / "s.mp3", 5)})
+    assert cache.get("k") is None
+    assert not os.path.exists(tmp_path / "cache")
@@ -1,54 +1,209 @@
+import asyncio
+import itertools
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import AsyncIterator, Callable, Iterator
+
 from fastapi import FastAPI, HTTPException, Query
+from fastapi.responses import ORJSONResponse, StreamingResponse
+import orjson
 import yt_dlp
 
-app = FastAPI(title="YouTube Search Service")
+from search_cache import SearchCache
+from search_result import SearchResult, Thumb
+
+app = FastAPI(title="YouTube Search Service", default_response_class=ORJSONResponse)
+
+# YouTube returns search results about 20 at a time, so fetching fewer saves nothing;
+# results are fetched and cached in multiples of this and sliced into pages
+SEARCH_BATCH = 20
+MAX_LIMIT = 50
+MAX_PAGE = 10
+SEARCH_WORKERS = int(os.environ.get("SEARCH_WORKERS", "4"))
+SEARCH_TIMEOUT_SECONDS = float(os.environ.get("SEARCH_TIMEOUT_SECONDS", "15"))
+
+cache = SearchCache(
+    maxsize=int(os.environ.get("SEARCH_CACHE_SIZE", "512")),
+    ttl_seconds=float(os.environ.get("SEARCH_CACHE_SECONDS", "600")),
+)
+
+
+def normalize_query(query: str) -> str:
+    """Cache key for a query: case and runs of whitespace don't change YouTube's results."""
+    return " ".join(query.lower().split())
+
+
+_YDL_OPTS = {
+    "quiet": True,
+    "no_warnings": True,
+    "extract_flat": True,
+}
+
+# Each executor thread keeps one YoutubeDL, created when the thread starts and reused for every search
+_local = threading.local()
+
+
+def _init_extractor() -> None:
+    _local.ydl = yt_dlp.YoutubeDL(_YDL_OPTS)
+
+
+executor = ThreadPoolExecutor(
+    max_workers=SEARCH_WORKERS,
+    thread_name_prefix="search",
+    initializer=_init_extractor,
+)
+
+
+def extract_entries(query: str, count: int) -> Iterator[dict]:
+    """Raw yt-dlp entries for the first count results of a YouTube search. Runs on an executor thread.
+
+    Unprocessed, so entries are yielded as each results page arrives rather than all at the end.
+    """
+    info = _local.ydl.extract_info(f"ytsearch{count}:{query}", download=False, process=False)
+    return iter(info.get("entries") or []) if info else iter(())
+
+
+def _search(query: str, count: int) -> list[SearchResult]:
+    return [SearchResult.from_entry(entry) for entry in extract_entries(query, count) if entry]
+
+
+def _page_bounds(limit: int, page: int) -> tuple[int, int, int]:
+    """(start, end, fetch depth) of a page; the depth is end rounded up to a whole batch."""
+    start = (page - 1) * limit
+    end = start + limit
+    depth = -(-end // SEARCH_BATCH) * SEARCH_BATCH
+    return start, end, depth
+
+
+def _cache_key(query: str, depth: int) -> str:
+    return f"{depth}:{query}"
+
+
+def _normalized_or_422(query: str) -> str:
+    key = normalize_query(query)
+    if not key:
+        raise HTTPException(status_code=422, detail="query must not be blank")
+    return key
+
+
+@app.on_event("shutdown")
+def stop_executor():
+    executor.shutdown(wait=False, cancel_futures=True)
 
 
 @app.get("/search")
-def search(query: str = Query(..., min_length=1)):
+async def search(
+    query: str = Query(..., min_length=1),
+    limit: int = Query(SEARCH_BATCH, ge=1, le=MAX_LIMIT),
+    page: int = Query(1, ge=1, le=MAX_PAGE),
+    thumb: Thumb = Thumb.BEST,
+):
+    normalized = _normalized_or_422(query)
+    start, end, depth = _page_bounds(limit, page)
+
+    async def compute() -> list[dict]:
+        return await asyncio.get_running_loop().run_in_executor(executor, _search, normalized, depth)
+
+    try:
+        results = await asyncio.wait_for(
+            cache.get_or_compute(_cache_key(normalized, depth), compute), SEARCH_TIMEOUT_SECONDS
+        )
+    except asyncio.TimeoutError:
+        raise HTTPException(status_code=504, detail="YouTube search timed out")
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+    return {
+        "results": [result.to_dict(thumb) for result in results[start:end]],
+        "page": page,
+        "limit": limit,
+        # A full batch means YouTube may have more; a short one means the results ran out
+        "has_more": len(results) > end or len(results) == depth,
+    }
+
+
+def _stream_entries(
+    query: str, start: int, end: int, depth: int, emit: Callable[[str, object], None], stop: threading.Event
+) -> None:
+    """Executor task feeding search_stream: emit("result", result) for each page entry as it arrives,
+    then emit("done", all results if the whole fetch depth was read, else None) or emit("error", message).
+    """
+    results = []
     try:
-        ydl_opts = {
-            "quiet": True,
-            "no_warnings": True,
-            "extract_flat": True,
-        }
-        with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-            info = ydl.extract_info(f"ytsearch20:{query}", download=False)
-            entries = info.get("entries", []) if info else []
-
-        results = []
-        for entry in entries:
+        for entry in itertools.islice(extract_entries(query, depth), end):
+            if stop.is_set():
+                return
             if not entry:
                 continue
+            result = SearchResult.from_entry(entry)
+            results.append(result)
+            if len(results) > start:
+                emit("result", result)
+    except Exception as exc:
+        emit("error", str(exc))
+        return
+    emit("done", results if len(results) == depth else None)
 
-            video_id = entry.get("id", "")
-            thumbnails = entry.get("thumbnails") or [
-                {"url": f"https://i.ytimg.com/vi/{video_id}/hqdefault.jpg"}
-            ]
-
-            view_count = entry.get("view_count")
-            if view_count is None:
-                view_count_short = ""
-            elif view_count >= 1_000_000:
-                view_count_short = f"{view_count / 1_000_000:.1f}M"
-            elif view_count >= 1_000:
-                view_count_short = f"{view_count / 1_000:.1f}K"
-            else:
-                view_count_short = str(view_count)
-
-            results.append({
-                "id": video_id,
-                "title": entry.get("title", ""),
-                "link": f"https://www.youtube.com/watch?v={video_id}",
-                "thumbnails": thumbnails,
-                "channel": {"name": entry.get("channel") or entry.get("uploader", "")},
-                "viewCount": {"short": view_count_short},
-                "duration": entry.get("duration_string", ""),
-            })
-
-        return {"results": results}
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=str(e))
+
+def _ndjson(item: dict) -> bytes:
+    return orjson.dumps(item, option=orjson.OPT_APPEND_NEWLINE)
+
+
+@app.get("/search/stream")
+async def search_stream(
+    query: str = Query(..., min_length=1),
+    limit: int = Query(SEARCH_BATCH, ge=1, le=MAX_LIMIT),
+    page: int = Query(1, ge=1, le=MAX_PAGE),
+    thumb: Thumb = Thumb.BEST,
+):
+    """Newline-delimited JSON: one result per line, sent as soon as yt-dlp yields it.
+
+    A failure part-way through ends the stream with an {"error": ...} line.
+    """
+    normalized = _normalized_or_422(query)
+    start, end, depth = _page_bounds(limit, page)
+    key = _cache_key(normalized, depth)
+    cached = cache.get(key)
+
+    async def from_cache() -> AsyncIterator[bytes]:
+        for result in cached[start:end]:
+            yield _ndjson(result.to_dict(thumb))
+
+    async def live() -> AsyncIterator[bytes]:
+        loop = asyncio.get_running_loop()
+        messages: asyncio.Queue = asyncio.Queue()
+        stop = threading.Event()
+
+        def emit(kind: str, payload: object) -> None:
+            loop.call_soon_threadsafe(messages.put_nowait, (kind, payload))
+
+        loop.run_in_executor(executor, _stream_entries, normalized, start, end, depth, emit, stop)
+        try:
+            while True:
+                try:
+                    kind, payload = await asyncio.wait_for(messages.get(), SEARCH_TIMEOUT_SECONDS)
+                except asyncio.TimeoutError:
+                    yield _ndjson({"error": "YouTube search timed out"})
+                    return
+                if kind == "result":
+                    yield _ndjson(payload.to_dict(thumb))
+                elif kind == "error":
+                    yield _ndjson({"error": payload})
+                    return
+                else:
+                    if payload is not None:
+                        cache.put(key, payload)
+                    return
+        finally:
+            # Client went away or the stream ended: the extraction stops at its next entry
+            stop.set()
+
+    return StreamingResponse(from_cache() if cached is not None else live(), media_type="application/x-ndjson")
+
+
+@app.get("/metrics")
+async def metrics():
+    return {"search_cache": cache.stats()}
 
 
 @app.get("/health")
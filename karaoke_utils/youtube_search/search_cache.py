@@ -0,0 +1,70 @@
+import asyncio
+import time
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Optional
+
+
+class SearchCache:
+    """LRU + TTL cache of search results with single-flight request coalescing.
+
+    While a key is being computed, further callers for it await that one
+    computation instead of starting their own. A caller that gives up (e.g.
+    on a timeout) does not cancel the shared computation, so its result still
+    lands in the cache. Failures are not cached.
+
+    Must be used from a single event loop.
+    """
+
+    def __init__(self, maxsize: int, ttl_seconds: float):
+        self.maxsize = maxsize
+        self.ttl_seconds = ttl_seconds
+        self._items: OrderedDict[str, tuple[float, Any]] = OrderedDict()
+        self._inflight: dict[str, asyncio.Task] = {}
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+
+    def get(self, key: str) -> Optional[Any]:
+        """Cached value for key, or None if it is missing or expired."""
+        item = self._items.get(key)
+        if item and item[0] > time.monotonic():
+            self.hits += 1
+            self._items.move_to_end(key)
+            return item[1]
+        return None
+
+    def put(self, key: str, value: Any) -> None:
+        self._items[key] = (time.monotonic() + self.ttl_seconds, value)
+        self._items.move_to_end(key)
+        while len(self._items) > self.maxsize:
+            self._items.popitem(last=False)
+
+    async def get_or_compute(self, key: str, compute: Callable[[], Awaitable[Any]]) -> Any:
+        value = self.get(key)
+        if value is not None:
+            return value
+        task = self._inflight.get(key)
+        if task is None:
+            self.misses += 1
+            task = self._inflight[key] = asyncio.ensure_future(self._fill(key, compute))
+            # Nobody may be left awaiting a failed fill; retrieve its exception so it isn't logged
+            task.add_done_callback(lambda t: t.cancelled() or t.exception())
+        else:
+            self.coalesced += 1
+        return await asyncio.shield(task)
+
+    async def _fill(self, key: str, compute: Callable[[], Awaitable[Any]]) -> Any:
+        try:
+            value = await compute()
+        finally:
+            self._inflight.pop(key, None)
+        self.put(key, value)
+        return value
+
+    def stats(self) -> dict:
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "coalesced": self.coalesced,
+            "size": len(self._items),
+        }
@@ -0,0 +1,78 @@
+from dataclasses import dataclass
+from enum import Enum
+
+from yt_dlp.utils import formatSeconds
+
+
+class Thumb(str, Enum):
+    BEST = "best"
+    SMALLEST = "smallest"
+    NONE = "none"
+
+
+@dataclass(frozen=True, slots=True)
+class SearchResult:
+    """One search hit, reduced to the fields the frontend shows.
+
+    Of yt-dlp's thumbnail list only the largest and smallest URLs are kept;
+    to_dict() picks one per request.
+    """
+
+    id: str
+    title: str
+    channel: str
+    view_count_short: str
+    duration: str
+    thumb_best: str
+    thumb_smallest: str
+
+    @classmethod
+    def from_entry(cls, entry: dict) -> "SearchResult":
+        video_id = entry.get("id", "")
+        thumbnails = [t for t in entry.get("thumbnails") or () if t.get("url")]
+        if thumbnails:
+            # yt-dlp lists thumbnails worst first, so on equal (or unknown) sizes the later one is better
+            ranked = sorted(
+                enumerate(thumbnails),
+                key=lambda item: ((item[1].get("width") or 0) * (item[1].get("height") or 0), item[0]),
+            )
+            thumb_best, thumb_smallest = ranked[-1][1]["url"], ranked[0][1]["url"]
+        else:
+            thumb_best = thumb_smallest = f"https://i.ytimg.com/vi/{video_id}/hqdefault.jpg"
+
+        duration = entry.get("duration")
+        return cls(
+            id=video_id,
+            title=entry.get("title", ""),
+            channel=entry.get("channel") or entry.get("uploader", ""),
+            view_count_short=_short_count(entry.get("view_count")),
+            duration=entry.get("duration_string") or (formatSeconds(duration) if duration else ""),
+            thumb_best=thumb_best,
+            thumb_smallest=thumb_smallest,
+        )
+
+    def to_dict(self, thumb: Thumb = Thumb.BEST) -> dict:
+        """The JSON shape the frontend reads; thumbnails holds at most the one selected URL."""
+        if thumb is Thumb.NONE:
+            thumbnails = []
+        else:
+            thumbnails = [{"url": self.thumb_best if thumb is Thumb.BEST else self.thumb_smallest}]
+        return {
+            "id": self.id,
+            "title": self.title,
+            "link": f"https://www.youtube.com/watch?v={self.id}",
+            "thumbnails": thumbnails,
+            "channel": {"name": self.channel},
+            "viewCount": {"short": self.view_count_short},
+            "duration": self.duration,
+        }
+
+
+def _short_count(view_count) -> str:
+    if view_count is None:
+        return ""
+    if view_count >= 1_000_000:
+        return f"{view_count / 1_000_000:.1f}M"
+    if view_count >= 1_000:
+        return f"{view_count / 1_000:.1f}K"
+    return str(view_count)
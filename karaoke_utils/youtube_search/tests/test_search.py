@@ -1,21 +1,31 @@
-from unittest.mock import MagicMock, patch
+import json
+import threading
+from unittest.mock import patch
+
+import pytest
 from fastapi.testclient import TestClient
 
+import main
 from main import app
+from search_cache import SearchCache
 
 client = TestClient(app)
 
-MOCK_RESULTS = {
-    "result": [
-        {
-            "id": "abc123",
-            "title": "Test Song",
-            "link": "https://www.youtube.com/watch?v=abc123",
-            "thumbnails": [{"url": "https://example.com/thumb.jpg"}],
-            "viewCount": {"text": "1,000,000 views"},
-        }
-    ]
-}
+MOCK_ENTRIES = [
+    {
+        "id": "abc123",
+        "title": "Test Song",
+        "thumbnails": [{"url": "https://example.com/thumb.jpg"}],
+        "channel": "Test Channel",
+        "view_count": 1_500_000,
+        "duration_string": "3:45",
+    }
+]
+
+
+@pytest.fixture(autouse=True)
+def fresh_cache(monkeypatch):
+    monkeypatch.setattr(main, "cache", SearchCache(maxsize=8, ttl_seconds=60))
 
 
 def test_health():
@@ -24,31 +34,139 @@ def test_health():
     assert response.json() == {"status": "ok"}
 
 
-@patch("main.VideosSearch")
-def test_search_returns_results(mock_videos_search):
-    mock_instance = MagicMock()
-    mock_instance.result.return_value = MOCK_RESULTS
-    mock_videos_search.return_value = mock_instance
-
+@patch("main.extract_entries", return_value=MOCK_ENTRIES)
+def test_search_returns_results(mock_extract):
     response = client.get("/search?query=test+song")
 
     assert response.status_code == 200
-    data = response.json()
-    assert "results" in data
-    assert len(data["results"]) == 1
-    assert data["results"][0]["id"] == "abc123"
-    mock_videos_search.assert_called_once_with("test song", limit=20)
+    results = response.json()["results"]
+    assert len(results) == 1
+    assert results[0]["id"] == "abc123"
+    assert results[0]["link"] == "https://www.youtube.com/watch?v=abc123"
+    assert results[0]["channel"] == {"name": "Test Channel"}
+    assert results[0]["viewCount"] == {"short": "1.5M"}
+    assert results[0]["duration"] == "3:45"
+    mock_extract.assert_called_once_with("test song", 20)
+
+
+@patch("main.extract_entries", return_value=[{"id": "xyz", "duration": 185}])
+def test_search_fallbacks(mock_extract):
+    result = client.get("/search?query=x").json()["results"][0]
+    assert result["thumbnails"] == [{"url": "https://i.ytimg.com/vi/xyz/hqdefault.jpg"}]
+    assert result["duration"] == "3:05"
+
+
+THUMBNAILS = [
+    {"url": "https://example.com/small.jpg", "width": 120, "height": 90},
+    {"url": "https://example.com/large.jpg", "width": 480, "height": 360},
+    {"url": "https://example.com/medium.jpg", "width": 320, "height": 180},
+]
+
+
+@pytest.mark.parametrize("thumb, expected", [
+    ("best", [{"url": "https://example.com/large.jpg"}]),
+    ("smallest", [{"url": "https://example.com/small.jpg"}]),
+    ("none", []),
+])
+def test_search_thumbnail_selection(thumb, expected):
+    with patch("main.extract_entries", return_value=[{"id": "a", "thumbnails": THUMBNAILS}]):
+        result = client.get(f"/search?query=x&thumb={thumb}").json()["results"][0]
+    assert result["thumbnails"] == expected
+
+
+def test_search_unsized_thumbnails_prefer_the_last():
+    thumbnails = [{"url": "https://example.com/1.jpg"}, {"url": "https://example.com/2.jpg"}]
+    with patch("main.extract_entries", return_value=[{"id": "a", "thumbnails": thumbnails}]):
+        result = client.get("/search?query=x").json()["results"][0]
+    assert result["thumbnails"] == [{"url": "https://example.com/2.jpg"}]
+
+
+def test_search_rejects_unknown_thumb():
+    assert client.get("/search?query=x&thumb=huge").status_code == 422
+
+
+def _entries(count):
+    return [{"id": f"id{i}", "title": f"Song {i}"} for i in range(count)]
+
+
+@patch("main.extract_entries", side_effect=lambda query, count: iter(_entries(count)))
+def test_search_pages_share_one_fetch(mock_extract):
+    first = client.get("/search?query=song&limit=5").json()
+    second = client.get("/search?query=song&limit=5&page=2").json()
+
+    assert [r["id"] for r in first["results"]] == ["id0", "id1", "id2", "id3", "id4"]
+    assert [r["id"] for r in second["results"]] == ["id5", "id6", "id7", "id8", "id9"]
+    assert second["page"] == 2 and second["has_more"]
+    mock_extract.assert_called_once_with("song", 20)
+
+
+@patch("main.extract_entries", return_value=_entries(12))
+def test_search_last_page(mock_extract):
+    data = client.get("/search?query=song&limit=10&page=2").json()
+    assert [r["id"] for r in data["results"]] == ["id10", "id11"]
+    assert not data["has_more"]
+
+
+def test_search_rejects_out_of_range_paging():
+    assert client.get("/search?query=song&limit=0").status_code == 422
+    assert client.get("/search?query=song&limit=500").status_code == 422
+    assert client.get("/search?query=song&page=0").status_code == 422
+
+
+def _stream_lines(url):
+    response = client.get(url)
+    assert response.status_code == 200
+    assert response.headers["content-type"] == "application/x-ndjson"
+    return [json.loads(line) for line in response.text.splitlines()]
+
+
+@patch("main.extract_entries", side_effect=lambda query, count: iter(_entries(count)))
+def test_search_stream_emits_one_result_per_line(mock_extract):
+    lines = _stream_lines("/search/stream?query=song&limit=3&page=2")
+    assert [line["id"] for line in lines] == ["id3", "id4", "id5"]
+    mock_extract.assert_called_once_with("song", 20)
+
 
+@patch("main.extract_entries", side_effect=lambda query, count: iter(_entries(count)))
+def test_search_stream_fills_and_uses_the_cache(mock_extract):
+    streamed = _stream_lines("/search/stream?query=song")
+    assert len(streamed) == 20
 
-@patch("main.VideosSearch")
-def test_search_empty_results(mock_videos_search):
-    mock_instance = MagicMock()
-    mock_instance.result.return_value = {"result": []}
-    mock_videos_search.return_value = mock_instance
+    assert client.get("/search?query=song").json()["results"] == streamed
+    assert _stream_lines("/search/stream?query=song&limit=2") == streamed[:2]
+    mock_extract.assert_called_once()
 
+
+def test_search_stream_reports_errors_inline(monkeypatch):
+    def failing(query, count):
+        yield {"id": "first"}
+        raise RuntimeError("network error")
+
+    monkeypatch.setattr(main, "extract_entries", failing)
+    lines = _stream_lines("/search/stream?query=song")
+    assert lines == [
+        {**lines[0], "id": "first"},
+        {"error": "network error"},
+    ]
+
+
+@patch("main.extract_entries", return_value=[])
+def test_search_empty_results(mock_extract):
     response = client.get("/search?query=nothing")
     assert response.status_code == 200
-    assert response.json() == {"results": []}
+    assert response.json()["results"] == []
+    assert not response.json()["has_more"]
+
+
+@patch("main.extract_entries", return_value=MOCK_ENTRIES)
+def test_search_is_cached_by_normalized_query(mock_extract):
+    client.get("/search?query=Test+Song")
+    client.get("/search?query=  test   SONG ")
+
+    mock_extract.assert_called_once_with("test song", 20)
+    assert client.get("/metrics").json()["search_cache"] == {
+        "hits": 1, "misses": 1, "coalesced": 0, "size": 1,
+    }
 
 
 def test_search_missing_query():
@@ -61,10 +179,46 @@ def test_search_empty_query():
     assert response.status_code == 422
 
 
-@patch("main.VideosSearch")
-def test_search_upstream_error(mock_videos_search):
-    mock_videos_search.side_effect = Exception("network error")
+def test_search_blank_query():
+    response = client.get("/search?query=%20%20")
+    assert response.status_code == 422
+
 
+@patch("main.extract_entries", side_effect=Exception("network error"))
+def test_search_upstream_error(mock_extract):
     response = client.get("/search?query=test")
     assert response.status_code == 500
     assert "network error" in response.json()["detail"]
+    # Failures are not cached
+    client.get("/search?query=test")
+    assert mock_extract.call_count == 2
+
+
+def test_search_times_out(monkeypatch):
+    release = threading.Event()
+    monkeypatch.setattr(main, "SEARCH_TIMEOUT_SECONDS", 0.05)
+    monkeypatch.setattr(main, "extract_entries", lambda query, count: release.wait(5) and [])
+    try:
+        response = client.get("/search?query=slow")
+    finally:
+        release.set()
+    assert response.status_code == 504
+
+
+def test_extractor_is_reused_per_worker_thread():
+    created = []
+
+    class FakeYoutubeDL:
+        def __init__(self, opts):
+            created.append(self)
+
+        def extract_info(self, url, download, process):
+            assert url == "ytsearch20:song"
+            assert not process
+            return {"entries": iter(MOCK_ENTRIES)}
+
+    with patch("main.yt_dlp.YoutubeDL", FakeYoutubeDL):
+        main._init_extractor()
+        assert list(main.extract_entries("song", 20)) == MOCK_ENTRIES
+        assert list(main.extract_entries("song", 20)) == MOCK_ENTRIES
+    assert len(created) == 1
@@ -0,0 +1,107 @@
+import asyncio
+
+import pytest
+
+from search_cache import SearchCache
+
+
+def _value(value):
+    async def compute():
+        return value
+    return compute
+
+
+def test_hit_after_miss():
+    cache = SearchCache(maxsize=4, ttl_seconds=60)
+    calls = []
+
+    async def compute():
+        calls.append(1)
+        return ["result"]
+
+    async def run():
+        assert await cache.get_or_compute("q", compute) == ["result"]
+        assert await cache.get_or_compute("q", compute) == ["result"]
+
+    asyncio.run(run())
+    assert len(calls) == 1
+    assert cache.stats() == {"hits": 1, "misses": 1, "coalesced": 0, "size": 1}
+
+
+def test_entries_expire():
+    cache = SearchCache(maxsize=4, ttl_seconds=0)
+
+    async def run():
+        await cache.get_or_compute("q", _value(1))
+        return await cache.get_or_compute("q", _value(2))
+
+    assert asyncio.run(run()) == 2
+    assert cache.misses == 2
+
+
+def test_least_recently_used_is_evicted():
+    cache = SearchCache(maxsize=2, ttl_seconds=60)
+
+    async def run():
+        await cache.get_or_compute("a", _value("a"))
+        await cache.get_or_compute("b", _value("b"))
+        await cache.get_or_compute("a", _value("unused"))     # a is now most recent
+        await cache.get_or_compute("c", _value("c"))
+        return (
+            await cache.get_or_compute("a", _value("new a")),
+            await cache.get_or_compute("b", _value("new b")),
+        )
+
+    assert asyncio.run(run()) == ("a", "new b")
+
+
+def test_concurrent_identical_queries_compute_once():
+    cache = SearchCache(maxsize=4, ttl_seconds=60)
+    calls = []
+
+    async def slow_compute():
+        calls.append(1)
+        await asyncio.sleep(0.05)
+        return ["shared"]
+
+    async def run():
+        return await asyncio.gather(*(cache.get_or_compute("q", slow_compute) for _ in range(8)))
+
+    assert asyncio.run(run()) == [["shared"]] * 8
+    assert len(calls) == 1
+    assert cache.stats()["misses"] == 1
+    assert cache.stats()["coalesced"] == 7
+
+
+def test_waiters_see_the_leaders_error():
+    cache = SearchCache(maxsize=4, ttl_seconds=60)
+
+    async def failing_compute():
+        await asyncio.sleep(0.01)
+        raise RuntimeError("boom")
+
+    async def run():
+        return await asyncio.gather(
+            *(cache.get_or_compute("q", failing_compute) for _ in range(3)), return_exceptions=True
+        )
+
+    errors = asyncio.run(run())
+    assert [str(error) for error in errors] == ["boom"] * 3
+    assert cache.stats()["size"] == 0
+
+
+def test_timed_out_caller_does_not_cancel_the_shared_computation():
+    cache = SearchCache(maxsize=4, ttl_seconds=60)
+
+    async def slow_compute():
+        await asyncio.sleep(0.05)
+        return "late"
+
+    async def run():
+        with pytest.raises(asyncio.TimeoutError):
+            await asyncio.wait_for(cache.get_or_compute("q", slow_compute), 0.01)
+        await asyncio.sleep(0.1)
+        return await cache.get_or_compute("q", _value("unused"))
+
+    assert asyncio.run(run()) == "late"
+    assert cache.hits == 1
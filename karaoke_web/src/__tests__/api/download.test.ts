@@ -0,0 +1,46 @@
+/**
+ * @jest-environment node
+ */
+import { NextRequest } from "next/server";
+import { GET } from "@/app/api/download/route";
+
+const mockFetch = jest.fn();
+global.fetch = mockFetch;
+
+function makeRequest(headers: Record<string, string> = {}) {
+  return new NextRequest("http://localhost:3000/api/download?type=karaoke&job_id=job_1", { headers });
+}
+
+describe("GET /api/download", () => {
+  beforeEach(() => mockFetch.mockClear());
+
+  it("returns 400 when job_id is missing", async () => {
+    const res = await GET(new NextRequest("http://localhost:3000/api/download?type=karaoke"));
+    expect(res.status).toBe(400);
+  });
+
+  it("forwards Range and passes the partial response through", async () => {
+    mockFetch.mockResolvedValue(
+      new Response("data", {
+        status: 206,
+        headers: { "Content-Type": "video/mp4", "Content-Range": "bytes 3-6/7", "Accept-Ranges": "bytes" },
+      })
+    );
+    const res = await GET(makeRequest({ Range: "bytes=3-" }));
+
+    const [url, init] = mockFetch.mock.calls[0];
+    expect(url).toBe("http://localhost:8003/file/job_1");
+    expect(init.headers.get("range")).toBe("bytes=3-");
+    expect(res.status).toBe(206);
+    expect(res.headers.get("content-range")).toBe("bytes 3-6/7");
+    expect(res.headers.get("accept-ranges")).toBe("bytes");
+  });
+
+  it("passes 304 Not Modified through", async () => {
+    mockFetch.mockResolvedValue(new Response(null, { status: 304, headers: { ETag: '"abc"' } }));
+    const res = await GET(makeRequest({ "If-None-Match": '"abc"' }));
+    expect(mockFetch.mock.calls[0][1].headers.get("if-none-match")).toBe('"abc"');
+    expect(res.status).toBe(304);
+    expect(res.headers.get("etag")).toBe('"abc"');
+  });
+});
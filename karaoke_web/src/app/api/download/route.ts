@@ -3,6 +3,26 @@ import { NextRequest, NextResponse } from "next/server";
 const KARAOKE_URL = process.env.KARAOKE_URL ?? "http://localhost:8003";
 const MP3_DOWNLOAD_URL = process.env.MP3_DOWNLOAD_URL ?? "http://localhost:8002";
 
+const FORWARDED_REQUEST_HEADERS = ["range", "if-range", "if-none-match"];
+const PASSED_RESPONSE_HEADERS = [
+  "content-type",
+  "content-disposition",
+  "content-length",
+  "content-range",
+  "accept-ranges",
+  "etag",
+  "last-modified",
+];
+
+function passThrough(upstream: Headers): Headers {
+  const headers = new Headers();
+  for (const name of PASSED_RESPONSE_HEADERS) {
+    const value = upstream.get(name);
+    if (value) headers.set(name, value);
+  }
+  return headers;
+}
+
 export async function GET(req: NextRequest) {
   const { searchParams } = req.nextUrl;
   const type = searchParams.get("type");
@@ -21,23 +41,29 @@ export async function GET(req: NextRequest) {
     upstreamUrl = `${MP3_DOWNLOAD_URL}/file/${jobId}`;
   }
 
+  // Forward range and conditional headers so seeking and resumed downloads only move the bytes asked for
+  const forwarded = new Headers();
+  for (const name of FORWARDED_REQUEST_HEADERS) {
+    const value = req.headers.get(name);
+    if (value) forwarded.set(name, value);
+  }
+
   try {
-    const upstream = await fetch(upstreamUrl, { cache: "no-store" });
+    const upstream = await fetch(upstreamUrl, { cache: "no-store", headers: forwarded });
+    if (upstream.status === 304 || upstream.status === 416) {
+      return new NextResponse(null, { status: upstream.status, headers: passThrough(upstream.headers) });
+    }
     if (!upstream.ok) {
       const err = await upstream.json().catch(() => ({}));
       return NextResponse.json({ error: err.detail ?? "File not available" }, { status: upstream.status });
     }
 
-    const contentType = upstream.headers.get("content-type") ?? "application/octet-stream";
+    const headers = passThrough(upstream.headers);
     const ext = type === "karaoke" ? "mp4" : "mp3";
-    const contentDisposition = upstream.headers.get("content-disposition") ?? `attachment; filename="${jobId}.${ext}"`;
-
-    return new NextResponse(upstream.body, {
-      headers: {
-        "Content-Type": contentType,
-        "Content-Disposition": contentDisposition,
-      },
-    });
+    if (!headers.has("Content-Type")) headers.set("Content-Type", "application/octet-stream");
+    if (!headers.has("Content-Disposition")) headers.set("Content-Disposition", `attachment; filename="${jobId}.${ext}"`);
+
+    return new NextResponse(upstream.body, { status: upstream.status, headers });
   } catch {
     return NextResponse.json({ error: "Internal error" }, { status: 500 });
   }
@@ -12,7 +12,12 @@ export async function POST(req: NextRequest) {
     const upstream = await fetch(`${KARAOKE_URL}/karaoke`, {
       method: "POST",
       headers: { "Content-Type": "application/json" },
-      body: JSON.stringify({ video_url: body.video_url }),
+      body: JSON.stringify({
+        video_url: body.video_url,
+        ...(body.output ? { output: body.output } : {}),
+        ...(body.engine ? { engine: body.engine } : {}),
+        ...(body.quality ? { quality: body.quality } : {}),
+      }),
     });
 
     const data = await upstream.json();
@@ -20,11 +20,15 @@ export async function startMp3Download(videoUrl: string, videoTitle?: string): P
   return res.json();
 }
 
-export async function startKaraoke(videoUrl: string): Promise<{ job_id: string }> {
+export async function startKaraoke(
+  videoUrl: string,
+  engine?: "demucs" | "fast",
+  quality?: "fast" | "balanced" | "best",
+): Promise<{ job_id: string }> {
   const res = await fetch("/api/karaoke", {
     method: "POST",
     headers: { "Content-Type": "application/json" },
-    body: JSON.stringify({ video_url: videoUrl }),
+    body: JSON.stringify({ video_url: videoUrl, ...(engine ? { engine } : {}), ...(quality ? { quality } : {}) }),
   });
   if (!res.ok) {
     const err = await res.json().catch(() => ({}));
@@ -21,5 +21,11 @@ export interface JobStatusResponse {
   job_id: string;
   status: JobStatus;
   progress_message: string;
+  queue_position?: number | null;
+  progress?: number | null;
+  eta_seconds?: number | null;
+  downloaded_bytes?: number | null;
+  total_bytes?: number | null;
+  speed?: number | null;  // bytes per second while downloading
   error: string | null;
 }